@@ -0,0 +1,212 @@
+"""Columnar decoding of query results into NumPy arrays.
+
+NumPy is an optional dependency: it is only imported the first time a
+columnar fetch is requested.
+
+"""
+from psycopg2ct._impl import libpq
+from psycopg2ct._impl import typecasts
+
+
+# Default dtypes for the types which are decoded with a vectorized
+# conversion of the raw values. Other types produce object arrays filled
+# using the cursor typecasters.
+_default_dtypes = {
+    16: 'bool',                 # bool
+    20: 'int64',                # int8
+    21: 'int16',                # int2
+    23: 'int32',                # int4
+    26: 'uint32',               # oid
+    700: 'float32',             # float4
+    701: 'float64',             # float8
+    1082: 'datetime64[D]',      # date
+    1114: 'datetime64[us]',     # timestamp
+    1184: 'datetime64[us]',     # timestamptz, converted to UTC
+}
+
+TIMESTAMPTZ_OID = 1184
+
+
+def _numpy():
+    import numpy
+    return numpy
+
+
+def column_dtypes(cursor, dtypes=None):
+    """Return the list of NumPy dtypes for the columns of the current result.
+
+    `dtypes` is an optional mapping from column name or index to a dtype
+    overriding the default one for that column.
+
+    """
+    numpy = _numpy()
+    rv = []
+    for i, column in enumerate(cursor.description):
+        dtype = None
+        if dtypes:
+            dtype = dtypes.get(column.name, dtypes.get(i))
+        if dtype is None:
+            dtype = _default_dtypes.get(column.type_code, object)
+        rv.append(numpy.dtype(dtype))
+    return rv
+
+
+def fetch_columns(cursor, start, stop, dtypes):
+    """Decode the rows start..stop of the cursor result column by column.
+
+    `dtypes` is the list returned by column_dtypes(). Return a list with an
+    array for each column: NULLs are masked in integer and boolean arrays,
+    NaN in float arrays, NaT in datetime arrays and None in object arrays.
+    The infinite dates and timestamps are NaT too.
+
+    """
+    pgres = cursor._pgres
+    row_nums = xrange(start, stop)
+    arrays = []
+    for i, dtype in enumerate(dtypes):
+        raw = []
+        nulls = []
+        for row_num in row_nums:
+            # PQgetvalue will return an empty string for null values,
+            # so check with PQgetisnull if the value is really null
+            val = libpq.PQgetvalue(pgres, row_num, i)
+            if not val and libpq.PQgetisnull(pgres, row_num, i):
+                val = None
+            raw.append(val)
+            nulls.append(val is None)
+
+        arrays.append(_decode_column(
+            cursor, i, dtype, raw, nulls, pgres, start))
+    return arrays
+
+
+def to_structured(cursor, arrays):
+    """Combine the column arrays of a result in a masked structured array.
+
+    The array fields are named after the result columns; NULLs are masked.
+
+    """
+    numpy = _numpy()
+    names = [column.name for column in cursor.description]
+    n = arrays and len(arrays[0]) or 0
+    data = numpy.empty(n, dtype=[(name, a.dtype)
+        for name, a in zip(names, arrays)])
+    mask = numpy.zeros(n, dtype=[(name, bool) for name in names])
+    for name, a in zip(names, arrays):
+        data[name] = numpy.ma.getdata(a)
+        mask[name] = numpy.ma.getmaskarray(a)
+    return numpy.ma.array(data, mask=mask)
+
+
+def to_dict(cursor, arrays):
+    """Return a dict mapping the result column names to the column arrays."""
+    return dict(zip([column.name for column in cursor.description], arrays))
+
+
+def _decode_column(cursor, i, dtype, raw, nulls, pgres, start):
+    numpy = _numpy()
+    kind = dtype.kind
+    has_nulls = True in nulls
+
+    if kind in 'iu':
+        if has_nulls:
+            raw = [v if v is not None else '0' for v in raw]
+        values = numpy.array(raw, dtype='S').astype(dtype)
+        return numpy.ma.array(values, mask=nulls, shrink=True)
+
+    if kind == 'b':
+        if has_nulls:
+            raw = [v if v is not None else 'f' for v in raw]
+        values = numpy.array(raw, dtype='S1') == 't'
+        return numpy.ma.array(values, mask=nulls, shrink=True)
+
+    if kind == 'f':
+        if has_nulls:
+            raw = [v if v is not None else 'NaN' for v in raw]
+        return numpy.array(raw, dtype='S').astype(dtype)
+
+    if kind == 'M':
+        if cursor.description[i].type_code == TIMESTAMPTZ_OID:
+            return _decode_timestamptz(numpy, dtype, raw)
+        return numpy.array(map(_datetime_value, raw), dtype=dtype)
+
+    if kind in 'SU':
+        if has_nulls:
+            raw = [v if v is not None else '' for v in raw]
+        if kind == 'U':
+            enc = cursor._conn._py_enc
+            raw = [v.decode(enc) for v in raw]
+        return numpy.array(raw, dtype=dtype)
+
+    # Everything else goes through the regular typecasters
+    cast = cursor._casts[i]
+    values = numpy.empty(len(raw), dtype=dtype)
+    for j, val in enumerate(raw):
+        if val is not None:
+            length = libpq.PQgetlength(pgres, start + j, i)
+            val = typecasts.typecast(cast, val, length, cursor)
+        values[j] = val
+    return values
+
+
+def _datetime_value(val):
+    """Return a date or timestamp in a format NumPy can parse.
+
+    NULL and infinite values become NaT; BC dates, such as `0044-03-15 BC`,
+    are converted to the astronomical year numbering used by NumPy, in which
+    1 BC is the year 0.
+
+    """
+    if val is None or val == 'infinity' or val == '-infinity':
+        return 'NaT'
+    if val.endswith(' BC'):
+        pos = val.index('-')
+        year = int(val[:pos]) - 1
+        return (year and '-%04d' % year or '0000') + val[pos:-3]
+    return val
+
+
+def _decode_timestamptz(numpy, dtype, raw):
+    """Convert timestamptz values to UTC datetime64 values.
+
+    The values are in the format `2011-01-02 10:20:30.123456+01:30`: the
+    local part is parsed by NumPy and the UTC offset is subtracted.
+
+    """
+    local = []
+    offsets = []
+    seen = {}
+    for val in raw:
+        val = _datetime_value(val)
+        if val == 'NaT':
+            local.append(val)
+            offsets.append(0)
+            continue
+
+        # skip the date part, which contains '-' too
+        pos = max(val.rfind('+', 10), val.rfind('-', 10))
+        if pos < 0:
+            local.append(val)
+            offsets.append(0)
+            continue
+
+        local.append(val[:pos])
+        tz = val[pos:]
+        try:
+            offsets.append(seen[tz])
+        except KeyError:
+            parts = tz[1:].split(':')
+            secs = int(parts[0]) * 3600
+            if len(parts) > 1:
+                secs += int(parts[1]) * 60
+            if len(parts) > 2:
+                secs += int(parts[2])
+            if tz[0] == '-':
+                secs = -secs
+            offsets.append(seen.setdefault(tz, secs))
+
+    values = numpy.array(local, dtype=dtype)
+    if seen:
+        offsets = numpy.array(offsets, dtype='timedelta64[s]')
+        values = (values - offsets).astype(dtype)
+    return values
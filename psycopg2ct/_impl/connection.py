@@ -1,3 +1,4 @@
+import re
 import threading
 import weakref
 from functools import wraps
@@ -28,6 +29,43 @@ for k, v in _isolevels.items():
 
 del k, v
 
+# Statements changing the state of the session beyond the transaction,
+# detected in the queries executed. The group names are the kind of state
+# touched; the detection errs on the side of false positives. The
+# statements are looked for after the start of the query or a ';', and
+# any whitespace and comment (not nested) following it.
+_session_re = re.compile(r"""
+    (?:^|;)(?:\s|--[^\n]*(?:\n|$)|/\*(?:[^*]|\*(?!/))*\*/)*(?:
+        (?P<guc>(?:SET\s+(?!LOCAL\b|TRANSACTION\b|CONSTRAINTS\b)|RESET\b))
+      | (?P<prepared>PREPARE\s+(?!TRANSACTION\b))
+      | (?P<listen>LISTEN\b)
+      | (?P<cursor>DECLARE\b[^;]*?\bWITH\s+HOLD\b)
+      | (?P<temp>CREATE\s+(?:(?:GLOBAL|LOCAL)\s+)?TEMP(?:ORARY)?\b)
+      | (?P<guc_trans>SET\s+LOCAL\b|RELEASE\b
+            | ROLLBACK\s+(?:(?:WORK|TRANSACTION)\s+)?TO\b)
+    )
+    | (?P<guc_func>\bset_config\s*\()
+    | (?P<lock>\bpg_(?:try_)?advisory_lock(?:_shared)?\s*\()
+    """, re.I | re.X)
+
+# The statements undoing each kind of session state.
+_session_reset = [
+    ('lock', 'SELECT pg_advisory_unlock_all()'),
+    ('guc', 'RESET ALL'),
+    ('guc', 'SET SESSION AUTHORIZATION DEFAULT'),
+    ('cursor', 'CLOSE ALL'),
+    ('prepared', 'DEALLOCATE ALL'),
+    ('temp', 'DISCARD TEMP'),
+    ('listen', 'UNLISTEN *'),
+]
+
+# The parameters the server reports to the client on change: their value
+# is known without asking it.
+_reported_gucs = dict((name.lower(), name) for name in [
+    'application_name', 'client_encoding', 'DateStyle', 'integer_datetimes',
+    'IntervalStyle', 'is_superuser', 'server_encoding', 'server_version',
+    'session_authorization', 'standard_conforming_strings', 'TimeZone'])
+
 _green_callback = None
 
 
@@ -84,6 +122,10 @@ class Connection(object):
     ProgrammingError = exceptions.ProgrammingError
     Warning = exceptions.Warning
 
+    #: If True the BEGIN starting a transaction is sent together with the
+    #: first query executed by a cursor, saving a round trip.
+    piggyback_begin = False
+
     def __init__(self, dsn, async=False):
 
         self.dsn = dsn
@@ -107,6 +149,16 @@ class Connection(object):
         self._async = async
         self._async_status = consts.ASYNC_DONE
         self._async_cursor = None
+        self._in_copy = False
+        self._copy_steps = None
+
+        # The kinds of session state changed since the last reset
+        self._session_state = set()
+
+        # The values of the configuration parameters known to the client,
+        # and whether they may be reverted by the end of the transaction
+        self._gucs = {}
+        self._gucs_in_trans = False
 
         self_ref = weakref.ref(self)
         self._notice_callback = libpq.PQnoticeProcessor(
@@ -147,6 +199,21 @@ class Connection(object):
 
         libpq.PQsetNoticeProcessor(self._pgconn, self._notice_callback, None)
 
+    def _async_to_sync(self):
+        """Turn an async connection, once established, into a sync one.
+
+        This allows to open several connections concurrently using poll()
+        and then use them as if they were created by a blocking connect.
+
+        """
+        if self.status != consts.STATUS_READY or self._async_cursor:
+            raise exceptions.InterfaceError(
+                "the asynchronous connection is not ready")
+
+        util.pq_set_non_blocking(self._pgconn, 0, True)
+        self._async = False
+        self._autocommit = False
+
     def __del__(self):
         self._close()
 
@@ -176,9 +243,102 @@ class Connection(object):
             self._mark += 1
             self._autocommit = False
             self._tpc_xid = None
+            self._session_state.discard('guc')
+            self._gucs.clear()
+            self._restore_setup()
+
+    def _track_session(self, query):
+        """Record the kinds of session state changed by a query."""
+        for m in _session_re.finditer(query):
+            kind = m.lastgroup
+            if kind == 'guc_func':
+                kind = 'guc'
+            if kind in ('guc', 'guc_trans'):
+                self._gucs.clear()
+                self._gucs_in_trans = True
+            if kind != 'guc_trans':
+                self._session_state.add(kind)
+
+    def _gucs_cacheable(self):
+        # a value seen inside a transaction may be reverted by a ROLLBACK
+        # (TO SAVEPOINT) or be a SET LOCAL: only cache it outside
+        return libpq.PQtransactionStatus(self._pgconn) \
+            == consts.TRANSACTION_STATUS_IDLE
+
+    def _reset_session(self, mode='tracked'):
+        """Bring the session back to a clean state in a single round trip.
+
+        With mode 'tracked' only the state changes detected are undone (if
+        there is none and no transaction is open no query is sent); 'all'
+        runs all the reset statements regardless of what was detected and
+        'discard' runs DISCARD ALL, which can't be sent together with other
+        statements, so it takes one more round trip if a transaction must be
+        aborted first.
+
+        """
+        if mode not in ('tracked', 'all', 'discard'):
+            raise ValueError("bad session reset mode: %r" % mode)
+
+        with self._lock:
+            statements = []
+            if libpq.PQtransactionStatus(self._pgconn) \
+                    != consts.TRANSACTION_STATUS_IDLE:
+                statements.append('ABORT')
+                self._mark += 1
+
+            if mode == 'discard':
+                if statements:
+                    self._execute_command('ABORT')
+                statements = ['DISCARD ALL']
+            else:
+                for kind, stmt in _session_reset:
+                    if mode == 'all' or kind in self._session_state:
+                        statements.append(stmt)
+
+            if statements:
+                self._gucs.clear()
+                query = '; '.join(statements)
+                if _green_callback:
+                    pgres = self._execute_green(query)
+                else:
+                    pgres = libpq.PQexec(self._pgconn, query)
+
+                if not pgres:
+                    raise self._create_exception()
+                try:
+                    # the last statement may be the advisory locks release
+                    if libpq.PQresultStatus(pgres) not in (
+                            libpq.PGRES_COMMAND_OK, libpq.PGRES_TUPLES_OK):
+                        raise self._create_exception(pgres=pgres)
+                finally:
+                    libpq.PQclear(pgres)
+
+                if 'RESET ALL' in statements or 'DISCARD ALL' in statements:
+                    self._restore_setup()
+
+            self.status = consts.STATUS_READY
+            self._autocommit = False
+            self._tpc_xid = None
+            self._session_state.clear()
 
     def _get_guc(self, name):
-        """Return the value of a configuration parameter."""
+        """Return the value of a configuration parameter.
+
+        The value is only asked to the server the first time and after a
+        change the client can't know. Values read inside a transaction are
+        not cached.
+        """
+        key = name.lower()
+        if key in _reported_gucs:
+            rv = libpq.PQparameterStatus(self._pgconn, _reported_gucs[key])
+            if rv is not None:
+                return rv
+
+        try:
+            return self._gucs[key]
+        except KeyError:
+            pass
+
         with self._lock:
             query = 'SHOW %s' % name
 
@@ -191,13 +351,30 @@ class Connection(object):
                 raise exceptions.OperationalError("can't fetch %s" % name)
             rv = libpq.PQgetvalue(pgres, 0, 0)
             libpq.PQclear(pgres)
+            if self._gucs_cacheable():
+                self._gucs[key] = rv
             return rv
 
     def _set_guc(self, name, value):
-        """Set the value of a configuration parameter."""
-        if value.lower() != 'default':
-            value = util.quote_string(self, value)
-        self._execute_command('SET %s TO %s' % (name, value))
+        """Set the value of a configuration parameter.
+
+        Nothing is sent to the server if the parameter is known to have
+        already the value.
+        """
+        key = name.lower()
+        if value.lower() == 'default':
+            self._execute_command('SET %s TO default' % name)
+            self._gucs.pop(key, None)
+        else:
+            if self._gucs.get(key) == value.lower():
+                return
+            self._execute_command(
+                'SET %s TO %s' % (name, util.quote_string(self, value)))
+            if self._gucs_cacheable():
+                self._gucs[key] = value.lower()
+            else:
+                self._gucs.pop(key, None)
+        self._session_state.add('guc')
 
     def _set_guc_onoff(self, name, value):
         """Set the value of a configuration parameter to a boolean.
@@ -285,6 +462,17 @@ class Connection(object):
         return libpq.PQtransactionStatus(self._pgconn)
 
     def cursor(self, name=None, cursor_factory=Cursor, withhold=False):
+        if name and self._async:
+            raise exceptions.ProgrammingError(
+                "asynchronous connections cannot produce named cursors: "
+                "use psycopg2ct.aio.AsyncCursor")
+
+        return self._cursor(name, cursor_factory, withhold)
+
+    def _cursor(self, name=None, cursor_factory=Cursor, withhold=False):
+        # Also creates named cursors on async connections: their fetch
+        # methods only return the records already received, so they are
+        # only handed out to aio.AsyncCursor, which prefetch()es the rest.
         cur = cursor_factory(self, name)
 
         if not isinstance(cur, Cursor):
@@ -299,10 +487,6 @@ class Connection(object):
                 raise exceptions.ProgrammingError(
                     "withhold=True can be specified only for named cursors")
 
-        if name and self._async:
-            raise exceptions.ProgrammingError(
-                "asynchronous connections cannot produce named cursors")
-
         cur._mark = self._mark
         return cur
 
@@ -320,7 +504,7 @@ class Connection(object):
         if self.status != consts.STATUS_READY:
             return True
 
-        if self._async_cursor is not None:
+        if self._async_cursor is not None or self._copy_steps is not None:
             return True
 
         return False
@@ -427,6 +611,11 @@ class Connection(object):
 
         if self.status in (consts.STATUS_READY, consts.STATUS_BEGIN,
                            consts.STATUS_PREPARED):
+            if self._in_copy:
+                return self._poll_copy()
+            if self._copy_steps is not None:
+                return self._poll_copy_steps()
+
             res = self._poll_query()
 
             if res == consts.POLL_OK and self._async and self._async_cursor:
@@ -445,6 +634,10 @@ class Connection(object):
                     curs._pq_fetch()
                 finally:
                     self._async_cursor = None
+
+                # a COPY started: transfer the data
+                if self._copy_steps is not None:
+                    return self._poll_copy_steps()
             return res
 
         return consts.POLL_ERROR
@@ -493,6 +686,31 @@ class Connection(object):
 
         return ret
 
+    def _poll_copy(self):
+        """Poll the connection while a green COPY is waiting for the socket
+
+        Ask to wait for the socket to become readable, then read the data
+        available so that the copy can proceed. When waiting to write, flush
+        the data until all of it is sent.
+
+        """
+        if self._async_status == consts.ASYNC_READ:
+            self._async_status = consts.ASYNC_DONE
+            return consts.POLL_READ
+
+        if self._async_status == consts.ASYNC_WRITE:
+            flush = libpq.PQflush(self._pgconn)
+            if flush == 1:
+                return consts.POLL_WRITE
+            elif flush == -1:
+                raise self._create_exception()
+            self._async_status = consts.ASYNC_DONE
+            return consts.POLL_OK
+
+        if not libpq.PQconsumeInput(self._pgconn):
+            raise self._create_exception()
+        return consts.POLL_OK
+
     def _poll_advance_write(self, flush):
         """Advance to the next state after an attempt of flushing output"""
         if flush == 0:
@@ -582,14 +800,38 @@ class Connection(object):
             datestyle = libpq.PQparameterStatus(self._pgconn, 'DateStyle')
             if not datestyle or not datestyle.startswith('ISO'):
                 self.status = consts.STATUS_DATESTYLE
-                self._set_guc('datestyle', 'ISO')
+                self._execute_command("SET DATESTYLE TO 'ISO'")
+                self.status = consts.STATUS_READY
 
             self._closed = False
 
-    def _begin_transaction(self):
+    def _restore_setup(self):
+        """Redo the setup undone by a RESET ALL or DISCARD ALL.
+
+        The datestyle is forced to ISO again, without recording it as a
+        change of the session, and the client encoding, possibly reverted
+        to the default, is read again.
+        """
+        self._get_encoding()
+        datestyle = libpq.PQparameterStatus(self._pgconn, 'DateStyle')
+        if not datestyle or not datestyle.startswith('ISO'):
+            self._execute_command("SET DATESTYLE TO 'ISO'")
+
+    def _begin_transaction(self, piggyback=False):
+        """Start a transaction if required.
+
+        If 'piggyback' is True and the connection allows it, don't send the
+        BEGIN but return it, to be prepended to the next query; else return
+        an empty string.
+
+        """
         if self.status == consts.STATUS_READY and not self._autocommit:
+            if piggyback and self.piggyback_begin:
+                self.status = consts.STATUS_BEGIN
+                return 'BEGIN; '
             self._execute_command('BEGIN')
             self.status = consts.STATUS_BEGIN
+        return ''
 
     def _execute_command(self, command):
         with self._lock:
@@ -612,15 +854,55 @@ class Connection(object):
         self._execute_command(cmd)
         self._mark += 1
 
-    def _execute_green(self, query):
+    def _describe(self, query):
+        """Return the result describing the columns of a query.
+
+        The query is not executed: it is prepared as the unnamed statement,
+        which is then described.
+
+        """
+        with self._lock:
+            if _green_callback:
+                pgres = self._send_green(libpq.PQsendPrepare,
+                    ('', query, 0, None))
+            else:
+                pgres = libpq.PQprepare(self._pgconn, '', query, 0, None)
+            self._check_command(pgres)
+            libpq.PQclear(pgres)
+
+            if _green_callback:
+                pgres = self._send_green(libpq.PQsendDescribePrepared, ('',))
+            else:
+                pgres = libpq.PQdescribePrepared(self._pgconn, '')
+            self._check_command(pgres)
+            return pgres
+
+    def _check_command(self, pgres):
+        """Raise the error of a failed command, freeing its result."""
+        if not pgres:
+            raise self._create_exception()
+        if libpq.PQresultStatus(pgres) != libpq.PGRES_COMMAND_OK:
+            try:
+                raise self._create_exception(pgres=pgres)
+            finally:
+                libpq.PQclear(pgres)
+
+    def _execute_green(self, query, statuses=None):
         """Execute version for green threads"""
+        return self._send_green(libpq.PQsendQuery, (query,), statuses)
+
+    def _send_green(self, send, args, statuses=None):
+        """Send a command using a PQsend* function and wait for its last
+        result, in green mode.
+
+        """
         if self._async_cursor:
             raise exceptions.ProgrammingError(
                 "a single async query can be executed on the same connection")
 
         self._async_cursor = True
 
-        if not libpq.PQsendQuery(self._pgconn, query):
+        if not send(self._pgconn, *args):
             self._async_cursor = None
             return
 
@@ -628,7 +910,7 @@ class Connection(object):
 
         try:
             _green_callback(self)
-            return util.pq_get_last_result(self._pgconn)
+            return util.pq_get_last_result(self._pgconn, statuses)
         except:
             util.pq_clear_async(self._pgconn)
             raise
@@ -636,6 +918,31 @@ class Connection(object):
             self._async_cursor = None
             self._async_status = consts.ASYNC_DONE
 
+    def _poll_copy_steps(self):
+        """Advance an async COPY, return the state to wait for"""
+        try:
+            return self._copy_steps.next()
+        except StopIteration:
+            self._copy_steps = None
+            return consts.POLL_OK
+        except:
+            self._copy_steps = None
+            raise
+
+    def _wait_copy(self, state=consts.POLL_READ):
+        """Wait during COPY for the socket to be ready, using the wait
+        callback"""
+        self._in_copy = True
+        if state == consts.POLL_WRITE:
+            self._async_status = consts.ASYNC_WRITE
+        else:
+            self._async_status = consts.ASYNC_READ
+        try:
+            _green_callback(self)
+        finally:
+            self._in_copy = False
+            self._async_status = consts.ASYNC_DONE
+
     def _finish_tpc(self, command, fallback, xid):
         if xid:
             # committing/aborting a received transaction.
@@ -685,6 +992,7 @@ class Connection(object):
                 self._execute_command('COMMIT')
             finally:
                 self.status = consts.STATUS_READY
+                self._gucs_in_trans = False
 
     def _rollback(self):
         if self._autocommit or self.status != consts.STATUS_BEGIN:
@@ -692,6 +1000,10 @@ class Connection(object):
         self._mark += 1
         self._execute_command('ROLLBACK')
         self.status = consts.STATUS_READY
+        if self._gucs_in_trans:
+            # a SET executed in the transaction may have been reverted
+            self._gucs.clear()
+            self._gucs_in_trans = False
 
     def _get_encoding(self):
         """Retrieving encoding"""
@@ -0,0 +1,743 @@
+"""Conversion between Python records and the COPY data formats.
+
+The encoders convert a record (a sequence of Python values) into a line of
+COPY data. The conversion function for each value type is looked up once
+and then cached by the encoder, so encoding a row costs little more than a
+dictionary lookup and a string conversion per field.
+
+The binary format is supported in both directions for the core scalar types
+and their one-dimensional arrays: as the binary format carries no type
+information, the types of the columns must be specified.
+
+"""
+import datetime
+import decimal
+import re
+import struct
+import uuid
+from binascii import hexlify
+
+from psycopg2ct import tz
+from psycopg2ct._impl.exceptions import DataError, NotSupportedError
+
+
+_binary_signature = 'PGCOPY\n\xff\r\n\x00'
+_binary_null = struct.pack('!i', -1)
+_int2 = struct.Struct('!h')
+_int4 = struct.Struct('!i')
+
+
+class TextEncoder(object):
+    """Encode records in the COPY text format."""
+
+    #: The separator between fields
+    sep = '\t'
+
+    #: The representation of NULL
+    null = '\\N'
+
+    #: The data to send before and after the records
+    header = trailer = ''
+
+    _re_escape = re.compile(r'[\\\t\n\r]')
+    _escapes = {'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'}
+
+    def __init__(self, conn):
+        self._conn = conn
+        self._hex_bytea = conn.server_version >= 90000
+        self._encoders = {}
+
+    def encode_row(self, record):
+        """Return the line of COPY data representing `record`."""
+        null = self.null
+        encoders = self._encoders
+        fields = []
+        for value in record:
+            if value is None:
+                fields.append(null)
+                continue
+            try:
+                encoder = encoders[type(value)]
+            except KeyError:
+                encoder = self._get_encoder(type(value))
+            fields.append(encoder(value))
+
+        return self.sep.join(fields) + '\n'
+
+    def escape(self, value):
+        """Escape the characters with special meaning in a field."""
+        if self._re_escape.search(value) is None:
+            return value
+        escapes = self._escapes
+        return self._re_escape.sub(lambda m: escapes[m.group()], value)
+
+    def dump(self, value):
+        """Return the unescaped representation of a value."""
+        return self._lookup(type(value))[0](self, value)
+
+    def _lookup(self, cls):
+        for base in cls.__mro__:
+            if base in _dumpers:
+                return _dumpers[base]
+        return _dump_str, False
+
+    def _get_encoder(self, cls):
+        dumper, safe = self._lookup(cls)
+        if safe:
+            encoder = lambda value: dumper(self, value)
+        else:
+            escape = self.escape
+            encoder = lambda value: escape(dumper(self, value))
+
+        self._encoders[cls] = encoder
+        return encoder
+
+
+class CsvEncoder(TextEncoder):
+    """Encode records in the COPY csv format."""
+
+    sep = ','
+    null = ''
+
+    _re_escape = re.compile(r'[,"\n\r]')
+
+    def escape(self, value):
+        if not value or value == '\\.' or self._re_escape.search(value):
+            return '"%s"' % value.replace('"', '""')
+        return value
+
+
+class CopySource(object):
+    """A file-like object serializing records on demand for COPY FROM.
+
+    Every read() returns a chunk of complete lines of about `size` bytes, so
+    only a bounded part of the records is held in memory at any time.
+
+    """
+
+    def __init__(self, records, encoder):
+        self._records = iter(records)
+        self._encode = encoder.encode_row
+        self._header = encoder.header
+        self._trailer = encoder.trailer
+
+        #: The number of records consumed so far
+        self.rows = 0
+
+    def read(self, size=-1):
+        if self._records is None:
+            return ''
+
+        encode = self._encode
+        chunk = [self._header]
+        self._header = ''
+        length = 0
+        for record in self._records:
+            line = encode(record)
+            chunk.append(line)
+            self.rows += 1
+            length += len(line)
+            if 0 < size <= length:
+                break
+        else:
+            chunk.append(self._trailer)
+            self._records = None
+
+        return ''.join(chunk)
+
+    def readline(self, size=-1):
+        return self.read(1)
+
+
+class BinaryEncoder(object):
+    """Encode records in the COPY binary format.
+
+    `types` is the sequence of the types of the columns, as PostgreSQL type
+    names (e.g. ``'int4'``, ``'text[]'``) or oids.
+
+    """
+
+    header = _binary_signature + struct.pack('!ii', 0, 0)
+    trailer = struct.pack('!h', -1)
+
+    def __init__(self, conn, types):
+        self._conn = conn
+        self._encoders = [_get_binary_codec(t)[1] for t in types]
+        self._count = _int2.pack(len(self._encoders))
+
+    def encode_row(self, record):
+        """Return the COPY binary tuple representing `record`."""
+        if len(record) != len(self._encoders):
+            raise ValueError("expected %d fields, got %d"
+                % (len(self._encoders), len(record)))
+
+        pack_length = _int4.pack
+        fields = [self._count]
+        for encode, value in zip(self._encoders, record):
+            if value is None:
+                fields.append(_binary_null)
+            else:
+                data = encode(self, value)
+                fields.append(pack_length(len(data)))
+                fields.append(data)
+
+        return ''.join(fields)
+
+
+class BinaryDecoder(object):
+    """Decode a COPY binary format stream into records.
+
+    The object is a file-like target for copy_expert() and copy_to(): the
+    data is parsed as it is written and `callback` is called with every
+    record, as a tuple of Python values, as soon as it is complete. The
+    records are not kept by the decoder.
+
+    Values with no exact Python equivalent raise `DataError`: dates and
+    timestamps before year 1 (BC) or after year 9999, and intervals
+    including months or years.
+
+    """
+
+    def __init__(self, conn, types, callback):
+        self._conn = conn
+        self._decoders = [_get_binary_codec(t)[2] for t in types]
+        self._callback = callback
+        self._buf = ''
+        self._in_header = True
+
+        #: The number of records decoded so far
+        self.rows = 0
+
+        #: True after the end of the stream has been read
+        self.done = False
+
+    def write(self, data):
+        buf = self._buf + data
+        pos = 0
+        if self._in_header:
+            if len(buf) < 19:
+                self._buf = buf
+                return
+            if buf[:11] != _binary_signature:
+                raise DataError("invalid COPY binary signature")
+            pos = 19 + _int4.unpack_from(buf, 15)[0]
+            if len(buf) < pos:
+                self._buf = buf
+                return
+            self._in_header = False
+
+        unpack_count = _int2.unpack_from
+        unpack_length = _int4.unpack_from
+        decoders = self._decoders
+        callback = self._callback
+        end = len(buf)
+        while not self.done and pos + 2 <= end:
+            count = unpack_count(buf, pos)[0]
+            if count == -1:
+                self.done = True
+                pos += 2
+                break
+            if count != len(decoders):
+                raise DataError("expected %d fields, got %d"
+                    % (len(decoders), count))
+
+            row = []
+            p = pos + 2
+            for decode in decoders:
+                if p + 4 > end:
+                    break
+                length = unpack_length(buf, p)[0]
+                p += 4
+                if length < 0:
+                    row.append(None)
+                    continue
+                if p + length > end:
+                    break
+                row.append(decode(self, buf[p:p + length]))
+                p += length
+            else:
+                pos = p
+                self.rows += 1
+                callback(tuple(row))
+                continue
+
+            # incomplete tuple: wait for more data
+            break
+
+        self._buf = buf[pos:]
+
+
+def parse_text_row(line):
+    """Split a line of COPY text data in its fields.
+
+    Return the list of the unescaped fields, with None for the NULLs.
+
+    """
+    if line.endswith('\n'):
+        line = line[:-1]
+    fields = line.split('\t')
+    for i, field in enumerate(fields):
+        if field == '\\N':
+            fields[i] = None
+        elif '\\' in field:
+            fields[i] = _re_unescape.sub(_unescape, field)
+    return fields
+
+_re_unescape = re.compile(r'\\(?:([0-7]{1,3})|x([0-9a-fA-F]{1,2})|(.))')
+_unescapes = {
+    'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t', 'v': '\v'}
+
+
+def _unescape(m):
+    octal, hex, char = m.groups()
+    if octal:
+        return chr(int(octal, 8) & 0xff)
+    if hex:
+        return chr(int(hex, 16))
+    return _unescapes.get(char, char)
+
+
+def make_encoder(conn, format, types=None):
+    """Return an encoder for the COPY `format` ('text', 'csv' or 'binary').
+
+    The binary format requires the `types` of the columns.
+
+    """
+    if format == 'binary':
+        if types is None:
+            raise ValueError("the binary format requires the column types")
+        return BinaryEncoder(conn, types)
+
+    try:
+        cls = _encoders[format]
+    except KeyError:
+        raise ValueError("unknown COPY format: %r" % (format,))
+    return cls(conn)
+
+
+_encoders = {
+    'text': TextEncoder,
+    'csv': CsvEncoder,
+}
+
+def _dump_str(encoder, value):
+    return str(value)
+
+
+def _dump_unicode(encoder, value):
+    return value.encode(encoder._conn._py_enc)
+
+
+def _dump_bool(encoder, value):
+    return value and 't' or 'f'
+
+
+def _dump_float(encoder, value):
+    if value != value:
+        return 'NaN'
+    if value in (_inf, -_inf):
+        return value > 0 and 'Infinity' or '-Infinity'
+    return repr(value)
+
+_inf = float('inf')
+
+
+def _dump_isoformat(encoder, value):
+    return value.isoformat()
+
+
+def _dump_timedelta(encoder, value):
+    return '%d days %d.%06d seconds' % (
+        value.days, value.seconds, value.microseconds)
+
+
+def _dump_bytea(encoder, value):
+    if hasattr(value, 'tobytes'):
+        value = value.tobytes()     # memoryview
+    else:
+        value = str(value)
+
+    if encoder._hex_bytea:
+        return '\\x' + hexlify(value)
+    return ''.join([_bytea_escapes[c] for c in value])
+
+_bytea_escapes = dict(
+    (chr(i), (32 <= i < 127 and i != 92) and chr(i) or '\\%03o' % i)
+    for i in xrange(256))
+
+
+_re_array_quote = re.compile(r'[{}",\\\s]')
+
+
+def _dump_list(encoder, value):
+    items = []
+    for item in value:
+        if item is None:
+            items.append('NULL')
+        elif isinstance(item, list):
+            items.append(_dump_list(encoder, item))
+        else:
+            item = encoder.dump(item)
+            if (not item or item.upper() == 'NULL'
+                    or _re_array_quote.search(item)):
+                item = '"%s"' % item.replace('\\', '\\\\').replace('"', '\\"')
+            items.append(item)
+
+    return '{%s}' % ','.join(items)
+
+
+# Map types to (dumper, safe). The representation of safe types never
+# contains characters that need escaping.
+_dumpers = {
+    str: (_dump_str, False),
+    unicode: (_dump_unicode, False),
+    bool: (_dump_bool, True),
+    int: (_dump_str, True),
+    long: (_dump_str, True),
+    float: (_dump_float, True),
+    decimal.Decimal: (_dump_str, True),
+    datetime.date: (_dump_isoformat, True),
+    datetime.time: (_dump_isoformat, True),
+    datetime.timedelta: (_dump_timedelta, True),
+    buffer: (_dump_bytea, False),
+    bytearray: (_dump_bytea, False),
+    list: (_dump_list, False),
+}
+
+try:
+    _dumpers[memoryview] = (_dump_bytea, False)
+except NameError:
+    # Python 2.6
+    pass
+
+
+# Binary format codecs: every type has an encode(encoder, value) function
+# returning a string and a decode(decoder, data) function.
+
+def _struct_codec(fmt, cast=None):
+    st = struct.Struct(fmt)
+    pack = st.pack
+    unpack = st.unpack
+    if cast is None:
+        encode = lambda encoder, value: pack(value)
+    else:
+        encode = lambda encoder, value: pack(cast(value))
+    decode = lambda decoder, data: unpack(data)[0]
+    return encode, decode
+
+
+def _encode_text(encoder, value):
+    if isinstance(value, unicode):
+        return value.encode(encoder._conn._py_enc)
+    return str(value)
+
+
+def _decode_text(decoder, data):
+    return data
+
+
+def _encode_bytea(encoder, value):
+    if hasattr(value, 'tobytes'):
+        return value.tobytes()      # memoryview
+    return str(value)
+
+
+def _decode_bytea(decoder, data):
+    return buffer(data)
+
+
+def _encode_bool(encoder, value):
+    return value and '\x01' or '\x00'
+
+
+def _decode_bool(decoder, data):
+    return data != '\x00'
+
+
+_pg_epoch_date = datetime.date(2000, 1, 1)
+_pg_epoch = datetime.datetime(2000, 1, 1)
+_utc = tz.FixedOffsetTimezone(0)
+_int8 = struct.Struct('!q')
+
+
+def _encode_date(encoder, value):
+    if isinstance(value, datetime.datetime):
+        value = value.date()
+    return _int4.pack((value - _pg_epoch_date).days)
+
+
+def _decode_date(decoder, data):
+    days = _int4.unpack(data)[0]
+    if days == 0x7fffffff:
+        return datetime.date.max
+    if days == -0x80000000:
+        return datetime.date.min
+    try:
+        return _pg_epoch_date + datetime.timedelta(days)
+    except OverflowError:
+        raise _range_error('date', days < 0)
+
+
+def _encode_time(encoder, value):
+    return _int8.pack(
+        ((value.hour * 60 + value.minute) * 60 + value.second) * 1000000
+        + value.microsecond)
+
+
+def _decode_time(decoder, data):
+    secs, us = divmod(_int8.unpack(data)[0], 1000000)
+    mins, secs = divmod(secs, 60)
+    hours, mins = divmod(mins, 60)
+    return datetime.time(hours, mins, secs, us)
+
+
+def _timestamp_us(value):
+    delta = value - _pg_epoch
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+def _encode_timestamp(encoder, value):
+    return _int8.pack(_timestamp_us(value.replace(tzinfo=None)))
+
+
+def _encode_timestamptz(encoder, value):
+    # naive values are taken as UTC
+    offset = value.utcoffset()
+    value = value.replace(tzinfo=None)
+    if offset:
+        value -= offset
+    return _int8.pack(_timestamp_us(value))
+
+
+def _decode_timestamp(decoder, data):
+    us = _int8.unpack(data)[0]
+    if us == 0x7fffffffffffffff:
+        return datetime.datetime.max
+    if us == -0x8000000000000000:
+        return datetime.datetime.min
+    try:
+        return _pg_epoch + datetime.timedelta(microseconds=us)
+    except OverflowError:
+        raise _range_error('timestamp', us < 0)
+
+
+def _range_error(name, bc):
+    # PostgreSQL dates go from 4713 BC to year 5874897, Python ones from 1
+    # to 9999
+    if bc:
+        return DataError("%s before year 1 can't be represented in Python"
+            % name)
+    else:
+        return DataError("%s after year 9999 can't be represented in Python"
+            % name)
+
+
+def _decode_timestamptz(decoder, data):
+    value = _decode_timestamp(decoder, data)
+    return value.replace(tzinfo=_utc)
+
+
+_interval = struct.Struct('!qii')
+
+
+def _encode_interval(encoder, value):
+    return _interval.pack(
+        value.seconds * 1000000 + value.microseconds, value.days, 0)
+
+
+def _decode_interval(decoder, data):
+    us, days, months = _interval.unpack(data)
+    if months:
+        # the length of a month depends on the date it is added to
+        raise DataError("interval with months can't be represented "
+            "exactly as timedelta: cast it to text or convert it to a "
+            "number of days in the query")
+    return datetime.timedelta(days=days, microseconds=us)
+
+
+_numeric_head = struct.Struct('!hhHh')
+_NUMERIC_NEG = 0x4000
+_NUMERIC_NAN = 0xC000
+_NUMERIC_PINF = 0xD000
+_NUMERIC_NINF = 0xF000
+
+
+def _encode_numeric(encoder, value):
+    if not isinstance(value, decimal.Decimal):
+        value = decimal.Decimal(str(value))
+    if value.is_nan():
+        return _numeric_head.pack(0, 0, _NUMERIC_NAN, 0)
+    if value.is_infinite():
+        return _numeric_head.pack(0, 0,
+            value > 0 and _NUMERIC_PINF or _NUMERIC_NINF, 0)
+
+    sign, digits, exp = value.as_tuple()
+    digits = list(digits)
+    if exp > 0:
+        digits.extend([0] * exp)
+        exp = 0
+    dscale = -exp
+
+    # align the digits in groups of 4 around the decimal point
+    digits.extend([0] * (-dscale % 4))
+    intlen = len(digits) - dscale - (-dscale % 4)
+    digits[:0] = [0] * (-intlen % 4)
+    intlen += -intlen % 4
+
+    groups = [digits[i] * 1000 + digits[i + 1] * 100
+        + digits[i + 2] * 10 + digits[i + 3]
+        for i in xrange(0, len(digits), 4)]
+    weight = intlen // 4 - 1
+    while groups and not groups[0]:
+        del groups[0]
+        weight -= 1
+    while groups and not groups[-1]:
+        del groups[-1]
+    if not groups:
+        weight = 0
+
+    return (_numeric_head.pack(len(groups), weight,
+            sign and _NUMERIC_NEG or 0, dscale)
+        + struct.pack('!%dh' % len(groups), *groups))
+
+
+def _decode_numeric(decoder, data):
+    ndigits, weight, sign, dscale = _numeric_head.unpack_from(data)
+    if sign == _NUMERIC_NAN:
+        return decimal.Decimal('NaN')
+    if sign == _NUMERIC_PINF:
+        return decimal.Decimal('Infinity')
+    if sign == _NUMERIC_NINF:
+        return decimal.Decimal('-Infinity')
+
+    groups = struct.unpack_from('!%dh' % ndigits, data, 8)
+    digits = ''.join(['%04d' % g for g in groups])
+    point = (weight + 1) * 4
+    if point <= 0:
+        digits = '0' * -point + digits
+        point = 0
+    elif point > len(digits):
+        digits += '0' * (point - len(digits))
+
+    rv = digits[:point].lstrip('0') or '0'
+    if dscale:
+        rv += '.' + (digits[point:] + '0' * dscale)[:dscale]
+    if sign == _NUMERIC_NEG:
+        rv = '-' + rv
+    return decimal.Decimal(rv)
+
+
+def _encode_uuid(encoder, value):
+    if not isinstance(value, uuid.UUID):
+        value = uuid.UUID(str(value))
+    return value.bytes
+
+
+def _decode_uuid(decoder, data):
+    return uuid.UUID(bytes=data)
+
+
+_array_head = struct.Struct('!iiI')
+_array_dim = struct.Struct('!ii')
+
+
+def _array_codec(elem_oid, elem_encode, elem_decode):
+    def encode(encoder, value):
+        if not value:
+            return _array_head.pack(0, 0, elem_oid)
+
+        items = []
+        has_null = 0
+        for item in value:
+            if item is None:
+                has_null = 1
+                items.append(_binary_null)
+            else:
+                data = elem_encode(encoder, item)
+                items.append(_int4.pack(len(data)))
+                items.append(data)
+
+        return (_array_head.pack(1, has_null, elem_oid)
+            + _array_dim.pack(len(value), 1) + ''.join(items))
+
+    def decode(decoder, data):
+        ndim = _array_head.unpack_from(data)[0]
+        pos = _array_head.size
+        dims = []
+        for i in xrange(ndim):
+            dims.append(_array_dim.unpack_from(data, pos)[0])
+            pos += _array_dim.size
+
+        items = []
+        for i in xrange(ndim and reduce(int.__mul__, dims) or 0):
+            length = _int4.unpack_from(data, pos)[0]
+            pos += 4
+            if length < 0:
+                items.append(None)
+            else:
+                items.append(elem_decode(decoder, data[pos:pos + length]))
+                pos += length
+
+        # rebuild the nested lists of the multi-dimensional arrays
+        for size in reversed(dims[1:]):
+            items = [items[i:i + size] for i in xrange(0, len(items), size)]
+        return items
+
+    return encode, decode
+
+
+# Map type names to (oid, array oid, encode, decode)
+_binary_types = {}
+
+
+def _add_binary_type(names, oid, array_oid, codec):
+    for name in names.split():
+        _binary_types[name] = (oid, array_oid) + tuple(codec)
+
+_add_binary_type('bool boolean', 16, 1000, (_encode_bool, _decode_bool))
+_add_binary_type('bytea', 17, 1001, (_encode_bytea, _decode_bytea))
+_add_binary_type('int8 bigint', 20, 1016, _struct_codec('!q', long))
+_add_binary_type('int2 smallint', 21, 1005, _struct_codec('!h', int))
+_add_binary_type('int4 int integer', 23, 1007, _struct_codec('!i', int))
+_add_binary_type('text', 25, 1009, (_encode_text, _decode_text))
+_add_binary_type('oid', 26, 1028, _struct_codec('!I', long))
+_add_binary_type('json', 114, 199, (_encode_text, _decode_text))
+_add_binary_type('float4 real', 700, 1021, _struct_codec('!f', float))
+_add_binary_type('float8', 701, 1022, _struct_codec('!d', float))
+_add_binary_type('bpchar char', 1042, 1014, (_encode_text, _decode_text))
+_add_binary_type('varchar', 1043, 1015, (_encode_text, _decode_text))
+_add_binary_type('date', 1082, 1182, (_encode_date, _decode_date))
+_add_binary_type('time', 1083, 1183, (_encode_time, _decode_time))
+_add_binary_type('timestamp', 1114, 1115,
+    (_encode_timestamp, _decode_timestamp))
+_add_binary_type('timestamptz', 1184, 1185,
+    (_encode_timestamptz, _decode_timestamptz))
+_add_binary_type('interval', 1186, 1187,
+    (_encode_interval, _decode_interval))
+_add_binary_type('numeric decimal', 1700, 1231,
+    (_encode_numeric, _decode_numeric))
+_add_binary_type('uuid', 2950, 2951, (_encode_uuid, _decode_uuid))
+
+_binary_oids = {}
+for _name, _info in _binary_types.iteritems():
+    _binary_oids[_info[0]] = _name
+    _binary_oids[_info[1]] = _name + '[]'
+del _name, _info
+
+
+def _get_binary_codec(type):
+    """Return (oid, encode, decode) for a type name or oid."""
+    name = type
+    if not isinstance(name, basestring):
+        name = _binary_oids.get(name, name)
+
+    try:
+        if isinstance(name, basestring) and name.endswith('[]'):
+            oid, array_oid, encode, decode = _binary_types[name[:-2]]
+            return (array_oid,) + _array_codec(oid, encode, decode)
+
+        oid, array_oid, encode, decode = _binary_types[name]
+        return oid, encode, decode
+    except (KeyError, TypeError):
+        raise NotSupportedError(
+            "binary COPY not supported for the type %r" % (type,))
@@ -1,10 +1,15 @@
 from collections import namedtuple
 from functools import wraps
 from io import TextIOBase
+import mmap
+import sys
+import time
 import weakref
 
 from psycopg2ct import tz
+from psycopg2ct._impl import columnar
 from psycopg2ct._impl import consts
+from psycopg2ct._impl import copyformat
 from psycopg2ct._impl import exceptions
 from psycopg2ct._impl import libpq
 from psycopg2ct._impl import typecasts
@@ -13,6 +18,19 @@ from psycopg2ct._impl.adapters import _getquoted
 from psycopg2ct._impl.exceptions import InterfaceError, ProgrammingError
 
 
+# The size of the slices of a buffer sent by COPY FROM is doubled when a
+# slice is sent in less than _COPY_FAST_PUT seconds and halved when sending
+# it takes longer than _COPY_SLOW_PUT.
+_COPY_MIN_CHUNK = 8192
+_COPY_MAX_CHUNK = 8 * 1024 * 1024
+_COPY_FAST_PUT = 0.005
+_COPY_SLOW_PUT = 0.05
+
+
+class _CopyPutError(Exception):
+    """PQputCopyData() failed: the COPY must be ended with an error."""
+
+
 def check_closed(func):
     """Check if the connection is closed and raise an error"""
     @wraps(func)
@@ -63,7 +81,7 @@ class Cursor(object):
 
     """
 
-    def __init__(self, connection, name, row_factory=None):
+    def __init__(self, connection, name, row_factory=None, row_maker=None):
 
         self._conn = connection
 
@@ -85,6 +103,13 @@ class Cursor(object):
         self.tzinfo_factory = tz.FixedOffsetTimezone
         self.row_factory = row_factory
 
+        #: Optional callable used to build rows in a single step. It is
+        #: called with the cursor once the description of a result is known
+        #: and must return a callable which receives the decoded values of a
+        #: row as a tuple and returns the row object (e.g. the `_make`
+        #: method of a namedtuple). It takes precedence over row_factory.
+        self.row_maker = row_maker
+
         self._closed = False
         self._description = None
         self._lastrowid = 0
@@ -97,6 +122,7 @@ class Cursor(object):
         self._statusmessage = None
         self._typecasts = {}
         self._pgres = None
+        self._make_row = None
         self._copyfile = None
         self._copysize = None
 
@@ -175,9 +201,21 @@ class Cursor(object):
         (or subclass) exception will be raised if any operation is attempted
         with the cursor.
 
+        On asynchronous connections closing a named cursor only sends the
+        CLOSE to the server: the connection must be polled until the command
+        is complete before executing another query, as after .execute().
+
         """
         if self._name is not None:
-            self._pq_execute('CLOSE "%s"' % self._name)
+            if not self._conn._async:
+                self._pq_execute('CLOSE "%s"' % self._name)
+            elif self._query is not None:
+                # the cursor is gone if its transaction is, unless WITH HOLD
+                status = self._conn.get_transaction_status()
+                if status == consts.TRANSACTION_STATUS_INTRANS or (
+                        self._withhold
+                        and status == consts.TRANSACTION_STATUS_IDLE):
+                    self._pq_execute('CLOSE "%s"' % self._name, True)
 
         self._closed = True
 
@@ -216,7 +254,13 @@ class Cursor(object):
             if self._query:
                 raise ProgrammingError(
                     "can't call .execute() on named cursors more than once")
-            if self._conn.autocommit:
+            if conn._async:
+                # the transaction is started by the user with a BEGIN
+                if not self._withhold and conn.get_transaction_status() \
+                        != consts.TRANSACTION_STATUS_INTRANS:
+                    raise ProgrammingError(
+                        "can't use a named cursor outside of transactions")
+            elif self._conn.autocommit:
                 raise ProgrammingError(
                     "can't use a named cursor outside of transactions")
 
@@ -228,7 +272,9 @@ class Cursor(object):
         else:
             self._query = query
 
-        conn._begin_transaction()
+        # an empty query must not run the BEGIN alone
+        begin = conn._begin_transaction(
+            piggyback=bool(self._query.strip(' \t\r\n;')))
         self._clear_pgres()
 
         if self._name:
@@ -236,9 +282,42 @@ class Cursor(object):
                 self._name,
                 self._withhold and "WITH" or "WITHOUT", # youuuuu
                 self._query)
+            if conn._async:
+                # fetch the first records in the same roundtrip
+                self._query += '; FETCH FORWARD %d FROM "%s"' % (
+                    self.itersize, self._name)
+
+        conn._track_session(self._query)
+        if not begin:
+            self._pq_execute(self._query, conn._async)
+            return
 
-        self._pq_execute(self._query, conn._async)
+        # the results before the last one: there is at least the BEGIN one
+        # if the server has executed anything
+        statuses = []
+        try:
+            self._pq_execute(begin + self._query, statuses=statuses)
+        except exceptions.Error:
+            if statuses or conn.closed or not self._pgres \
+                    or libpq.PQresultErrorField(self._pgres,
+                        libpq.PG_DIAG_SQLSTATE) != '42601':
+                raise
+
+            # The query string was rejected as a whole by the parser so not
+            # even the BEGIN was executed. Repeat the steps separately to
+            # leave the connection in the same state as without
+            # piggybacking, in a failed transaction.
+            conn.status = consts.STATUS_READY
+            conn._begin_transaction()
+            self._clear_pgres()
+            self._pq_execute(self._query)
+            return
 
+        if not statuses and self._statusmessage == 'BEGIN':
+            # Only the BEGIN was executed: the query has no statement (e.g.
+            # it is only made of comments). Run it alone to get the error.
+            self._clear_pgres()
+            self._pq_execute(self._query)
 
     @check_closed
     @check_async
@@ -283,7 +362,7 @@ class Cursor(object):
         .execute*() did not produce any result set or no call was issued yet.
 
         """
-        if self._name is not None:
+        if self._name is not None and not self._conn._async:
             self._pq_execute(
                 'FETCH FORWARD 1 FROM "%s"' % self._name)
 
@@ -321,7 +400,7 @@ class Cursor(object):
         if size is None:
             size = self.arraysize
 
-        if self._name is not None:
+        if self._name is not None and not self._conn._async:
             self._pq_execute(
                 'FETCH FORWARD %d FROM "%s"' % (size, self._name))
 
@@ -331,10 +410,8 @@ class Cursor(object):
         if size <= 0:
             return []
 
-        rows = []
-        for i in xrange(size):
-            rows.append(self._build_row(self._rownumber))
-            self._rownumber += 1
+        rows = self._build_rows(self._rownumber, self._rownumber + size)
+        self._rownumber += size
         return rows
 
     @check_closed
@@ -350,18 +427,111 @@ class Cursor(object):
         .execute*() did not produce any result set or no call was issued yet.
 
         """
-        if self._name is not None:
+        if self._name is not None and not self._conn._async:
             self._pq_execute('FETCH FORWARD ALL FROM "%s"' % self._name)
 
         size = self._rowcount - self._rownumber
         if size <= 0:
             return []
 
-        result = []
-        for row in xrange(size):
-            result.append(self._build_row(self._rownumber))
-            self._rownumber += 1
-        return result
+        rows = self._build_rows(self._rownumber, self._rowcount)
+        self._rownumber = self._rowcount
+        return rows
+
+    @check_closed
+    @check_no_tuples
+    def fetch_numpy(self, size=None, dtypes=None):
+        """Fetch the next set of rows of a query result as NumPy arrays.
+
+        Return a list with an array for each column of the result. If size
+        is not given all the remaining rows are fetched.
+
+        Integer, float, boolean, date and timestamp columns are converted
+        with a vectorized conversion of the values returned by the backend;
+        timestamps with time zone are converted to UTC. Other columns are
+        returned as object arrays of the objects returned by the cursor
+        typecasters. NULLs are masked in integer and boolean arrays, and are
+        NaN, NaT or None in the other arrays.
+
+        The dtypes parameter is an optional mapping from column name or
+        index to the NumPy dtype to use for that column.
+
+        NumPy is required to use this method.
+
+        This is a psycopg2ct extension to the DB API 2.0
+
+        """
+        return self._fetch_columns(size, dtypes)[0]
+
+    @check_closed
+    @check_no_tuples
+    def iter_numpy(self, size=None, dtypes=None, structured=False):
+        """Iterate over the rest of a query result in chunks of NumPy arrays.
+
+        Each chunk contains at most size rows, by default the cursor's
+        itersize; named cursors fetch every chunk from the backend with a
+        separate network roundtrip, so the memory used is independent of the
+        size of the result.
+
+        Every chunk is a dict mapping the column names to arrays as returned
+        by fetch_numpy() or, if structured is True, a masked structured array
+        whose fields are the result columns. The dtypes parameter has the
+        same meaning as in fetch_numpy().
+
+        NumPy is required to use this method.
+
+        This is a psycopg2ct extension to the DB API 2.0
+
+        """
+        if size is None:
+            size = self.itersize
+        if size <= 0:
+            raise ValueError("size must be a positive number")
+
+        while 1:
+            arrays, nrows = self._fetch_columns(size, dtypes)
+            if not nrows:
+                return
+
+            if structured:
+                yield columnar.to_structured(self, arrays)
+            else:
+                yield columnar.to_dict(self, arrays)
+
+    @check_closed
+    def prefetch(self, size=None):
+        """Start fetching the next records of a named cursor on an
+        asynchronous connection.
+
+        On asynchronous connections the fetch methods of named cursors only
+        return the records already received: this method sends a FETCH for
+        the next size records (by default the cursor's itersize, all of them
+        if negative) and, once the connection has been polled to completion,
+        makes them available to the fetch methods. The first itersize
+        records are fetched already by .execute(); .scroll() is not
+        supported. Such cursors are only created by
+        `psycopg2ct.aio.AsyncCursor`, which calls this method when the
+        records received run out.
+
+        This is a psycopg2ct extension to the DB API 2.0
+
+        """
+        if not self._name or not self._conn._async:
+            raise ProgrammingError("prefetch() can be used only with "
+                "named cursors on asynchronous connections")
+        if self._query is None:
+            raise ProgrammingError("no results to fetch")
+        if self._conn._async_cursor is not None:
+            raise ProgrammingError(
+                "cannot be used while an asynchronous query is underway")
+
+        if size is None:
+            size = self.itersize
+        if size < 0:
+            self._pq_execute('FETCH FORWARD ALL FROM "%s"' % self._name, True)
+        else:
+            self._pq_execute(
+                'FETCH FORWARD %d FROM "%s"' % (size, self._name), True)
 
     def nextset(self):
         """This method will make the cursor skip to the next available set,
@@ -402,13 +572,14 @@ class Cursor(object):
         return _combine_cmd_params(query, vars, self._conn)
 
     @check_closed
-    @check_async
     def copy_from(self, file, table, sep='\t', null='\\N', size=8192,
                   columns=None):
         """Reads data from a file-like object appending them to a database
         table (COPY table FROM file syntax).
 
-        The source file must have both read() and readline() method.
+        The source file must have both read() and readline() method. It can
+        also be a bytes-like object (str, buffer, bytearray, memoryview,
+        mmap) whose memory is sent as it is, without intermediate copies.
 
         TODO: Improve error handling
 
@@ -423,21 +594,17 @@ class Cursor(object):
             util.quote_string(self._conn, sep),
             util.quote_string(self._conn, null))
 
-        self._copysize = size
-        self._copyfile = file
-        try:
-            self._pq_execute(query)
-        finally:
-            self._copyfile = None
-            self._copysize = None
+        self._pq_execute_copy(query, file, size)
 
     @check_closed
-    @check_async
-    def copy_to(self, file, table, sep='\t', null='\\N', columns=None):
+    def copy_to(self, file, table, sep='\t', null='\\N', columns=None,
+                size=8192):
         """Writes the content of a table to a file-like object (COPY table
         TO file syntax).
 
-        The target file must have a write() method.
+        The target file must have a write() method, or be a bytearray which
+        the data is appended to. The data is written in blocks of about
+        `size` bytes.
 
         TODO: Improve error handling
 
@@ -452,27 +619,84 @@ class Cursor(object):
             util.quote_string(self._conn, sep),
             util.quote_string(self._conn, null))
 
-        self._copyfile = file
-        try:
-            self._pq_execute(query)
-        finally:
-            self._copyfile = None
+        self._pq_execute_copy(query, file, size)
 
     @check_closed
-    @check_async
     def copy_expert(self, sql, file, size=8192):
         if not sql:
             return
 
-        if not hasattr(file, 'read') and not hasattr(file, 'write'):
+        if not hasattr(file, 'read') and not hasattr(file, 'write') \
+                and not isinstance(file, util.buffer_types):
             raise TypeError("file must be a readable file-like object for"
                 " COPY FROM; a writeable file-like object for COPY TO.")
 
-        self._copyfile = file
-        try:
-            self._pq_execute(sql)
-        finally:
-            self._copyfile = None
+        self._pq_execute_copy(sql, file, size)
+
+    @check_closed
+    def copy_records(self, table, columns, records, format='text',
+                     size=8192, types=None):
+        """Append the records of an iterable to a database table (COPY
+        table FROM stdin syntax).
+
+        Every record is a sequence of Python values, in the order of
+        `columns`, which may be None to load all the table columns. The
+        records are serialized in the COPY `format` ('text', 'csv' or
+        'binary') and sent in chunks of about `size` bytes, as they are
+        consumed. The binary format requires the `types` of the columns.
+
+        """
+        encoder = copyformat.make_encoder(self._conn, format, types)
+        if columns:
+            columns_str = '(%s)' % ','.join([column for column in columns])
+        else:
+            columns_str = ''
+
+        query = "COPY %s%s FROM stdin" % (table, columns_str)
+        if format == 'csv':
+            query += " WITH CSV"
+        elif format == 'binary':
+            query += " WITH BINARY"
+
+        self._pq_execute_copy(query, copyformat.CopySource(records, encoder), size)
+
+    @check_closed
+    @check_async
+    def copy_rows(self, query, vars=None):
+        """Execute a query and return an iterator on its rows, transferred
+        using COPY (query) TO STDOUT.
+
+        The rows are parsed and converted by the cursor typecasters as the
+        data is received, so the result is never held in memory as a whole.
+        The result columns are available in description: they are obtained
+        describing the query, which is only executed by the COPY, once the
+        iteration starts. If the iterator is closed before the end, the
+        remaining data is discarded.
+
+        """
+        if self._name:
+            raise ProgrammingError(
+                "copy_rows() can't be used with named cursors")
+
+        # The query is nested in a COPY: drop its terminator
+        query = self.mogrify(query, vars).rstrip(' \t\r\n;')
+
+        # COPY results have no types: describe the query to get them
+        conn = self._conn
+        conn._begin_transaction()
+        self._clear_pgres()
+        self._description = None
+        self._pgres = conn._describe(query)
+        self._pq_fetch_tuples()
+        self._clear_pgres()
+        self._no_tuples = True
+        self._rowcount = -1
+        self._query = "COPY (%s) TO STDOUT" % query
+
+        make_row = self._make_row
+        row_factory = make_row is None and self.row_factory or None
+        return self._iter_copy_rows(
+            self._query, self._casts, make_row, row_factory)
 
     @check_closed
     def setinputsizes(self, sizes):
@@ -626,6 +850,13 @@ class Cursor(object):
             if self._mark != self._conn._mark and not self._withhold:
                 raise ProgrammingError("named cursor isn't valid anymore")
 
+            # the records prefetched are out of sync with the server cursor
+            # position and MOVE would need polling: not worth it.
+            if self._conn._async:
+                raise exceptions.NotSupportedError(
+                    "scroll() not supported on named cursors "
+                    "on asynchronous connections")
+
             # This should also raise a ProgrammingError if the mode is
             # not absolute or relative. But mimic psycopg for now.
             if mode == 'absolute':
@@ -640,8 +871,13 @@ class Cursor(object):
             libpq.PQclear(self._pgres)
             self._pgres = None
 
-    def _pq_execute(self, query, async=False):
-        """Execute the query"""
+    def _pq_execute(self, query, async=False, statuses=None):
+        """Execute the query
+
+        If 'statuses' is a list, the status of the results before the last
+        one are appended to it (only in sync mode).
+
+        """
         pgconn = self._conn._pgconn
 
         # Check the status of the connection
@@ -650,10 +886,14 @@ class Cursor(object):
 
         if not async:
             with self._conn._lock:
-                if not self._conn._have_wait_callback():
+                if self._conn._have_wait_callback():
+                    self._pgres = self._conn._execute_green(query, statuses)
+                elif statuses is None:
                     self._pgres = libpq.PQexec(pgconn, query)
+                elif libpq.PQsendQuery(pgconn, query):
+                    self._pgres = util.pq_get_last_result(pgconn, statuses)
                 else:
-                    self._pgres = self._conn._execute_green(query)
+                    self._pgres = None
                 if not self._pgres:
                     raise self._conn._create_exception(pgres=self._pgres)
                 self._conn._process_notifies()
@@ -683,6 +923,26 @@ class Cursor(object):
             self._conn._async_status = async_status
             self._conn._async_cursor = weakref.ref(self)
 
+    def _pq_execute_copy(self, query, file, size):
+        """Execute a COPY query transferring data from or to file."""
+        self._copysize = size
+        self._copyfile = file
+        if self._conn._async:
+            # the data is transferred by poll(), which releases the file
+            try:
+                self._pq_execute(query, True)
+            except:
+                self._copyfile = None
+                self._copysize = None
+                raise
+            return
+
+        try:
+            self._pq_execute(query)
+        finally:
+            self._copyfile = None
+            self._copysize = None
+
     def _pq_fetch(self):
         pgstatus = libpq.PQresultStatus(self._pgres)
         self._statusmessage = libpq.PQcmdStatus(self._pgres)
@@ -756,60 +1016,344 @@ class Cursor(object):
             self._description = tuple(description)
             self._casts = casts
 
+        if self.row_maker is not None:
+            self._make_row = self.row_maker(self)
+        else:
+            self._make_row = None
+
     def _pq_fetch_copy_in(self):
+        self._pq_copy(self._pq_copy_in_steps())
+
+    def _pq_copy(self, steps):
+        """Run the steps of a COPY operation.
+
+        The steps generate POLL_READ or POLL_WRITE when they must wait for
+        the connection: on async connections they are advanced by poll(),
+        in green mode the wait callback is used to wait. On blocking
+        connections nothing is generated.
+
+        """
+        conn = self._conn
+        if conn._async:
+            conn._copy_steps = self._pq_async_copy(steps)
+            return
+
+        green = conn._have_wait_callback()
+        if green:
+            util.pq_set_non_blocking(conn._pgconn, 1, True)
+        try:
+            for state in steps:
+                conn._wait_copy(state)
+        finally:
+            if green:
+                util.pq_set_non_blocking(conn._pgconn, 0)
+
+    def _pq_async_copy(self, steps):
+        try:
+            for state in steps:
+                yield state
+        finally:
+            self._copyfile = None
+            self._copysize = None
+
+    def _pq_copy_in_steps(self):
+        """Send the copy file to the backend and read the result."""
+        pgconn = self._conn._pgconn
+        if isinstance(self._copyfile, util.buffer_types):
+            put_copy_data = self._pq_put_copy_buffer
+        else:
+            put_copy_data = self._pq_put_copy_file
+
+        errmsg = None
+        try:
+            for state in put_copy_data():
+                yield state
+        except _CopyPutError:
+            errmsg = 'error in PQputCopyData() call'
+        except Exception:
+            # Abort the COPY, so that the connection is usable again
+            exc_info = sys.exc_info()
+            for state in self._pq_put_copy_end(
+                    'error reading the copy source'):
+                yield state
+            self._clear_pgres()
+            util.pq_clear_async(pgconn)
+            raise exc_info[0], exc_info[1], exc_info[2]
+
+        for state in self._pq_put_copy_end(errmsg):
+            yield state
+        self._clear_pgres()
+        self._pq_fetch_copy_result()
+
+    def _pq_put_copy_data(self, buf, length):
+        """Pass a block of data to libpq, waiting if its buffer is full."""
         pgconn = self._conn._pgconn
+        while 1:
+            res = libpq.PQputCopyData(pgconn, buf, length)
+            if res > 0:
+                return
+            elif res < 0:
+                raise _CopyPutError()
+            yield consts.POLL_WRITE
+
+    def _pq_put_copy_end(self, errmsg):
+        """Terminate COPY FROM and wait for its result to be available."""
+        conn = self._conn
+        pgconn = conn._pgconn
+        while 1:
+            res = libpq.PQputCopyEnd(pgconn, errmsg)
+            if res > 0:
+                break
+            elif res < 0:
+                raise conn._create_exception()
+            yield consts.POLL_WRITE
+
+        if conn._async or conn._have_wait_callback():
+            for state in self._pq_wait_copy_result():
+                yield state
+
+    def _pq_wait_copy_result(self):
+        """Flush the data sent and wait until the result can be read."""
+        conn = self._conn
+        pgconn = conn._pgconn
+        while 1:
+            res = libpq.PQflush(pgconn)
+            if res == 0:
+                break
+            elif res < 0:
+                raise conn._create_exception()
+            yield consts.POLL_WRITE
+
+        while libpq.PQisBusy(pgconn):
+            yield consts.POLL_READ
+            if not libpq.PQconsumeInput(pgconn):
+                raise conn._create_exception()
+
+    def _pq_put_copy_file(self):
+        """Send the data read from the copy file."""
         size = self._copysize
-        error = 0
         while True:
             data = self._copyfile.read(size)
             if isinstance(self._copyfile, TextIOBase):
                 data = data.encode(self._conn._py_enc)
 
             if not data:
-                break
+                return
 
-            res = libpq.PQputCopyData(pgconn, data, len(data))
-            if res <= 0:
-                error = 2
-                break
+            for state in self._pq_put_copy_data(data, len(data)):
+                yield state
 
-        errmsg = None
-        if error == 2:
-            errmsg = 'error in PQputCopyData() call'
+    def _pq_put_copy_buffer(self):
+        """Send the memory of a bytes-like object.
 
-        libpq.PQputCopyEnd(pgconn, errmsg)
-        self._clear_pgres()
-        util.pq_clear_async(pgconn)
+        The data is passed to libpq in slices, with no copy when the object
+        exposes its memory. The slices grow while the data is sent quickly
+        and shrink when the socket doesn't keep up.
+
+        """
+        data = self._copyfile
+        start = 0
+        if isinstance(data, mmap.mmap):
+            start = data.tell()
+
+        pointer = util.get_buffer_pointer(data)
+        if pointer is not None:
+            address, length = pointer
+        else:
+            # memoryview on Python 2: copy a slice at time
+            try:
+                data = memoryview(data)
+            except NameError:
+                # Python 2.6: slices of a buffer are strings
+                data = buffer(data)
+            else:
+                if data.itemsize != 1:
+                    data = memoryview(data.tobytes())
+            address, length = None, len(data)
+
+        chunk = max(self._copysize or 0, _COPY_MIN_CHUNK)
+        pos = start
+        while pos < length:
+            n = min(chunk, length - pos)
+            if address is not None:
+                buf = address + pos
+            else:
+                buf = data[pos:pos + n]
+                if not isinstance(buf, str):
+                    buf = buf.tobytes()
+
+            t0 = time.time()
+            for state in self._pq_put_copy_data(buf, n):
+                yield state
+            elapsed = time.time() - t0
+            pos += n
+
+            if elapsed < _COPY_FAST_PUT and chunk < _COPY_MAX_CHUNK:
+                chunk *= 2
+            elif elapsed > _COPY_SLOW_PUT and chunk > _COPY_MIN_CHUNK:
+                chunk //= 2
+
+        if isinstance(self._copyfile, mmap.mmap):
+            self._copyfile.seek(pos)
+
+    def _iter_copy_rows(self, query, casts, make_row, row_factory):
+        # The COPY is only started by the first next(): an iterator never
+        # used doesn't leave the connection in COPY OUT state.
+        conn = self._conn
+        pgconn = conn._pgconn
+        with conn._lock:
+            if not conn._have_wait_callback():
+                pgres = libpq.PQexec(pgconn, query)
+            else:
+                pgres = conn._execute_green(query)
+        try:
+            if libpq.PQresultStatus(pgres) != libpq.PGRES_COPY_OUT:
+                raise conn._create_exception(pgres=pgres)
+        finally:
+            if pgres:
+                libpq.PQclear(pgres)
+
+        async = int(conn._have_wait_callback())
+        buf = libpq.pointer(libpq.c_char_p())
+        done = False
+        try:
+            while True:
+                length = libpq.PQgetCopyData(pgconn, buf, async)
+                if length > 0:
+                    line = libpq.string_at(buf.contents, length)
+                    libpq.PQfreemem(buf.contents)
+                elif length == 0:
+                    conn._wait_copy()
+                    continue
+                elif length == -2:
+                    raise conn._create_exception()
+                else:
+                    break
+
+                if casts:
+                    values = copyformat.parse_text_row(line)
+                else:
+                    values = ()
+
+                if row_factory:
+                    row = row_factory(self)
+                else:
+                    row = [None] * len(casts)
+                for i, val in enumerate(values):
+                    if val is not None:
+                        val = typecasts.typecast(casts[i], val, len(val), self)
+                    row[i] = val
+
+                if row_factory:
+                    yield row
+                elif make_row is not None:
+                    yield make_row(tuple(row))
+                else:
+                    yield tuple(row)
+
+            done = True
+
+        finally:
+            if not done:
+                self._pq_discard_copy_out()
+            self._pq_fetch_copy_result(check=done)
 
     def _pq_fetch_copy_out(self):
-        is_text = isinstance(self._copyfile, TextIOBase)
+        self._pq_copy(self._pq_copy_out_steps())
+
+    def _pq_copy_out_steps(self):
+        """Write the data received from the backend to the copy file."""
+        file = self._copyfile
+        is_text = isinstance(file, TextIOBase)
+        if isinstance(file, bytearray):
+            write = file.extend
+        else:
+            write = file.write
+
+        # In async and green mode don't block waiting for data, but wait
+        # for the connection to become readable
+        conn = self._conn
+        pgconn = conn._pgconn
+        async = int(conn._async or conn._have_wait_callback())
+
+        # Coalesce the rows in blocks of about size bytes
+        size = self._copysize or 0
+        chunks = []
+        pending = 0
+
+        self._clear_pgres()
+        buf = libpq.pointer(libpq.c_char_p())
+        try:
+            while True:
+                length = libpq.PQgetCopyData(pgconn, buf, async)
+                if length > 0:
+                    chunks.append(libpq.string_at(buf.contents, length))
+                    libpq.PQfreemem(buf.contents)
+                    pending += length
+                    if pending < size:
+                        continue
+                elif length == 0:
+                    yield consts.POLL_READ
+                    if not libpq.PQconsumeInput(pgconn):
+                        raise conn._create_exception()
+                    continue
+                elif length == -2:
+                    raise conn._create_exception()
+
+                if chunks:
+                    data = ''.join(chunks)
+                    if is_text:
+                        data = typecasts.parse_unicode(data, len(data), self)
+                    write(data)
+                    chunks = []
+                    pending = 0
+
+                if length < 0:
+                    break
+
+        except Exception:
+            self._pq_discard_copy_out()
+            self._pq_fetch_copy_result(check=False)
+            raise
+
+        if async:
+            for state in self._pq_wait_copy_result():
+                yield state
+        self._pq_fetch_copy_result()
+
+    def _pq_discard_copy_out(self):
+        """Discard the data left in a COPY TO operation."""
         pgconn = self._conn._pgconn
-        while True:
-            buf = libpq.pointer(libpq.c_char_p())
-            length = libpq.PQgetCopyData(pgconn, buf, 0)
+        buf = libpq.pointer(libpq.c_char_p())
+        while libpq.PQgetCopyData(pgconn, buf, 0) > 0:
+            libpq.PQfreemem(buf.contents)
 
-            if length > 0:
-                value = buf.contents.value
-                if is_text:
-                    value = typecasts.parse_unicode(value, length, self)
-                libpq.PQfreemem(buf.contents)
+    def _pq_fetch_copy_result(self, check=True):
+        """Read the result at the end of a COPY operation.
 
-                if value is None:
-                    return
+        Set rowcount and, if `check` is true, raise the error occurred.
 
-                self._copyfile.write(value)
-            elif length == -2:
-                raise self._conn._create_exception()
-            else:
-                break
+        """
+        self._pgres = util.pq_get_last_result(self._conn._pgconn)
+        if not self._pgres:
+            return
 
-        self._clear_pgres()
-        util.pq_clear_async(pgconn)
+        try:
+            if check and \
+                    libpq.PQresultStatus(self._pgres) != libpq.PGRES_COMMAND_OK:
+                raise self._conn._create_exception(pgres=self._pgres)
+
+            rowcount = libpq.PQcmdTuples(self._pgres)
+            if rowcount:
+                self._rowcount = int(rowcount)
+        finally:
+            self._clear_pgres()
 
     def _build_row(self, row_num):
+        make_row = self._make_row
 
         # Create the row
-        if self.row_factory:
+        if self.row_factory and make_row is None:
             row = self.row_factory(self)
             is_tuple = False
         else:
@@ -831,9 +1375,69 @@ class Cursor(object):
             row[i] = val
 
         if is_tuple:
+            if make_row is not None:
+                return make_row(tuple(row))
             return tuple(row)
         return row
 
+    def _build_rows(self, start, stop):
+        """Build the rows from start up to stop of the current result.
+
+        The values are decoded a column at a time, so the typecaster lookup
+        is done once per column instead of once per value, and the rows are
+        then assembled from the column slices in a single pass.
+
+        """
+        make_row = self._make_row
+        if self.row_factory and make_row is None:
+            return [self._build_row(i) for i in xrange(start, stop)]
+
+        pgres = self._pgres
+        row_nums = xrange(start, stop)
+        columns = []
+        for i in xrange(self._nfields):
+            cast = self._casts[i]
+            column = []
+            append = column.append
+            for row_num in row_nums:
+                # PQgetvalue will return an empty string for null values,
+                # so check with PQgetisnull if the value is really null
+                val = libpq.PQgetvalue(pgres, row_num, i)
+                if not val and libpq.PQgetisnull(pgres, row_num, i):
+                    append(None)
+                else:
+                    length = libpq.PQgetlength(pgres, row_num, i)
+                    append(typecasts.typecast(cast, val, length, self))
+            columns.append(column)
+
+        if columns:
+            rows = zip(*columns)
+        else:
+            rows = [()] * len(row_nums)
+
+        if make_row is not None:
+            return map(make_row, rows)
+        return rows
+
+    def _fetch_columns(self, size, dtypes):
+        """Fetch up to size rows as column arrays; return (arrays, nrows)."""
+        if self._name is not None and not self._conn._async:
+            if size is None:
+                self._pq_execute('FETCH FORWARD ALL FROM "%s"' % self._name)
+            else:
+                self._pq_execute(
+                    'FETCH FORWARD %d FROM "%s"' % (size, self._name))
+
+        remaining = max(self._rowcount - self._rownumber, 0)
+        if size is None or size > remaining or size < 0:
+            size = remaining
+
+        dtypes = columnar.column_dtypes(self, dtypes)
+        arrays = columnar.fetch_columns(
+            self, self._rownumber, self._rownumber + size, dtypes)
+        self._rownumber += size
+        return arrays, size
+
     def _get_cast(self, oid):
         try:
             return self._typecasts[oid]
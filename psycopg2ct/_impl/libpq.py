@@ -142,6 +142,14 @@ PQexec = libpq.PQexec
 PQexec.argtypes = [PGconn_p, c_char_p]
 PQexec.restype = PGresult_p
 
+PQprepare = libpq.PQprepare
+PQprepare.argtypes = [PGconn_p, c_char_p, c_char_p, c_int, c_void_p]
+PQprepare.restype = PGresult_p
+
+PQdescribePrepared = libpq.PQdescribePrepared
+PQdescribePrepared.argtypes = [PGconn_p, c_char_p]
+PQdescribePrepared.restype = PGresult_p
+
 PQresultStatus = libpq.PQresultStatus
 PQresultStatus.argtypes = [PGresult_p]
 PQresultStatus.restype = ExecStatusType
@@ -243,6 +251,14 @@ PQsendQuery = libpq.PQsendQuery
 PQsendQuery.argtypes = [PGconn_p, c_char_p]
 PQsendQuery.restype = c_int
 
+PQsendPrepare = libpq.PQsendPrepare
+PQsendPrepare.argtypes = [PGconn_p, c_char_p, c_char_p, c_int, c_void_p]
+PQsendPrepare.restype = c_int
+
+PQsendDescribePrepared = libpq.PQsendDescribePrepared
+PQsendDescribePrepared.argtypes = [PGconn_p, c_char_p]
+PQsendDescribePrepared.restype = c_int
+
 PQgetResult = libpq.PQgetResult
 PQgetResult.argtypes = [PGconn_p]
 PQgetResult.restype = PGresult_p
@@ -288,7 +304,7 @@ PQgetCopyData.argtypes = [PGconn_p, POINTER(c_char_p), c_int]
 PQgetCopyData.restype = c_int
 
 PQputCopyData = libpq.PQputCopyData
-PQputCopyData.argtypes = [PGconn_p, c_char_p, c_int]
+PQputCopyData.argtypes = [PGconn_p, c_void_p, c_int]
 PQputCopyData.restype = c_int
 
 PQputCopyEnd = libpq.PQputCopyEnd
@@ -1,3 +1,6 @@
+import ctypes
+import mmap
+
 from psycopg2ct._impl import exceptions
 from psycopg2ct._impl import libpq
 from psycopg2ct._impl.adapters import QuotedString
@@ -15,27 +18,86 @@ def pq_clear_async(pgconn):
         pgres = libpq.PQgetResult(pgconn)
         if not pgres:
             break
+        status = libpq.PQresultStatus(pgres)
         libpq.PQclear(pgres)
+        if status in _copy_statuses:
+            break
+
+
+_copy_statuses = (libpq.PGRES_COPY_IN, libpq.PGRES_COPY_OUT)
+
 
+def pq_get_last_result(pgconn, statuses=None):
+    """Return the last result of a query, discarding the ones before.
 
-def pq_get_last_result(pgconn):
+    If 'statuses' is a list, append to it the status of the discarded
+    results.
+    """
     pgres_next = None
     pgres = libpq.PQgetResult(pgconn)
     if not pgres:
         return
 
     while True:
+        # A COPY result is returned until the COPY is complete
+        if libpq.PQresultStatus(pgres) in _copy_statuses:
+            break
+
         pgres_next = libpq.PQgetResult(pgconn)
         if not pgres_next:
             break
 
         if pgres:
+            if statuses is not None:
+                statuses.append(libpq.PQresultStatus(pgres))
             libpq.PQclear(pgres)
         pgres = pgres_next
 
     return pgres
 
 
+#: The bytes-like objects whose memory can be sent without copies
+buffer_types = (str, buffer, bytearray, mmap.mmap)
+try:
+    buffer_types += (memoryview,)
+except NameError:
+    # Python 2.6
+    pass
+
+try:
+    _c_ssize_t = ctypes.c_ssize_t
+except AttributeError:
+    # Python 2.6: Py_ssize_t has the size of size_t
+    _c_ssize_t = ctypes.c_size_t
+
+try:
+    _as_read_buffer = ctypes.pythonapi.PyObject_AsReadBuffer
+    _as_read_buffer.argtypes = [ctypes.py_object,
+        ctypes.POINTER(ctypes.c_void_p), ctypes.POINTER(_c_ssize_t)]
+    _as_read_buffer.restype = ctypes.c_int
+except AttributeError:
+    # PyPy
+    _as_read_buffer = None
+
+
+def get_buffer_pointer(obj):
+    """Return the address and the length of the memory of a buffer.
+
+    Return None if the object doesn't expose its memory.
+
+    """
+    if _as_read_buffer is None:
+        return None
+
+    address = ctypes.c_void_p()
+    length = _c_ssize_t()
+    try:
+        _as_read_buffer(obj, ctypes.byref(address), ctypes.byref(length))
+    except TypeError:
+        return None
+    return address.value or 0, length.value
+
+
 def quote_string(conn, value):
     obj = QuotedString(value)
     obj.prepare(conn)
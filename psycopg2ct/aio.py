@@ -0,0 +1,732 @@
+"""Connections and cursors for asyncio event loops.
+
+This module requires trollius_, the asyncio port for Python 2: its
+coroutines are written using ``yield From(...)`` instead of ``yield from``.
+
+The connections are psycopg async connections: instead of blocking, every
+operation polls the connection and waits for its socket to be ready using
+the event loop `!add_reader()`/`!add_writer()`, so that many queries, on
+different connections, can run concurrently in a single thread. For
+example::
+
+    @asyncio.coroutine
+    def main():
+        conn = yield From(aio.connect(dsn))
+        cur = conn.cursor()
+        yield From(cur.execute("select %s", (42,)))
+        row = yield From(cur.fetchone())
+
+As with async connections, the connection is in autocommit mode: use
+`AsyncConnection.begin()`, `!commit()` and `!rollback()` to run several
+statements in a transaction. `AsyncPool` keeps a pool of connections to
+share among tasks.
+
+.. _trollius: https://pypi.python.org/pypi/trollius
+"""
+import sys
+import time
+from collections import deque
+
+import trollius as asyncio
+from trollius import From, Return
+
+import psycopg2ct as _psycopg
+from psycopg2ct._impl import consts
+from psycopg2ct._impl import exceptions
+
+
+@asyncio.coroutine
+def wait(conn, loop=None):
+    """Wait until an async connection has completed its current operation.
+
+    This is the event loop equivalent of `psycopg2.extras.wait_select()`:
+    the connection is polled and, while it is not ready, the coroutine
+    waits for its socket to become readable or writable.
+    """
+    if loop is None:
+        loop = asyncio.get_event_loop()
+
+    while 1:
+        state = conn.poll()
+        if state == consts.POLL_OK:
+            return
+        elif state == consts.POLL_READ:
+            add, remove = loop.add_reader, loop.remove_reader
+        elif state == consts.POLL_WRITE:
+            add, remove = loop.add_writer, loop.remove_writer
+        else:
+            raise exceptions.OperationalError(
+                "bad state from poll: %s" % state)
+
+        # the socket may change while connecting
+        fileno = conn.fileno()
+        fut = asyncio.Future(loop=loop)
+        add(fileno, _set_done, fut)
+        try:
+            yield From(fut)
+        finally:
+            remove(fileno)
+
+
+def _set_done(fut):
+    if not fut.done():
+        fut.set_result(None)
+
+
+@asyncio.coroutine
+def connect(dsn=None, loop=None, **kwargs):
+    """Create a new `AsyncConnection`.
+
+    The arguments are the same of `psycopg2.connect()`; the connection
+    is established without blocking the event loop.
+    """
+    if loop is None:
+        loop = asyncio.get_event_loop()
+    conn = _psycopg.connect(dsn, async=True, **kwargs)
+    try:
+        yield From(wait(conn, loop))
+    except BaseException:
+        conn.close()
+        raise
+    raise Return(AsyncConnection(conn, loop))
+
+
+class AsyncConnection(object):
+    """A connection to use from asyncio coroutines.
+
+    A connection can run a single query at time: the operations requested
+    concurrently by different tasks are executed one after the other.
+    Use several connections (or a pool) to run queries in parallel.
+    """
+
+    def __init__(self, conn, loop=None):
+        if not conn.async:
+            raise exceptions.InterfaceError(
+                "an asynchronous connection is required")
+        if loop is None:
+            loop = asyncio.get_event_loop()
+
+        #: The underlying async connection.
+        self.connection = conn
+        self.loop = loop
+
+        self._lock = asyncio.Lock(loop=loop)
+        self._notifies = deque()
+        self._getters = []
+        self._listening = False
+        self._watching = None
+        self._error = None
+
+    def cursor(self, name=None, cursor_factory=None, withhold=False):
+        """Return a new `AsyncCursor`.
+
+        Named cursors can only be used in a transaction (see `begin()`),
+        unless 'withhold' is True.
+        """
+        return AsyncCursor(self, name, cursor_factory, withhold)
+
+    @property
+    def closed(self):
+        return self.connection.closed
+
+    def close(self):
+        """Close the connection.
+
+        Tasks waiting for notifications receive an `InterfaceError`.
+        """
+        self._unwatch()
+        if not self.connection.closed:
+            self.connection.close()
+        self._fail(exceptions.InterfaceError("connection already closed"))
+
+    @asyncio.coroutine
+    def execute(self, query, vars=None):
+        """Execute a query on a new cursor and return the cursor."""
+        cur = self.cursor()
+        yield From(cur.execute(query, vars))
+        raise Return(cur)
+
+    @asyncio.coroutine
+    def begin(self):
+        """Start a transaction."""
+        yield From(self.execute("BEGIN"))
+
+    @asyncio.coroutine
+    def commit(self):
+        """Commit the current transaction."""
+        yield From(self.execute("COMMIT"))
+
+    @asyncio.coroutine
+    def rollback(self):
+        """Roll back the current transaction."""
+        yield From(self.execute("ROLLBACK"))
+
+    @asyncio.coroutine
+    def listen(self, channel):
+        """Start listening for notifications on a channel.
+
+        The notifications are received in background, whenever the
+        connection is idle, and returned by `get_notify()`.
+        """
+        yield From(self.execute('LISTEN "%s"' % channel.replace('"', '""')))
+        self._listening = True
+        self._dispatch_notifies()
+        if not self._lock.locked():
+            self._watch()
+
+    @asyncio.coroutine
+    def get_notify(self):
+        """Return the next `~psycopg2.extensions.Notify` received."""
+        while not self._notifies:
+            if self._error is not None:
+                raise self._error
+            if not self._listening:
+                raise exceptions.ProgrammingError(
+                    "the connection is not listening to any channel")
+            fut = asyncio.Future(loop=self.loop)
+            self._getters.append(fut)
+            try:
+                yield From(fut)
+            finally:
+                self._getters.remove(fut)
+
+        raise Return(self._notifies.popleft())
+
+    @asyncio.coroutine
+    def _run(self, func, *args):
+        """Call func(*args) on the connection and wait for the result.
+
+        The connection lock is held for the whole operation. If the task is
+        cancelled the query is cancelled on the server too, and the
+        connection left ready for the next one.
+        """
+        yield From(self._lock.acquire())
+        try:
+            self._unwatch()
+            rv = func(*args)
+            try:
+                yield From(wait(self.connection, self.loop))
+            except asyncio.CancelledError:
+                exc_info = sys.exc_info()
+                self.connection.cancel()
+                try:
+                    yield From(wait(self.connection, self.loop))
+                except exceptions.Error:
+                    pass
+                raise exc_info[0], exc_info[1], exc_info[2]
+            finally:
+                self._dispatch_notifies()
+        finally:
+            self._lock.release()
+            if self._listening and not self.connection.closed:
+                self._watch()
+        raise Return(rv)
+
+    def _watch(self):
+        """Wait for notifications while the connection is idle."""
+        if self._watching is None:
+            self._watching = self.connection.fileno()
+            self.loop.add_reader(self._watching, self._idle_read)
+
+    def _unwatch(self):
+        if self._watching is not None:
+            self.loop.remove_reader(self._watching)
+            self._watching = None
+
+    def _idle_read(self):
+        if self._lock.locked():
+            # a query is about to start: it will read the data
+            self._unwatch()
+            return
+        try:
+            self.connection.poll()
+        except exceptions.Error, e:
+            self._unwatch()
+            self._fail(e)
+            return
+        self._dispatch_notifies()
+
+    def _dispatch_notifies(self):
+        notifies = self.connection.notifies
+        if notifies:
+            self._notifies.extend(notifies)
+            del notifies[:]
+            self._wake_getters()
+
+    def _fail(self, error):
+        self._error = error
+        self._wake_getters()
+
+    def _wake_getters(self):
+        # the tasks blocked in get_notify() check again what happened
+        for fut in self._getters:
+            _set_done(fut)
+
+
+class AsyncCursor(object):
+    """A cursor to use from asyncio coroutines.
+
+    The methods performing I/O are coroutines; the other attributes are the
+    ones of the underlying cursor.
+
+    Named cursors receive the result from the server in chunks of
+    `!itersize` records, so that large results can be read using constant
+    memory.
+    """
+
+    def __init__(self, conn, name=None, cursor_factory=None, withhold=False):
+        self.connection = conn
+        if cursor_factory is None:
+            self.cursor = conn.connection._cursor(name, withhold=withhold)
+        else:
+            self.cursor = conn.connection._cursor(name,
+                cursor_factory=cursor_factory, withhold=withhold)
+
+        # True when the named cursor has sent all its records
+        self._exhausted = False
+
+    @asyncio.coroutine
+    def execute(self, query, vars=None):
+        """Execute a query."""
+        itersize = self.cursor.itersize
+        yield From(self.connection._run(self.cursor.execute, query, vars))
+        if self.cursor.name is not None:
+            self._exhausted = self.cursor.rowcount < itersize
+
+    @asyncio.coroutine
+    def callproc(self, procname, parameters=None):
+        """Call a stored database procedure."""
+        rv = yield From(self.connection._run(
+            self.cursor.callproc, procname, parameters))
+        raise Return(rv)
+
+    @asyncio.coroutine
+    def copy_from(self, file, table, sep='\t', null='\\N', size=8192,
+            columns=None):
+        """Load a table from a file-like object using COPY FROM."""
+        yield From(self.connection._run(self.cursor.copy_from,
+            file, table, sep, null, size, columns))
+
+    @asyncio.coroutine
+    def copy_to(self, file, table, sep='\t', null='\\N', columns=None,
+            size=8192):
+        """Write a table to a file-like object using COPY TO."""
+        yield From(self.connection._run(self.cursor.copy_to,
+            file, table, sep, null, columns, size))
+
+    @asyncio.coroutine
+    def copy_expert(self, sql, file, size=8192):
+        """Execute a COPY statement reading or writing a file-like object.
+
+        The data is transferred while the event loop keeps running the
+        other tasks.
+        """
+        yield From(self.connection._run(self.cursor.copy_expert,
+            sql, file, size))
+
+    @asyncio.coroutine
+    def fetchone(self):
+        """Return the next record of the result."""
+        row = self.cursor.fetchone()
+        if row is None and self._more():
+            yield From(self._prefetch(self.cursor.itersize))
+            row = self.cursor.fetchone()
+        raise Return(row)
+
+    @asyncio.coroutine
+    def fetchmany(self, size=None):
+        """Return the next `size` records of the result."""
+        if size is None:
+            size = self.cursor.arraysize
+        rows = self.cursor.fetchmany(size)
+        if len(rows) < size and self._more():
+            missing = size - len(rows)
+            yield From(self._prefetch(max(missing, self.cursor.itersize)))
+            rows = rows + self.cursor.fetchmany(missing)
+        raise Return(rows)
+
+    @asyncio.coroutine
+    def fetchall(self):
+        """Return the remaining records of the result."""
+        rows = self.cursor.fetchall()
+        if self._more():
+            yield From(self._prefetch(-1))
+            rows = rows + self.cursor.fetchall()
+        raise Return(rows)
+
+    def close(self):
+        """Close the cursor.
+
+        Closing a named cursor requires a query to the server, executed in
+        background: return the task running it, which can be waited for.
+        The connection polls the query to completion before running the
+        next one, so it is not necessary to wait for the task before using
+        the connection again.
+        """
+        if self.cursor.name is None:
+            self.cursor.close()
+        else:
+            return asyncio.ensure_future(
+                self.connection._run(self.cursor.close),
+                loop=self.connection.loop)
+
+    def _more(self):
+        """Return True if a named cursor has more records on the server."""
+        return self.cursor.name is not None and not self._exhausted
+
+    @asyncio.coroutine
+    def _prefetch(self, size):
+        yield From(self.connection._run(self.cursor.prefetch, size))
+        self._exhausted = size < 0 or self.cursor.rowcount < size
+
+    @property
+    def closed(self):
+        return self.cursor.closed
+
+    @property
+    def description(self):
+        return self.cursor.description
+
+    @property
+    def rowcount(self):
+        return self.cursor.rowcount
+
+    @property
+    def statusmessage(self):
+        return self.cursor.statusmessage
+
+    @property
+    def query(self):
+        return self.cursor.query
+
+
+def _pool_module():
+    # psycopg2ct.pool imports psycopg2: only require it for the pool
+    from psycopg2ct import pool
+    return pool
+
+
+@asyncio.coroutine
+def create_pool(minconn, maxconn, dsn=None, loop=None, **kwargs):
+    """Create an `AsyncPool` and open its first 'minconn' connections."""
+    pool = AsyncPool(minconn, maxconn, dsn, loop=loop, **kwargs)
+    yield From(pool.open())
+    raise Return(pool)
+
+
+class AsyncPool(object):
+    """A pool of `AsyncConnection` for asyncio applications.
+
+    The pool mirrors `psycopg2.pool.ThreadedConnectionPool`: it keeps up to
+    'minconn' idle connections and opens up to 'maxconn' connections in
+    total; the arguments 'max_lifetime', 'max_idle', 'ping_idle',
+    'maintenance_interval', 'stats' and 'stats_callback' have the same
+    meaning. The other arguments are passed to `connect()`.
+
+    New connections are opened in background tasks, concurrently, while the
+    tasks requesting them wait in line. Use `create_pool()` to obtain a
+    pool with its first connections already open.
+    """
+
+    def __init__(self, minconn, maxconn, dsn=None, loop=None,
+            max_lifetime=None, max_idle=None, ping_idle=None,
+            maintenance_interval=None, stats=False, stats_callback=None,
+            **kwargs):
+        if loop is None:
+            loop = asyncio.get_event_loop()
+
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.loop = loop
+        self.closed = False
+
+        self.max_lifetime = max_lifetime
+        self.max_idle = max_idle
+        self.ping_idle = ping_idle
+        self.maintenance_interval = maintenance_interval
+
+        if stats or stats_callback is not None:
+            self.stats = _pool_module().PoolStats(stats_callback)
+        else:
+            self.stats = None
+
+        self._dsn = dsn
+        self._kwargs = kwargs
+
+        self._pool = []
+        self._used = set()
+        self._connecting = 0
+        self._waiters = deque()
+        self._created = {} # id(conn) -> creation time
+        self._idle = {} # id(conn) -> time it was put into the pool
+        self._maintenance = None
+
+    @asyncio.coroutine
+    def open(self):
+        """Open the first 'minconn' connections, concurrently."""
+        missing = self.minconn - len(self._pool) - len(self._used)
+        if missing > 0:
+            yield From(self._add_connections(missing, fail=True))
+
+        if self.maintenance_interval is not None and self._maintenance is None:
+            self._maintenance = asyncio.ensure_future(
+                self._maintenance_loop(), loop=self.loop)
+
+    @asyncio.coroutine
+    def acquire(self, timeout=None):
+        """Return a connection from the pool.
+
+        If the pool is exhausted wait up to 'timeout' seconds (forever if
+        None) for a connection to be released or opened, then raise
+        `PoolError`. With a 'timeout' of 0 a new connection is opened if
+        the pool is not full, else the error is raised immediately. The
+        waiting tasks are served in order of arrival.
+        """
+        pool = _pool_module()
+        start = self.loop.time()
+        fut = None
+        try:
+            while 1:
+                if self.closed:
+                    raise pool.PoolError("connection pool is closed")
+
+                if not self._waiters or self._waiters[0] is fut:
+                    conn = yield From(self._get_idle())
+                    if conn is not None:
+                        if self.stats is not None:
+                            self.stats._checkout(conn,
+                                self._waited(fut, start), len(self._used))
+                        raise Return(conn)
+
+                    if self._size() < self.maxconn:
+                        if timeout == 0:
+                            yield From(self._add_connections(1, fail=True))
+                            continue
+                        if self._connecting \
+                                < len(self._waiters) + (fut is None):
+                            self._spawn_connection()
+
+                if timeout is not None:
+                    remaining = start + timeout - self.loop.time()
+                    if remaining <= 0:
+                        if self.stats is not None:
+                            self.stats._exhausted(self._waited(fut, start))
+                        raise pool.PoolError("connection pool exausted")
+
+                if fut is None:
+                    fut = asyncio.Future(loop=self.loop)
+                    self._waiters.append(fut)
+                elif fut.done():
+                    # only the first in line is woken up: wait for the next
+                    # connection keeping the place
+                    fut = self._waiters[0] = asyncio.Future(loop=self.loop)
+
+                if timeout is None:
+                    yield From(asyncio.shield(fut, loop=self.loop))
+                else:
+                    try:
+                        yield From(asyncio.wait_for(
+                            asyncio.shield(fut, loop=self.loop), remaining,
+                            loop=self.loop))
+                    except asyncio.TimeoutError:
+                        pass
+
+        finally:
+            if fut is not None:
+                self._waiters.remove(fut)
+                self._wake()
+
+    @asyncio.coroutine
+    def release(self, conn, close=False):
+        """Put back a connection in the pool.
+
+        An open transaction is rolled back. The connection is closed if
+        'close' is True or if the pool has enough idle connections.
+        """
+        pool = _pool_module()
+        if conn not in self._used:
+            raise pool.PoolError("trying to put unkeyed connection")
+        if self.stats is not None:
+            self.stats._checkin(conn)
+
+        keep = (not close and not self.closed and not conn.closed
+            and not self._expired(conn, time.time())
+            and (len(self._pool) < self.minconn or self._waiters))
+        if keep:
+            status = conn.connection.get_transaction_status()
+            if status == consts.TRANSACTION_STATUS_UNKNOWN:
+                keep = False
+            elif status != consts.TRANSACTION_STATUS_IDLE:
+                try:
+                    yield From(conn.rollback())
+                except exceptions.Error:
+                    keep = False
+
+        self._used.discard(conn)
+        if keep and not self.closed:
+            self._pool.append(conn)
+            self._idle[id(conn)] = time.time()
+        else:
+            self._discard(conn)
+            self._top_up()
+        self._wake()
+
+    def closeall(self):
+        """Close all the connections, even the ones in use.
+
+        The tasks waiting for a connection receive a `PoolError`.
+        """
+        if self.closed:
+            raise _pool_module().PoolError("connection pool is closed")
+        self.closed = True
+        if self._maintenance is not None:
+            self._maintenance.cancel()
+        for conn in self._pool + list(self._used):
+            conn.close()
+        del self._pool[:]
+        self._used.clear()
+        self._created.clear()
+        self._idle.clear()
+        for fut in self._waiters:
+            _set_done(fut)
+
+    def get_stats(self):
+        """Return a snapshot of the pool statistics, None if not enabled.
+
+        The snapshot has the same format of the threaded pools one.
+        """
+        if self.stats is None:
+            return None
+        rv = self.stats.snapshot()
+        rv['idle'] = len(self._pool)
+        rv['used'] = len(self._used)
+        rv['size'] = rv['idle'] + rv['used']
+        return rv
+
+    def _waited(self, fut, start):
+        if fut is not None:
+            return self.loop.time() - start
+
+    def _size(self):
+        return len(self._pool) + len(self._used) + self._connecting
+
+    def _wake(self):
+        """Wake up the first waiting task, to let it try again."""
+        if self._waiters:
+            _set_done(self._waiters[0])
+
+    def _expired(self, conn, now):
+        return (self.max_lifetime is not None
+            and now - self._created.get(id(conn), now) >= self.max_lifetime)
+
+    def _broken(self, conn, now):
+        return (conn.closed or self._expired(conn, now)
+            or conn.connection.get_transaction_status()
+                == consts.TRANSACTION_STATUS_UNKNOWN)
+
+    def _discard(self, conn):
+        self._created.pop(id(conn), None)
+        self._idle.pop(id(conn), None)
+        if not conn.closed:
+            conn.close()
+        if self.stats is not None:
+            self.stats._closed()
+
+    @asyncio.coroutine
+    def _get_idle(self):
+        """Return a healthy idle connection, marked as used, or None."""
+        while self._pool:
+            conn = self._pool.pop()
+            now = time.time()
+            if self._broken(conn, now):
+                self._discard(conn)
+                continue
+
+            idle = self._idle.pop(id(conn), now)
+            self._used.add(conn)
+            if self.ping_idle is not None and now - idle >= self.ping_idle:
+                try:
+                    yield From(conn.execute("SELECT 1"))
+                except exceptions.Error:
+                    self._used.discard(conn)
+                    self._discard(conn)
+                    continue
+
+            raise Return(conn)
+
+    def _spawn_connection(self):
+        self._connecting += 1
+        asyncio.ensure_future(self._add_connections(1, counted=True),
+            loop=self.loop)
+
+    def _top_up(self):
+        """Open connections in background to get back to 'minconn'."""
+        if self.closed:
+            return
+        for i in range(self.minconn - self._size()):
+            self._spawn_connection()
+
+    @asyncio.coroutine
+    def _add_connections(self, n, fail=False, counted=False):
+        """Open 'n' connections concurrently and put them in the pool.
+
+        If 'fail' raise the first connection error, else pass it to the
+        first waiting task.
+        """
+        if not counted:
+            self._connecting += n
+        try:
+            results = yield From(asyncio.gather(loop=self.loop,
+                return_exceptions=True,
+                *[connect(self._dsn, loop=self.loop, **self._kwargs)
+                    for i in range(n)]))
+        finally:
+            self._connecting -= n
+
+        errors = []
+        for conn in results:
+            if isinstance(conn, BaseException):
+                errors.append(conn)
+                if self.stats is not None:
+                    self.stats._connected(conn)
+                continue
+
+            if self.stats is not None:
+                self.stats._connected()
+            if self.closed:
+                conn.close()
+                continue
+            now = time.time()
+            self._created[id(conn)] = now
+            self._idle[id(conn)] = now
+            self._pool.append(conn)
+            self._wake()
+
+        if errors:
+            if fail:
+                raise errors[0]
+            if self._waiters and not self._waiters[0].done():
+                self._waiters[0].set_exception(errors[0])
+
+    @asyncio.coroutine
+    def _maintenance_loop(self):
+        """Periodically replace the broken, expired and idle connections."""
+        while not self.closed:
+            yield From(asyncio.sleep(self.maintenance_interval,
+                loop=self.loop))
+
+            now = time.time()
+            for conn in self._pool[:]:
+                if self._broken(conn, now) or (self.max_idle is not None
+                        and now - self._idle.get(id(conn), now)
+                            >= self.max_idle):
+                    self._pool.remove(conn)
+                    self._discard(conn)
+
+            missing = min(self.minconn - len(self._pool),
+                self.maxconn - self._size())
+            if missing > 0:
+                try:
+                    yield From(self._add_connections(missing))
+                except exceptions.Error:
+                    pass
@@ -18,6 +18,9 @@ from psycopg2ct._impl.adapters import Binary, Boolean, Int, Float
 from psycopg2ct._impl.adapters import QuotedString, AsIs, ISQLQuote
 from psycopg2ct._impl.connection import Connection as connection
 from psycopg2ct._impl.consts import *
+from psycopg2ct._impl.copyformat import BinaryEncoder as BinaryCopyEncoder
+from psycopg2ct._impl.copyformat import BinaryDecoder as BinaryCopyDecoder
+from psycopg2ct._impl.copyformat import CopySource
 from psycopg2ct._impl.cursor import Cursor as cursor
 from psycopg2ct._impl.encodings import encodings
 from psycopg2ct._impl.exceptions import QueryCanceledError
@@ -124,6 +124,7 @@ class DictCursor(DictCursorBase):
         kwargs['row_factory'] = DictRow
         DictCursorBase.__init__(self, *args, **kwargs)
         self._prefetch = 1
+        self.row_maker = DictRow._maker
 
     def execute(self, query, vars=None):
         self.index = {}
@@ -135,6 +136,11 @@ class DictCursor(DictCursorBase):
         self._query_executed = 1
         return _cursor.callproc(self, procname, vars)
 
+    def copy_rows(self, query, vars=None):
+        self.index = {}
+        self._query_executed = 1
+        return _cursor.copy_rows(self, query, vars)
+
     def _build_index(self):
         if self._query_executed == 1 and self.description:
             for i in range(len(self.description)):
@@ -194,6 +200,21 @@ class DictRow(list):
     def __contains__(self, x):
         return x in self._index
 
+    @staticmethod
+    def _maker(cursor):
+        """Row maker building `DictRow` objects from the values tuple."""
+        cursor._build_index()
+        index = cursor.index
+        new, init = list.__new__, list.__init__
+
+        def make_row(values):
+            row = new(DictRow)
+            init(row, values)
+            row._index = index
+            return row
+
+        return make_row
+
     # grop the crusty Py2 methods
     if sys.version_info[0] > 2:
         items = iteritems; del iteritems
@@ -223,6 +244,7 @@ class RealDictCursor(DictCursorBase):
         kwargs['row_factory'] = RealDictRow
         DictCursorBase.__init__(self, *args, **kwargs)
         self._prefetch = 0
+        self.row_maker = RealDictRow._maker
 
     def execute(self, query, vars=None):
         self.column_mapping = []
@@ -234,6 +256,11 @@ class RealDictCursor(DictCursorBase):
         self._query_executed = 1
         return _cursor.callproc(self, procname, vars)
 
+    def copy_rows(self, query, vars=None):
+        self.column_mapping = []
+        self._query_executed = 1
+        return _cursor.copy_rows(self, query, vars)
+
     def _build_index(self):
         if self._query_executed == 1 and self.description:
             for i in range(len(self.description)):
@@ -258,6 +285,22 @@ class RealDictRow(dict):
             name = self._column_mapping[name]
         return dict.__setitem__(self, name, value)
 
+    @staticmethod
+    def _maker(cursor):
+        """Row maker building `RealDictRow` objects from the values tuple."""
+        if cursor.description and not cursor.column_mapping:
+            cursor._build_index()
+        mapping = cursor.column_mapping
+        new, init = dict.__new__, dict.__init__
+
+        def make_row(values):
+            row = new(RealDictRow)
+            init(row, zip(mapping, values))
+            row._column_mapping = mapping
+            return row
+
+        return make_row
+
 
 class NamedTupleConnection(_connection):
     """A connection that uses `NamedTupleCursor` automatically."""
@@ -283,6 +326,10 @@ class NamedTupleCursor(_cursor):
     """
     Record = None
 
+    def __init__(self, *args, **kwargs):
+        _cursor.__init__(self, *args, **kwargs)
+        self.row_maker = NamedTupleCursor._record_maker
+
     def execute(self, query, vars=None):
         self.Record = None
         return _cursor.execute(self, query, vars)
@@ -295,27 +342,30 @@ class NamedTupleCursor(_cursor):
         self.Record = None
         return _cursor.callproc(self, procname, vars)
 
-    def fetchone(self):
-        t = _cursor.fetchone(self)
-        if t is not None:
+    def copy_rows(self, query, vars=None):
+        self.Record = None
+        return _cursor.copy_rows(self, query, vars)
+
+    def _record_maker(self):
+        """Row maker building the records straight from the values tuple.
+
+        The `Record` type is created only once per query, also when the rows
+        are fetched in several `!FETCH` roundtrips by a named cursor, and
+        only when the first record is built: a result with names invalid
+        as attributes fails on fetch, not on execute.
+        """
+        nt = self.Record
+        if nt is not None:
+            return nt._make
+
+        def make_record(values):
             nt = self.Record
             if nt is None:
                 nt = self.Record = self._make_nt()
-            return nt(*t)
+                self._make_row = nt._make
+            return nt._make(values)
 
-    def fetchmany(self, size=None):
-        ts = _cursor.fetchmany(self, size)
-        nt = self.Record
-        if nt is None:
-            nt = self.Record = self._make_nt()
-        return [nt(*t) for t in ts]
-
-    def fetchall(self):
-        ts = _cursor.fetchall(self)
-        nt = self.Record
-        if nt is None:
-            nt = self.Record = self._make_nt()
-        return [nt(*t) for t in ts]
+        return make_record
 
     def __iter__(self):
         # Invoking _cursor.__iter__(self) goes to infinite recursion,
@@ -399,6 +449,12 @@ class LoggingCursor(_cursor):
         finally:
             self.connection.log(self.query, self)
 
+    def copy_rows(self, query, vars=None):
+        try:
+            return _cursor.copy_rows(self, query, vars)
+        finally:
+            self.connection.log(self.query, self)
+
 
 class MinTimeLoggingConnection(LoggingConnection):
     """A connection that logs queries based on execution time.
@@ -438,6 +494,10 @@ class MinTimeLoggingCursor(LoggingCursor):
         self.timestamp = time.time()
         return LoggingCursor.execute(self, procname, vars)
 
+    def copy_rows(self, query, vars=None):
+        self.timestamp = time.time()
+        return LoggingCursor.copy_rows(self, query, vars)
+
 
 # a dbtype and adapter for Python UUID type
 
@@ -568,6 +628,159 @@ def wait_select(conn):
             raise OperationalError("bad state from poll: %s" % state)
 
 
+def wait_poll(conn, timeout=None):
+    """Wait until a connection or cursor has data available.
+
+    A wait callback like `wait_select()` using `!poll()` instead of
+    `!select()`: it works with file descriptors beyond ``FD_SETSIZE`` and
+    its cost doesn't depend on the number of files open in the process.
+    Where `!poll()` is not available it falls back to `!select()`.
+
+    If 'timeout' is not None and the operation is not complete after
+    'timeout' seconds, the query is canceled and fails with
+    `~psycopg2.extensions.QueryCanceledError`. Use for instance
+    `!functools.partial()` to register the callback with a timeout.
+    """
+    if timeout is not None:
+        deadline = time.time() + timeout
+    else:
+        deadline = None
+
+    while 1:
+        state = conn.poll()
+        if state == POLL_OK:
+            break
+        elif state != POLL_READ and state != POLL_WRITE:
+            raise OperationalError("bad state from poll: %s" % state)
+
+        remaining = None
+        if deadline is not None:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                # wait for the backend to report the cancellation
+                deadline = None
+                try:
+                    conn.cancel()
+                except psycopg2.Error:
+                    # not connected yet
+                    raise OperationalError("timeout expired")
+                continue
+
+        if state == POLL_READ:
+            _wait_fds([conn.fileno()], [], remaining)
+        else:
+            _wait_fds([], [conn.fileno()], remaining)
+
+if hasattr(select, 'poll'):
+    def _wait_fds(readers, writers, timeout):
+        """Wait for files to be ready, return the ready ones."""
+        poller = select.poll()
+        for fd in readers:
+            poller.register(fd, select.POLLIN)
+        for fd in writers:
+            poller.register(fd, select.POLLOUT)
+        if timeout is None:
+            rv = poller.poll()
+        else:
+            rv = poller.poll(timeout * 1000)
+        return [fd for fd, event in rv]
+else:
+    def _wait_fds(readers, writers, timeout):
+        """Wait for files to be ready, return the ready ones."""
+        r, w, x = select.select(readers, writers, [], timeout)
+        return r + w
+
+
+def fan_out(connections, query, vars=None, timeout=None):
+    """Run the same query concurrently on several async connections.
+
+    The query is sent to all the connections at once, then their results
+    are generated as ``(conn, cursor)`` pairs in order of completion, so
+    that the total time is close to the one of the slowest connection. If
+    the query fails on a connection the exception is generated in place of
+    the cursor.
+
+    If 'timeout' is not None a query still running 'timeout' seconds after
+    it was sent to its connection is canceled and generates a
+    `~psycopg2.extensions.QueryCanceledError`: every connection has its own
+    deadline, so a shard sent late is not penalized by the time spent
+    sending the query to the others. If the generator is closed early the
+    queries still running are canceled too.
+    """
+    running = {}    # fileno -> (conn, cursor)
+    deadlines = {}  # fileno -> time to cancel the query at
+    failed = []
+    for conn in connections:
+        curs = conn.cursor()
+        try:
+            curs.execute(query, vars)
+        except psycopg2.Error, e:
+            failed.append((conn, e))
+        else:
+            fd = conn.fileno()
+            running[fd] = (conn, curs)
+            if timeout is not None:
+                deadlines[fd] = time.time() + timeout
+
+    states = {}     # fileno -> last poll state
+    ready = list(running)
+    try:
+        for item in failed:
+            yield item
+
+        while 1:
+            for fd in ready:
+                conn, curs = running[fd]
+                try:
+                    state = conn.poll()
+                except psycopg2.Error, e:
+                    state = e
+                else:
+                    if state == POLL_READ or state == POLL_WRITE:
+                        states[fd] = state
+                        continue
+                    elif state != POLL_OK:
+                        state = OperationalError(
+                            "bad state from poll: %s" % state)
+
+                del running[fd]
+                states.pop(fd, None)
+                deadlines.pop(fd, None)
+                if state == POLL_OK:
+                    yield conn, curs
+                else:
+                    yield conn, state
+
+            if not running:
+                break
+
+            remaining = None
+            if deadlines:
+                now = time.time()
+                expired = [fd for fd, t in deadlines.items() if t <= now]
+                if expired:
+                    # wait for the backends to report the cancellation
+                    for fd in expired:
+                        del deadlines[fd]
+                        running[fd][0].cancel()
+                    ready = expired
+                    continue
+                remaining = min(deadlines.values()) - now
+
+            ready = _wait_fds(
+                [fd for fd, state in states.items() if state == POLL_READ],
+                [fd for fd, state in states.items() if state == POLL_WRITE],
+                remaining)
+
+    finally:
+        for conn, curs in running.values():
+            try:
+                conn.cancel()
+                wait_poll(conn)
+            except psycopg2.Error:
+                pass
+
+
 class HstoreAdapter(object):
     """Adapt a Python dict to the hstore syntax."""
     def __init__(self, wrapped):
@@ -962,4 +1175,394 @@ def register_composite(name, conn_or_curs, globally=False):
     return caster
 
 
+
+# --- Parallel COPY loader
+
+def copy_parallel(pool, source, table, columns=None, workers=None,
+        sep='\t', null='\\N', size=8 * 1024 * 1024, rows=10000,
+        two_phase=False):
+    """Load data into a table using COPY FROM on several connections at once.
+
+    :param pool: a `~psycopg2.pool.ThreadedConnectionPool` providing the
+        connections
+    :param source: a file-like object with data in COPY text format, or an
+        iterable of records (sequences of Python values)
+    :param table: the name of the table to load
+    :param columns: the columns to load, in the order of the data
+    :param workers: the number of connections to use concurrently (default:
+        *maxconn* of the pool)
+    :param sep: the columns separator of a file source
+    :param null: the representation of NULL of a file source
+    :param size: the size of the chunks read from a file source; the chunks
+        are extended to the end of the line, so no row is split
+    :param rows: the number of records in the chunks of an iterable source
+    :param two_phase: if `!False` (default) every chunk is loaded in its own
+        transaction, so the chunks loaded before an error are kept; if
+        `!True` every connection loads its chunks in a two-phase transaction,
+        and all of them are committed only if all the connections could
+        prepare their transaction
+    :return: the number of rows loaded
+
+    In two-phase mode the rows of different chunks must not conflict with
+    each other (e.g. on a unique key): the connection inserting the second
+    row would wait for the transaction of the first one to finish, which
+    only happens after all the connections have prepared. If committing a
+    prepared transaction fails, the transactions not committed yet are rolled
+    back and the error is raised: the chunks of the transactions already
+    committed are kept.
+
+    The chunks are read in the calling thread and handed to a thread per
+    connection through a bounded queue. The first error raised is re-raised
+    after all the workers have stopped.
+    """
+    import threading
+    import uuid
+    from Queue import Queue
+
+    if workers is None:
+        workers = pool.maxconn
+
+    conns = []
+    try:
+        for i in range(workers):
+            conns.append(pool.getconn())
+
+        if two_phase:
+            gtrid = 'copy_parallel_%s' % uuid.uuid4().hex
+            for i, conn in enumerate(conns):
+                conn.tpc_begin(conn.xid(0, gtrid, 'part_%d' % i))
+
+        state = _CopyState()
+        queue = Queue(maxsize=workers * 2)
+        threads = []
+        try:
+            for conn in conns:
+                t = threading.Thread(target=_copy_worker, args=(
+                    conn, queue, state, table, columns, sep, null, two_phase))
+                t.setDaemon(True)
+                t.start()
+                threads.append(t)
+
+            if hasattr(source, 'read'):
+                chunks = _read_line_chunks(source, size)
+            else:
+                chunks = _read_record_chunks(source, rows)
+            for chunk in chunks:
+                if state.error:
+                    break
+                if not _put_chunk(queue, chunk, threads):
+                    raise psycopg2.InterfaceError(
+                        "the copy workers stopped unexpectedly")
+        except:
+            state.set_error(sys.exc_info())
+        finally:
+            for t in threads:
+                if not _put_chunk(queue, None, threads):
+                    break
+            for t in threads:
+                t.join()
+
+        if two_phase:
+            for conn in conns:
+                if conn.status == _ext.STATUS_READY:
+                    continue    # rolled back by the worker
+                if not state.error:
+                    try:
+                        conn.tpc_commit()
+                        continue
+                    except:
+                        # roll back this and the following transactions
+                        state.set_error(sys.exc_info())
+                try:
+                    conn.tpc_rollback()
+                except psycopg2.Error:
+                    pass    # e.g. broken: don't hide the first error
+
+        if state.error:
+            raise state.error[0], state.error[1], state.error[2]
+        return state.rows
+
+    finally:
+        for conn in conns:
+            if not conn.closed:
+                conn.rollback()
+            pool.putconn(conn)
+
+
+class _CopyState(object):
+    """The state shared by the copy_parallel() workers."""
+    def __init__(self):
+        import threading
+        self._lock = threading.Lock()
+        self.rows = 0
+        self.error = None
+
+    def add_rows(self, n):
+        self._lock.acquire()
+        try:
+            self.rows += n
+        finally:
+            self._lock.release()
+
+    def set_error(self, exc_info):
+        self._lock.acquire()
+        try:
+            if self.error is None:
+                self.error = exc_info
+        finally:
+            self._lock.release()
+
+
+def _put_chunk(queue, chunk, threads):
+    """Put a chunk in the queue of the copy_parallel() workers.
+
+    Return False, instead of blocking forever, if the queue is full and no
+    worker is left to consume it.
+    """
+    from Queue import Full
+    while 1:
+        try:
+            queue.put(chunk, timeout=1.0)
+            return True
+        except Full:
+            for t in threads:
+                if t.isAlive():
+                    break
+            else:
+                return False
+
+
+def _copy_worker(conn, queue, state, table, columns, sep, null, two_phase):
+    # whatever happens keep consuming until the end, so that the producer
+    # doesn't block
+    while 1:
+        chunk = queue.get()
+        if chunk is None:
+            break
+        if state.error:
+            continue
+
+        try:
+            curs = conn.cursor()
+            if isinstance(chunk, list):
+                curs.copy_records(table, columns, chunk)
+            else:
+                if isinstance(chunk, unicode):
+                    chunk = chunk.encode(_ext.encodings[conn.encoding])
+                curs.copy_from(chunk, table, sep=sep, null=null,
+                    columns=columns)
+            if not two_phase:
+                conn.commit()
+            state.add_rows(curs.rowcount)
+        except:
+            state.set_error(sys.exc_info())
+            if two_phase:
+                # release the locks held, which may block the other workers
+                try:
+                    conn.tpc_rollback()
+                except Exception:
+                    pass
+
+    if two_phase and not state.error:
+        try:
+            conn.tpc_prepare()
+        except:
+            state.set_error(sys.exc_info())
+
+
+def _read_line_chunks(f, size):
+    while 1:
+        data = f.read(size)
+        if not data:
+            break
+        if not data.endswith('\n'):
+            data += f.readline()
+        yield data
+
+
+def _read_record_chunks(records, rows):
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= rows:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+
+# --- Table to table transfer
+
+class TransferStats(object):
+    """The progress of a `transfer()` operation."""
+    def __init__(self):
+        self.bytes = 0
+        self.chunks = 0
+        self.rows = None
+        self.started = time.time()
+        self.elapsed = 0.0
+
+    def _update(self, nbytes):
+        self.bytes += nbytes
+        self.chunks += 1
+        self.elapsed = time.time() - self.started
+
+    @property
+    def throughput(self):
+        """The average number of bytes transferred per second."""
+        if not self.elapsed:
+            return 0.0
+        return self.bytes / self.elapsed
+
+    def __repr__(self):
+        return "<TransferStats: %d bytes in %.3f s (%.0f bytes/s)>" % (
+            self.bytes, self.elapsed, self.throughput)
+
+
+def transfer(src_conn, src_sql, dst_conn, dst_table, columns=None,
+        binary=False, size=1024 * 1024, buffers=8, progress=None,
+        interval=1.0):
+    """Copy the result of a query on a connection into a table on another.
+
+    :param src_conn: the connection to read the data from
+    :param src_sql: the query producing the data
+    :param dst_conn: the connection to write the data to
+    :param dst_table: the name of the table to load
+    :param columns: the columns to load, in the order of the query result
+    :param binary: if `!True` transfer the data in COPY binary format,
+        otherwise in text format
+    :param size: the size of the data blocks transferred
+    :param buffers: the maximum number of blocks held in memory
+    :param progress: a function called with a `TransferStats` argument
+        while the data is transferred, every *interval* seconds
+    :return: a `TransferStats` instance with the totals
+
+    The data is streamed from :sql:`COPY ... TO STDOUT` on *src_conn*,
+    run in a separate thread, into :sql:`COPY ... FROM STDIN` on
+    *dst_conn*, run in the calling thread. An error on either side stops
+    both the operations and is raised.
+    """
+    import threading
+
+    fmt = binary and " WITH BINARY" or ""
+    src_sql = "COPY (%s) TO STDOUT%s" % (src_sql, fmt)
+    if columns:
+        dst_table = "%s (%s)" % (dst_table, ','.join(columns))
+    dst_sql = "COPY %s FROM STDIN%s" % (dst_table, fmt)
+
+    stats = TransferStats()
+    pipe = _TransferPipe(buffers, stats, progress, interval)
+    producer = threading.Thread(target=_transfer_producer,
+        args=(src_conn, src_sql, pipe, size))
+    producer.setDaemon(True)
+    producer.start()
+
+    try:
+        try:
+            curs = dst_conn.cursor()
+            curs.copy_expert(dst_sql, pipe, size=size)
+        except:
+            # Stop the source instead of reading the rest of its data
+            if producer.isAlive():
+                src_conn.cancel()
+            raise
+    finally:
+        pipe.close()
+        producer.join()
+
+    stats.elapsed = time.time() - stats.started
+    stats.rows = curs.rowcount
+    if progress is not None:
+        progress(stats)
+    return stats
+
+
+class _TransferClosed(Exception):
+    """Raised to the producer when the consumer has stopped."""
+
+
+class _TransferPipe(object):
+    """A bounded queue of data blocks exposed as files to COPY.
+
+    The producer writes the blocks, the consumer reads them.
+    """
+    _eof = object()
+
+    def __init__(self, buffers, stats, progress, interval):
+        from Queue import Queue
+        self._queue = Queue(maxsize=buffers)
+        self._closed = False
+        self._stats = stats
+        self._progress = progress
+        self._interval = interval
+        self._reported = time.time()
+
+    def write(self, data):
+        from Queue import Full
+        while 1:
+            if self._closed:
+                raise _TransferClosed()
+            try:
+                self._queue.put(data, timeout=0.1)
+            except Full:
+                continue
+            else:
+                break
+
+    def finish(self, exc_info=None):
+        """Signal the end of the data, or the error occurred producing it."""
+        if exc_info is None:
+            self.write(self._eof)
+        else:
+            self.write(exc_info)
+
+    def read(self, size=-1):
+        if self._closed:
+            return ''
+
+        data = self._queue.get()
+        if data is self._eof:
+            self._closed = True
+            return ''
+        if isinstance(data, tuple):
+            self._closed = True
+            raise data[0], data[1], data[2]
+
+        self._stats._update(len(data))
+        if self._progress is not None:
+            now = time.time()
+            if now - self._reported >= self._interval:
+                self._reported = now
+                self._progress(self._stats)
+        return data
+
+    def readline(self, size=-1):
+        return self.read(size)
+
+    def close(self):
+        """Stop the transfer, releasing a producer blocked on write."""
+        self._closed = True
+        from Queue import Empty
+        try:
+            while 1:
+                self._queue.get_nowait()
+        except Empty:
+            pass
+
+
+def _transfer_producer(conn, sql, pipe, size):
+    try:
+        try:
+            conn.cursor().copy_expert(sql, pipe, size=size)
+        except _TransferClosed:
+            return
+        except:
+            pipe.finish(sys.exc_info())
+        else:
+            pipe.finish()
+    except _TransferClosed:
+        pass
+
+
 __all__ = filter(lambda k: not k.startswith('_'), locals().keys())
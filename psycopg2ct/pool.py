@@ -24,6 +24,11 @@ This module implements thread-safe (and not) connection pools.
 # FITNESS FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public
 # License for more details.
 
+import re
+import time
+import bisect
+import weakref
+
 import psycopg2
 import psycopg2.extensions as _ext
 
@@ -56,20 +61,207 @@ class PoolError(psycopg2.Error):
     pass
 
 
+_connect_timeout_re = re.compile(r"(?:^|\s)connect_timeout\s*=\s*'?(\d+)")
+
+def _connect_timeout(dsn):
+    """Return the connect_timeout of a dsn, None if there is no timeout."""
+    m = _connect_timeout_re.search(dsn or '')
+    if m is not None and int(m.group(1)) > 0:
+        return int(m.group(1))
+
+
+class Histogram(object):
+    """Distribution of a duration, in buckets growing by powers of 2.
+
+    The bucket i counts the values up to `Histogram.bounds[i]` seconds; the
+    last bucket counts the values exceeding all the bounds.
+    """
+
+    #: The upper bounds of the buckets: from 100us to about 52s.
+    bounds = [0.0001 * 2 ** i for i in range(20)]
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(self.bounds) + 1)
+
+    def add(self, value):
+        """Record a value in the histogram."""
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+        self.buckets[bisect.bisect_left(self.bounds, value)] += 1
+
+    def snapshot(self):
+        """Return the state of the histogram as a dict."""
+        return {
+            'count': self.count,
+            'total': self.total,
+            'max': self.max,
+            'mean': self.count and self.total / self.count or 0.0,
+            'buckets': zip(self.bounds + [None], self.buckets),
+        }
+
+
+class PoolStats(object):
+    """Counters and histograms about the activity of a connection pool.
+
+    If 'callback' is not None it is called as callback(event, value) for
+    every event recorded, with the pool lock held, so it should be quick.
+    The events are:
+
+    - 'checkout': a connection was handed out; value is the time waited;
+    - 'checkin': a connection was put back; value is the time it was held;
+    - 'exhausted': a connection was requested but none was available;
+    - 'connect': a new connection was opened;
+    - 'connect_error': opening a connection failed; value is the error;
+    - 'close': a connection was closed by the pool.
+    """
+
+    def __init__(self, callback=None):
+        self.callback = callback
+
+        #: Number of connections handed out.
+        self.checkouts = 0
+        #: Number of checkouts which had to wait for a connection.
+        self.waits = 0
+        #: Number of waits for a connection which timed out.
+        self.wait_timeouts = 0
+        #: Number of requests failed because no connection was available.
+        self.exhausted = 0
+        #: Number of connections opened and failed to open.
+        self.connects = 0
+        self.connect_errors = 0
+        #: Number of connections closed by the pool (broken, expired,
+        #: idle or exceeding minconn), usually replaced by new connects.
+        self.closes = 0
+        #: Largest number of connections in use at the same time.
+        self.max_used = 0
+
+        #: Time spent waiting for a connection by getconn().
+        self.wait_time = Histogram()
+        #: Time a connection was held before being put back.
+        self.hold_time = Histogram()
+
+        self._checkout_times = {}
+
+    def _event(self, event, value=None):
+        if self.callback is not None:
+            self.callback(event, value)
+
+    def _checkout(self, conn, wait, used):
+        self.checkouts += 1
+        if wait is None:
+            wait = 0.0
+        else:
+            self.waits += 1
+        self.wait_time.add(wait)
+        if used > self.max_used:
+            self.max_used = used
+        self._checkout_times[id(conn)] = time.time()
+        self._event('checkout', wait)
+
+    def _checkin(self, conn):
+        start = self._checkout_times.pop(id(conn), None)
+        if start is not None:
+            hold = time.time() - start
+            self.hold_time.add(hold)
+            self._event('checkin', hold)
+
+    def _exhausted(self, wait=None):
+        self.exhausted += 1
+        if wait is not None:
+            self.wait_timeouts += 1
+            self.wait_time.add(wait)
+        self._event('exhausted')
+
+    def _connected(self, error=None):
+        if error is None:
+            self.connects += 1
+            self._event('connect')
+        else:
+            self.connect_errors += 1
+            self._event('connect_error', error)
+
+    def _closed(self):
+        self.closes += 1
+        self._event('close')
+
+    def snapshot(self):
+        """Return the counters and histograms as a dict."""
+        return {
+            'checkouts': self.checkouts,
+            'waits': self.waits,
+            'wait_timeouts': self.wait_timeouts,
+            'exhausted': self.exhausted,
+            'connects': self.connects,
+            'connect_errors': self.connect_errors,
+            'closes': self.closes,
+            'max_used': self.max_used,
+            'wait_time': self.wait_time.snapshot(),
+            'hold_time': self.hold_time.snapshot(),
+        }
+
+
 class AbstractConnectionPool(object):
     """Generic key-based pooling code."""
 
+    # the lock held around the pool operations by the thread-safe pools
+    _lock = None
+
     def __init__(self, minconn, maxconn, *args, **kwargs):
         """Initialize the connection pool.
 
         New 'minconn' connections are created immediately calling 'connfunc'
         with given parameters. The connection pool will support a maximum of
         about 'maxconn' connections.        
+
+        The following keyword arguments configure the pool and are not
+        passed to connect():
+
+        - 'max_lifetime': seconds after which a connection is closed instead
+          of being handed out or put back into the pool;
+        - 'max_idle': seconds after which a connection sitting in the pool
+          is closed by the maintenance thread (and replaced if the pool
+          would go below 'minconn' connections);
+        - 'ping_idle': seconds of idleness after which a connection is
+          checked with a roundtrip to the server before being handed out;
+        - 'maintenance_interval': seconds between two runs of the
+          maintenance thread of the threaded pools. If None (default) no
+          thread is started;
+        - 'stats': if True record the pool activity in a `PoolStats`
+          object available as the 'stats' attribute (else it is None);
+        - 'stats_callback': a callback for the `PoolStats` events. Implies
+          'stats';
+        - 'reset': how to clean up the session of a connection put back into
+          the pool. None (default) only rolls back an open transaction;
+          'tracked' also undoes the session changes detected by the
+          connection (settings, prepared statements, temporary objects,
+          LISTENs, held cursors, advisory locks), usually sending no query
+          at all; 'all' undoes all of them anyway and 'discard' runs
+          DISCARD ALL.
         """
         self.minconn = minconn
         self.maxconn = maxconn
         self.closed = False
-        
+
+        self.max_lifetime = kwargs.pop('max_lifetime', None)
+        self.max_idle = kwargs.pop('max_idle', None)
+        self.ping_idle = kwargs.pop('ping_idle', None)
+        self.maintenance_interval = kwargs.pop('maintenance_interval', None)
+
+        self.reset = kwargs.pop('reset', None)
+        if self.reset not in (None, 'tracked', 'all', 'discard'):
+            raise ValueError("bad reset mode: %r" % (self.reset,))
+
+        callback = kwargs.pop('stats_callback', None)
+        if kwargs.pop('stats', False) or callback is not None:
+            self.stats = PoolStats(callback)
+        else:
+            self.stats = None
+
         self._args = args
         self._kwargs = kwargs
 
@@ -78,17 +270,207 @@ class AbstractConnectionPool(object):
         self._rused = {} # id(conn) -> key map
         self._keys = 0
 
-        for i in range(self.minconn):
-            self._connect()
+        self._created = {} # id(conn) -> creation time
+        self._idle = {} # id(conn) -> time it was put into the pool
+        self._connecting = 0 # connections being opened by the maintenance
+
+        conns, errors = self._new_conns(self.minconn)
+        if errors:
+            for conn in conns:
+                self._discard(conn)
+            raise errors[0]
+
+        now = time.time()
+        for conn in conns:
+            self._pool.append(conn)
+            self._idle[id(conn)] = now
+
+    def _new_conn(self):
+        """Open a new connection, without adding it to the pool."""
+        try:
+            conn = psycopg2.connect(*self._args, **self._kwargs)
+        except psycopg2.Error, e:
+            if self.stats is not None:
+                self.stats._connected(e)
+            raise
+        self._created[id(conn)] = time.time()
+        if self.stats is not None:
+            self.stats._connected()
+        return conn
+
+    def _new_conns(self, n):
+        """Open 'n' new connections concurrently.
+
+        The connections are started in async mode and established together
+        polling them in a single select() loop, so that it takes about the
+        time of a single connection, then they are turned into regular
+        connections. The connect_timeout of the dsn, if any, is the time
+        allowed to the whole loop. If a wait callback is set the connections
+        are opened one after the other instead.
+
+        Return the list of the connections opened and the list of the
+        errors of the ones which failed.
+        """
+        conns = []
+        errors = []
+        if n <= 0:
+            return conns, errors
+
+        if n == 1 or _ext.get_wait_callback() is not None:
+            for i in range(n):
+                try:
+                    conns.append(self._new_conn())
+                except psycopg2.Error, e:
+                    errors.append(e)
+            return conns, errors
+
+        import select
+        waiting = {}
+        for i in range(n):
+            try:
+                conn = psycopg2.connect(async=True, *self._args, **self._kwargs)
+            except psycopg2.Error, e:
+                errors.append(e)
+                if self.stats is not None:
+                    self.stats._connected(e)
+            else:
+                waiting[conn] = _ext.POLL_WRITE
+
+        ready = waiting.keys()
+        deadline = None
+        if ready:
+            timeout = _connect_timeout(ready[0].dsn)
+            if timeout is not None:
+                deadline = time.time() + timeout
+
+        while 1:
+            for conn in ready:
+                try:
+                    state = conn.poll()
+                except psycopg2.Error, e:
+                    state = e
+                else:
+                    if state == _ext.POLL_OK:
+                        try:
+                            conn._async_to_sync()
+                        except psycopg2.Error, e:
+                            state = e
+                    elif state not in (_ext.POLL_READ, _ext.POLL_WRITE):
+                        state = psycopg2.OperationalError(
+                            "bad poll state while connecting: %s" % state)
+
+                if state == _ext.POLL_OK:
+                    del waiting[conn]
+                    self._created[id(conn)] = time.time()
+                    conns.append(conn)
+                    if self.stats is not None:
+                        self.stats._connected()
+                elif isinstance(state, Exception):
+                    del waiting[conn]
+                    conn.close()
+                    errors.append(state)
+                    if self.stats is not None:
+                        self.stats._connected(state)
+                else:
+                    waiting[conn] = state
+
+            if not waiting:
+                break
+
+            if deadline is not None:
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    for conn in waiting:
+                        conn.close()
+                        e = psycopg2.OperationalError("timeout expired")
+                        errors.append(e)
+                        if self.stats is not None:
+                            self.stats._connected(e)
+                    break
+            else:
+                timeout = None
+
+            rlist = [c for c, s in waiting.iteritems() if s == _ext.POLL_READ]
+            wlist = [c for c, s in waiting.iteritems() if s == _ext.POLL_WRITE]
+            if timeout is None:
+                r, w, x = select.select(rlist, wlist, [])
+            else:
+                r, w, x = select.select(rlist, wlist, [], timeout)
+            ready = r + w
+
+        return conns, errors
+
+    def _forget(self, conn):
+        """Drop the bookkeeping about a connection leaving the pool."""
+        self._created.pop(id(conn), None)
+        self._idle.pop(id(conn), None)
+
+    def _discard(self, conn):
+        """Close a connection not wanted by the pool anymore."""
+        self._forget(conn)
+        if self.stats is not None:
+            self.stats._closed()
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _expired(self, conn, now):
+        """Return True if the connection has exceeded 'max_lifetime'."""
+        return (self.max_lifetime is not None
+            and now - self._created.get(id(conn), now) >= self.max_lifetime)
+
+    def _check(self, conn, now):
+        """Return True if a pooled connection can be handed out.
+
+        The connection state is checked without talking to the server: libpq
+        reports an unknown transaction status if the connection is bad. See
+        `_needs_ping()` for the check talking to the server.
+        """
+        if conn.closed or self._expired(conn, now):
+            return False
+
+        if conn.get_transaction_status() == _ext.TRANSACTION_STATUS_UNKNOWN:
+            return False
+
+        return True
+
+    def _needs_ping(self, conn, now):
+        """Return True if a pooled connection was idle for 'ping_idle'."""
+        return (self.ping_idle is not None
+            and now - self._idle.get(id(conn), now) >= self.ping_idle)
+
+    def _ping(self, conn):
+        """Return True if a connection answers a query.
+
+        The connection must not be in the pool, as the pool lock, if any, is
+        released during the round trip.
+        """
+        if self._lock is not None:
+            self._lock.release()
+        try:
+            try:
+                curs = conn.cursor()
+                curs.execute("SELECT 1")
+                curs.close()
+                if not conn.autocommit:
+                    conn.rollback()
+            except psycopg2.Error:
+                return False
+            return True
+        finally:
+            if self._lock is not None:
+                self._lock.acquire()
 
     def _connect(self, key=None):
         """Create a new connection and assign it to 'key' if not None."""
-        conn = psycopg2.connect(*self._args, **self._kwargs)
+        conn = self._new_conn()
         if key is not None:
             self._used[key] = conn
             self._rused[id(conn)] = key
         else:
             self._pool.append(conn)
+            self._idle[id(conn)] = time.time()
         return conn
 
     def _getkey(self):
@@ -96,7 +478,7 @@ class AbstractConnectionPool(object):
         self._keys += 1
         return self._keys
             
-    def _getconn(self, key=None):
+    def _getconn(self, key=None, _wait=None):
         """Get a free connection and assign it to 'key' if not None."""
         if self.closed: raise PoolError("connection pool is closed")
         if key is None: key = self._getkey()
@@ -104,14 +486,40 @@ class AbstractConnectionPool(object):
         if key in self._used:
             return self._used[key]
 
-        if self._pool:
-            self._used[key] = conn = self._pool.pop()
+        now = time.time()
+        while self._pool:
+            conn = self._pool.pop()
+            if not self._check(conn, now):
+                self._discard(conn)
+                continue
+
+            ping = self._needs_ping(conn, now)
+            self._idle.pop(id(conn), None)
+            self._used[key] = conn
             self._rused[id(conn)] = key
+            if ping:
+                # the connection is reserved while the lock is released
+                alive = self._ping(conn)
+                if self.closed:
+                    raise PoolError("connection pool is closed")
+                if not alive:
+                    del self._used[key]
+                    del self._rused[id(conn)]
+                    self._discard(conn)
+                    continue
+
+            if self.stats is not None:
+                self.stats._checkout(conn, _wait, len(self._used))
             return conn
-        else:
-            if len(self._used) == self.maxconn:
-                raise PoolError("connection pool exausted")
-            return self._connect(key)
+
+        if len(self._used) == self.maxconn:
+            if self.stats is not None:
+                self.stats._exhausted()
+            raise PoolError("connection pool exausted")
+        conn = self._connect(key)
+        if self.stats is not None:
+            self.stats._checkout(conn, _wait, len(self._used))
+        return conn
 		 
     def _putconn(self, conn, key=None, close=False):
         """Put away a connection."""
@@ -121,24 +529,41 @@ class AbstractConnectionPool(object):
         if not key:
             raise PoolError("trying to put unkeyed connection")
 
-        if len(self._pool) < self.minconn and not close:
+        if self.stats is not None:
+            self.stats._checkin(conn)
+
+        if (len(self._pool) < self.minconn and not close
+                and not self._expired(conn, time.time())):
             # Return the connection into a consistent state before putting
             # it back into the pool
             if not conn.closed:
                 status = conn.get_transaction_status()
                 if status == _ext.TRANSACTION_STATUS_UNKNOWN:
                     # server connection lost
-                    conn.close()
+                    self._discard(conn)
+                elif self.reset is not None:
+                    # rollback and session cleanup in a single roundtrip
+                    try:
+                        conn._reset_session(self.reset)
+                    except psycopg2.Error:
+                        self._discard(conn)
+                    else:
+                        self._pool.append(conn)
+                        self._idle[id(conn)] = time.time()
                 elif status != _ext.TRANSACTION_STATUS_IDLE:
                     # connection in error or in transaction
                     conn.rollback()
                     self._pool.append(conn)
+                    self._idle[id(conn)] = time.time()
                 else:
                     # regular idle connection
                     self._pool.append(conn)
-            # If the connection is closed, we just discard it.
+                    self._idle[id(conn)] = time.time()
+            else:
+                # If the connection is closed, we just discard it.
+                self._forget(conn)
         else:
-            conn.close()
+            self._discard(conn)
 
         # here we check for the presence of key because it can happen that a
         # thread tries to put back a connection after a call to close
@@ -159,8 +584,123 @@ class AbstractConnectionPool(object):
                 conn.close()
             except:
                 pass
+        self._created.clear()
+        self._idle.clear()
+        if self.stats is not None:
+            self.stats._checkout_times.clear()
         self.closed = True
-        
+
+    def _get_stats(self):
+        """Return a snapshot of the pool statistics, None if not enabled.
+
+        Together with the `PoolStats` counters and histograms report the
+        current number of connections: 'idle' in the pool, 'used' and the
+        total 'size'.
+        """
+        if self.stats is None:
+            return None
+        rv = self.stats.snapshot()
+        rv['idle'] = len(self._pool)
+        rv['used'] = len(self._used)
+        rv['size'] = rv['idle'] + rv['used']
+        return rv
+
+    def _maintain(self):
+        """Close the expired connections and replace them.
+
+        Connections which are broken, have exceeded 'max_lifetime' or have
+        been idle for longer than 'max_idle' are removed from the pool, then
+        new connections are opened to get back to 'minconn' idle ones.
+        Connecting and closing happen without holding the lock, so that the
+        threads requesting connections are not slowed down.
+        """
+        self._lock.acquire()
+        try:
+            if self.closed:
+                return
+            now = time.time()
+            reaped = []
+            for conn in self._pool[:]:
+                if (conn.closed or self._expired(conn, now)
+                        or conn.get_transaction_status()
+                            == _ext.TRANSACTION_STATUS_UNKNOWN
+                        or (self.max_idle is not None
+                            and now - self._idle.get(id(conn), now)
+                                >= self.max_idle)):
+                    self._pool.remove(conn)
+                    self._forget(conn)
+                    reaped.append(conn)
+                    if self.stats is not None:
+                        self.stats._closed()
+
+            # don't open more than 'maxconn' connections in total
+            missing = min(
+                self.minconn - len(self._pool),
+                self.maxconn - len(self._pool) - len(self._used))
+            missing -= self._connecting
+            missing = max(missing, 0)
+            self._connecting += missing
+        finally:
+            self._lock.release()
+
+        for conn in reaped:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+        conns, errors = self._new_conns(missing)
+        for e in errors:
+            dbg("pool maintenance failed to connect:", e)
+
+        self._lock.acquire()
+        try:
+            self._connecting -= missing
+            for conn in conns:
+                if self.closed or len(self._pool) >= self.minconn:
+                    self._discard(conn)
+                else:
+                    self._pool.append(conn)
+                    self._idle[id(conn)] = time.time()
+                    self._conn_added()
+        finally:
+            self._lock.release()
+
+    def _conn_added(self):
+        """Called with the lock held when maintenance adds a connection."""
+        pass
+
+    def _start_maintenance(self):
+        """Start the maintenance thread if 'maintenance_interval' is set."""
+        if self.maintenance_interval is None:
+            return
+
+        import threading
+        self._stop_maintenance = threading.Event()
+        t = threading.Thread(target=_maintenance_loop,
+            args=(weakref.ref(self), self.maintenance_interval,
+                self._stop_maintenance))
+        t.setDaemon(True)
+        t.start()
+
+
+def _maintenance_loop(ref, interval, stop):
+    """Periodically run the maintenance of a pool until it is closed.
+
+    Only a weak reference to the pool is kept, so that the thread doesn't
+    keep an abandoned pool alive.
+    """
+    while 1:
+        stop.wait(interval)
+        pool = ref()
+        if pool is None or stop.isSet() or pool.closed:
+            return
+        try:
+            pool._maintain()
+        except Exception, e:
+            dbg("pool maintenance failed:", e)
+        del pool
+
 
 class SimpleConnectionPool(AbstractConnectionPool):
     """A connection pool that can't be shared across different threads."""
@@ -168,6 +708,7 @@ class SimpleConnectionPool(AbstractConnectionPool):
     getconn = AbstractConnectionPool._getconn
     putconn = AbstractConnectionPool._putconn
     closeall   = AbstractConnectionPool._closeall
+    get_stats = AbstractConnectionPool._get_stats
 
 
 class ThreadedConnectionPool(AbstractConnectionPool):
@@ -176,23 +717,103 @@ class ThreadedConnectionPool(AbstractConnectionPool):
     def __init__(self, minconn, maxconn, *args, **kwargs):
         """Initialize the threading lock."""
         import threading
+        from collections import deque
         AbstractConnectionPool.__init__(
             self, minconn, maxconn, *args, **kwargs)
         self._lock = threading.Lock()
 
-    def getconn(self, key=None):
-        """Get a free connection and assign it to 'key' if not None."""
+        # the threads waiting for a connection, in order of arrival
+        self._waiters = deque()
+
+        # statistics about the getconn() calls which had to wait, kept
+        # even without 'stats'
+        self.waits = 0
+        self.wait_timeouts = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+
+        self._start_maintenance()
+
+    def getconn(self, key=None, timeout=0):
+        """Get a free connection and assign it to 'key' if not None.
+
+        If the pool is exhausted wait up to 'timeout' seconds (forever if
+        None) for a connection to be put back, then raise PoolError. The
+        waiting threads are served in order of arrival.
+        """
         self._lock.acquire()
         try:
-            return self._getconn(key)
+            if key is not None and key in self._used:
+                return self._getconn(key)
+
+            if not self._waiters:
+                if timeout == 0 or self._can_getconn():
+                    return self._getconn(key)
+            elif timeout == 0:
+                if self.stats is not None:
+                    self.stats._exhausted()
+                raise PoolError("connection pool exausted")
+
+            return self._wait_getconn(key, timeout)
         finally:
             self._lock.release()
 
+    def _can_getconn(self):
+        """Return True if _getconn() would not find the pool exhausted."""
+        return bool(self._pool) or len(self._used) < self.maxconn
+
+    def _wait_getconn(self, key, timeout):
+        """Wait in line for a connection. Must be called with the lock held."""
+        import threading
+        waiter = threading.Condition(self._lock)
+        self._waiters.append(waiter)
+        start = time.time()
+        try:
+            while self._waiters[0] is not waiter or not self._can_getconn():
+                if self.closed:
+                    raise PoolError("connection pool is closed")
+                if timeout is None:
+                    waiter.wait()
+                else:
+                    remaining = start + timeout - time.time()
+                    if remaining <= 0:
+                        self.wait_timeouts += 1
+                        if self.stats is not None:
+                            self.stats._exhausted(time.time() - start)
+                        raise PoolError("connection pool exausted")
+                    waiter.wait(remaining)
+
+            return self._getconn(key, time.time() - start)
+
+        finally:
+            self._waiters.remove(waiter)
+            elapsed = time.time() - start
+            self.waits += 1
+            self.wait_time += elapsed
+            self.max_wait_time = max(self.max_wait_time, elapsed)
+            self._notify_waiter()
+
+    def _notify_waiter(self):
+        """Wake up the first waiting thread if a connection is available."""
+        if self._waiters and (self.closed or self._can_getconn()):
+            self._waiters[0].notify()
+
+    _conn_added = _notify_waiter
+
     def putconn(self, conn=None, key=None, close=False):
         """Put away an unused connection."""
         self._lock.acquire()
         try:
             self._putconn(conn, key, close)
+            self._notify_waiter()
+        finally:
+            self._lock.release()
+
+    def get_stats(self):
+        """Return a snapshot of the pool statistics, None if not enabled."""
+        self._lock.acquire()
+        try:
+            return self._get_stats()
         finally:
             self._lock.release()
 
@@ -201,8 +822,12 @@ class ThreadedConnectionPool(AbstractConnectionPool):
         self._lock.acquire()
         try:
             self._closeall()
+            for waiter in self._waiters:
+                waiter.notify()
         finally:
             self._lock.release()
+        if self.maintenance_interval is not None:
+            self._stop_maintenance.set()
 
 
 class PersistentConnectionPool(AbstractConnectionPool):
@@ -213,6 +838,11 @@ class PersistentConnectionPool(AbstractConnectionPool):
     a connection it will always get the same connection object by successive
     `!getconn()` calls. This also means that a thread can't use more than one
     single connection from the pool.
+
+    A thread getting again the connection it holds doesn't need to acquire
+    the pool lock. If a thread terminates without putting its connection
+    away, the connection is returned to the pool by the next call requiring
+    the lock.
     """
 
     def __init__(self, minconn, maxconn, *args, **kwargs):
@@ -222,27 +852,86 @@ class PersistentConnectionPool(AbstractConnectionPool):
             self, minconn, maxconn, *args, **kwargs)
         self._lock = threading.Lock()
 
+        # the connection held by each thread, together with a token whose
+        # collection, on thread exit, queues the connection in _dead
+        self._local = threading.local()
+        self._tokens = {}
+        self._dead = []
+
         # we we'll need the thread module, to determine thread ids, so we
         # import it here and copy it in an instance variable
         import thread
         self.__thread = thread
 
+        self._start_maintenance()
+
     def getconn(self):
         """Generate thread id and return a connection."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and not self.closed:
+            return conn
+
         key = self.__thread.get_ident()
         self._lock.acquire()
         try:
-            return self._getconn(key)
+            self._reclaim()
+            conn = self._getconn(key)
+            if getattr(self._local, 'token', None) is None:
+                # a token left by a dead thread with the same id is replaced
+                token = _ThreadToken()
+                dead = self._dead
+                self._tokens[key] = weakref.ref(token,
+                    lambda ref: dead.append((key, conn, ref)))
+                self._local.token = token
         finally:
             self._lock.release()
 
+        self._local.conn = conn
+        return conn
+
     def putconn(self, conn=None, close=False):
         """Put away an unused connection."""
         key = self.__thread.get_ident()
         self._lock.acquire()
         try:
+            self._reclaim()
             if not conn: conn = self._used[key]
             self._putconn(conn, key, close)
+            self._tokens.pop(key, None)
+        finally:
+            self._lock.release()
+
+        # the token weakref is gone, so dropping it doesn't queue anything
+        self._local.conn = self._local.token = None
+
+    def _reclaim(self):
+        """Put back the connections of the terminated threads.
+
+        The weakref callbacks only append to a list, as they may run in any
+        thread, possibly with the lock already held; the actual work is done
+        here, with the lock held.
+        """
+        while self._dead:
+            key, conn, ref = self._dead.pop()
+            if self._tokens.get(key) is not ref:
+                continue
+            del self._tokens[key]
+            if not self.closed and self._used.get(key) is conn:
+                self._putconn(conn, key)
+
+    def _maintain(self):
+        self._lock.acquire()
+        try:
+            self._reclaim()
+        finally:
+            self._lock.release()
+        AbstractConnectionPool._maintain(self)
+
+    def get_stats(self):
+        """Return a snapshot of the pool statistics, None if not enabled."""
+        self._lock.acquire()
+        try:
+            return self._get_stats()
         finally:
             self._lock.release()
 
@@ -251,5 +940,117 @@ class PersistentConnectionPool(AbstractConnectionPool):
         self._lock.acquire()
         try:
             self._closeall()
+            self._tokens.clear()
+            del self._dead[:]
         finally:
             self._lock.release()
+        if self.maintenance_interval is not None:
+            self._stop_maintenance.set()
+
+
+class _ThreadToken(object):
+    """Object only referenced by a thread local: dies with its thread."""
+    __slots__ = ('__weakref__',)
+
+
+class QueryExecutor(object):
+    """Run independent queries in parallel on a `ThreadedConnectionPool`.
+
+    Queries are executed by 'max_workers' threads (by default the pool
+    'maxconn'), each one on a connection taken from the pool for the time
+    of the query. The results are fetched by the worker threads, so the
+    futures returned are ready to use.
+
+    At most 'max_pending' queries (by default twice the workers) can be
+    outstanding: further calls to `submit()` block until a query is done.
+    'timeout' is passed to `ThreadedConnectionPool.getconn()`.
+
+    The executor requires the `!concurrent.futures` module (available in
+    the ``futures`` package on Python 2).
+    """
+
+    def __init__(self, pool, max_workers=None, max_pending=None,
+            timeout=None, cursor_factory=None):
+        import threading
+        from concurrent.futures import ThreadPoolExecutor
+
+        if max_workers is None:
+            max_workers = pool.maxconn
+        if max_pending is None:
+            max_pending = 2 * max_workers
+
+        self.pool = pool
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.cursor_factory = cursor_factory
+
+        self._executor = ThreadPoolExecutor(max_workers)
+        self._slots = threading.BoundedSemaphore(max_pending)
+
+    def submit(self, query, vars=None):
+        """Schedule the execution of a query and return a `!Future`.
+
+        The result of the future is the list of records returned by the
+        query, or its rowcount if the query doesn't return records.
+        """
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(self._run, query, vars)
+        except:
+            self._slots.release()
+            raise
+        future.add_done_callback(self._release_slot)
+        return future
+
+    def map(self, query, argslist):
+        """Run a query once for every item in 'argslist'.
+
+        Generate the results in the order of 'argslist'. The arguments are
+        consumed as the results are, so 'argslist' can be a long iterator.
+        """
+        from collections import deque
+        pending = deque()
+        try:
+            for vars in argslist:
+                if len(pending) >= self.max_pending:
+                    yield pending.popleft().result()
+                pending.append(self.submit(query, vars))
+
+            while pending:
+                yield pending.popleft().result()
+
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def shutdown(self, wait=True):
+        """Stop accepting queries; if 'wait' wait for the pending ones."""
+        self._executor.shutdown(wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.shutdown()
+
+    def _release_slot(self, future):
+        self._slots.release()
+
+    def _run(self, query, vars):
+        conn = self.pool.getconn(timeout=self.timeout)
+        try:
+            if self.cursor_factory is None:
+                curs = conn.cursor()
+            else:
+                curs = conn.cursor(cursor_factory=self.cursor_factory)
+            curs.execute(query, vars)
+            if curs.description is None:
+                rv = curs.rowcount
+            else:
+                rv = curs.fetchall()
+            curs.close()
+            conn.commit()
+            return rv
+        finally:
+            # an aborted transaction is rolled back by the pool
+            self.pool.putconn(conn)
@@ -26,12 +26,14 @@ import sys
 from testconfig import dsn
 from testutils import unittest
 
+import test_aio
 import test_async
 import test_bugX000
 import test_bug_gc
 import test_cancel
 import test_connection
 import test_copy
+import test_copyformat
 import test_cursor
 import test_dates
 import test_extras_dictcursor
@@ -39,6 +41,7 @@ import test_green
 import test_lobject
 import test_module
 import test_notify
+import test_pool
 import test_psycopg2_dbapi20
 import test_quote
 import test_transaction
@@ -58,12 +61,14 @@ def test_suite():
         cnn.close()
 
     suite = unittest.TestSuite()
+    suite.addTest(test_aio.test_suite())
     suite.addTest(test_async.test_suite())
     suite.addTest(test_bugX000.test_suite())
     suite.addTest(test_bug_gc.test_suite())
     suite.addTest(test_cancel.test_suite())
     suite.addTest(test_connection.test_suite())
     suite.addTest(test_copy.test_suite())
+    suite.addTest(test_copyformat.test_suite())
     suite.addTest(test_cursor.test_suite())
     suite.addTest(test_dates.test_suite())
     suite.addTest(test_extras_dictcursor.test_suite())
@@ -71,6 +76,7 @@ def test_suite():
     suite.addTest(test_lobject.test_suite())
     suite.addTest(test_module.test_suite())
     suite.addTest(test_notify.test_suite())
+    suite.addTest(test_pool.test_suite())
     suite.addTest(test_psycopg2_dbapi20.test_suite())
     suite.addTest(test_quote.test_suite())
     suite.addTest(test_transaction.test_suite())
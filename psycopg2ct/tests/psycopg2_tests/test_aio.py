@@ -0,0 +1,450 @@
+#!/usr/bin/env python
+
+# test_aio.py - unit test for the asyncio connections
+#
+# psycopg2 is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# In addition, as a special exception, the copyright holders give
+# permission to link this program with the OpenSSL library (or with
+# modified versions of OpenSSL that use the same license as OpenSSL),
+# and distribute linked combinations including the two.
+#
+# You must obey the GNU Lesser General Public License in all respects for
+# all of the code used other than OpenSSL.
+#
+# psycopg2 is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public
+# License for more details.
+
+import time
+
+import psycopg2
+from testutils import unittest, decorate_all_tests, skip_if_no_trollius
+from testconfig import dsn
+
+try:
+    import trollius as asyncio
+    from trollius import From, Return
+except ImportError:
+    pass
+
+
+class AioTests(unittest.TestCase):
+
+    def setUp(self):
+        import psycopg2.aio
+        self.aio = psycopg2.aio
+        self.loop = asyncio.new_event_loop()
+        self.conns = []
+
+    def tearDown(self):
+        for conn in self.conns:
+            conn.close()
+        self.loop.close()
+
+    def run_(self, coro):
+        return self.loop.run_until_complete(coro)
+
+    def connect(self):
+        conn = self.run_(self.aio.connect(dsn, loop=self.loop))
+        self.conns.append(conn)
+        return conn
+
+    def test_execute(self):
+        conn = self.connect()
+        self.assert_(not conn.closed)
+        cur = conn.cursor()
+        self.run_(cur.execute("select %s, 'x'", (42,)))
+        self.assertEqual(cur.description[0][0], '?column?')
+        self.assertEqual(self.run_(cur.fetchone()), (42, 'x'))
+        self.assertEqual(self.run_(cur.fetchone()), None)
+
+        self.run_(cur.execute("select generate_series(1, 5)"))
+        self.assertEqual(cur.rowcount, 5)
+        self.assertEqual(self.run_(cur.fetchmany(2)), [(1,), (2,)])
+        self.assertEqual(self.run_(cur.fetchall()), [(3,), (4,), (5,)])
+
+    def test_connect_error(self):
+        self.assertRaises(psycopg2.OperationalError, self.run_,
+            self.aio.connect(dsn + " port=1", loop=self.loop))
+
+    def test_error(self):
+        conn = self.connect()
+        self.assertRaises(psycopg2.ProgrammingError, self.run_,
+            conn.execute("select * from nosuchtable"))
+        cur = self.run_(conn.execute("select 1"))
+        self.assertEqual(self.run_(cur.fetchone()), (1,))
+
+    def test_concurrent_connections(self):
+        conns = [self.connect() for i in range(5)]
+
+        t0 = time.time()
+        self.run_(asyncio.gather(loop=self.loop,
+            *[c.execute("select pg_sleep(0.2)") for c in conns]))
+        self.assert_(time.time() - t0 < 0.6)
+
+    def test_serialized(self):
+        conn = self.connect()
+
+        @asyncio.coroutine
+        def query(i):
+            cur = yield From(conn.execute("select %s, pg_sleep(0.05)", (i,)))
+            row = yield From(cur.fetchone())
+            raise Return(row[0])
+
+        rv = self.run_(asyncio.gather(loop=self.loop,
+            *[query(i) for i in range(5)]))
+        self.assertEqual(rv, range(5))
+
+    def test_transaction(self):
+        conn = self.connect()
+        self.run_(conn.execute("create temp table aiotest (x int)"))
+        self.run_(conn.begin())
+        self.run_(conn.execute("insert into aiotest values (1)"))
+        self.run_(conn.rollback())
+        cur = self.run_(conn.execute("select count(*) from aiotest"))
+        self.assertEqual(self.run_(cur.fetchone()), (0,))
+
+        self.run_(conn.begin())
+        self.run_(conn.execute("insert into aiotest values (1)"))
+        self.run_(conn.commit())
+        cur = self.run_(conn.execute("select count(*) from aiotest"))
+        self.assertEqual(self.run_(cur.fetchone()), (1,))
+
+    def test_listen(self):
+        conn = self.connect()
+        self.assertRaises(psycopg2.ProgrammingError,
+            self.run_, conn.get_notify())
+        self.run_(conn.listen('aiotest'))
+        pid = conn.connection.get_backend_pid()
+
+        notifier = psycopg2.connect(dsn)
+        notifier.autocommit = True
+
+        @asyncio.coroutine
+        def notify():
+            yield From(asyncio.sleep(0.1, loop=self.loop))
+            notifier.cursor().execute("notify aiotest, 'hi'")
+
+        try:
+            n, _ = self.run_(asyncio.gather(
+                conn.get_notify(), notify(), loop=self.loop))
+
+            # notifications received while a query runs
+            notifier.cursor().execute("notify aiotest, 'there'")
+            time.sleep(0.1)
+            self.run_(conn.execute("select 1"))
+            n2 = self.run_(conn.get_notify())
+        finally:
+            notifier.close()
+
+        self.assertEqual(n.channel, 'aiotest')
+        self.assertEqual(n.payload, 'hi')
+        self.assertNotEqual(n.pid, pid)
+        self.assertEqual(n2.payload, 'there')
+
+    def test_close_wakes_listeners(self):
+        conn = self.connect()
+        self.run_(conn.listen('aiotest'))
+
+        @asyncio.coroutine
+        def close():
+            yield From(asyncio.sleep(0.05, loop=self.loop))
+            conn.close()
+
+        self.assertRaises(psycopg2.InterfaceError, self.run_,
+            asyncio.gather(conn.get_notify(), close(), loop=self.loop))
+
+    def test_cancel(self):
+        conn = self.connect()
+        task = asyncio.async(conn.execute("select pg_sleep(10)"),
+            loop=self.loop)
+        self.loop.call_later(0.1, task.cancel)
+
+        t0 = time.time()
+        self.assertRaises(asyncio.CancelledError, self.run_, task)
+        self.assert_(time.time() - t0 < 1)
+
+        cur = self.run_(conn.execute("select 1"))
+        self.assertEqual(self.run_(cur.fetchone()), (1,))
+
+    def test_copy(self):
+        from StringIO import StringIO
+        conn = self.connect()
+        self.run_(conn.execute("create temp table aio_copy (id int)"))
+        cur = conn.cursor()
+        data = ''.join(["%d\n" % i for i in xrange(10000)])
+        ticks = []
+
+        @asyncio.coroutine
+        def ticker():
+            while 1:
+                ticks.append(1)
+                yield From(asyncio.sleep(0, loop=self.loop))
+
+        task = asyncio.async(ticker(), loop=self.loop)
+        self.run_(cur.copy_from(StringIO(data), "aio_copy"))
+        self.assertEqual(cur.rowcount, 10000)
+
+        f = StringIO()
+        self.run_(cur.copy_to(f, "aio_copy"))
+        self.assertEqual(f.getvalue(), data)
+        task.cancel()
+        self.assert_(ticks)
+
+        f = StringIO()
+        self.run_(cur.copy_expert("copy (select 42) to stdout", f))
+        self.assertEqual(f.getvalue(), "42\n")
+
+    def test_named_cursor(self):
+        conn = self.connect()
+        self.run_(conn.begin())
+        cur = conn.cursor("aio")
+        cur.cursor.itersize = 10
+        self.run_(cur.execute("select generate_series(1, 25)"))
+        self.assertEqual(self.run_(cur.fetchone()), (1,))
+        self.assertEqual(len(self.run_(cur.fetchmany(12))), 12)
+        self.assertEqual(self.run_(cur.fetchone()), (14,))
+        rows = self.run_(cur.fetchall())
+        self.assertEqual(rows, [(i,) for i in range(15, 26)])
+        self.assertEqual(self.run_(cur.fetchone()), None)
+        self.assertEqual(self.run_(cur.fetchmany(5)), [])
+        self.run_(cur.close())
+        self.run_(conn.commit())
+
+    def test_named_cursor_exact_size(self):
+        conn = self.connect()
+        cur = conn.cursor("aio", withhold=True)
+        cur.cursor.itersize = 5
+        self.run_(cur.execute("select generate_series(1, 10)"))
+        rows = []
+        while 1:
+            row = self.run_(cur.fetchone())
+            if row is None:
+                break
+            rows.append(row)
+        self.assertEqual(rows, [(i,) for i in range(1, 11)])
+        self.run_(cur.close())
+
+        cur = self.run_(conn.execute("select count(*) from pg_cursors"))
+        self.assertEqual(self.run_(cur.fetchone()), (0,))
+
+    def test_named_cursor_close_no_wait(self):
+        conn = self.connect()
+        self.run_(conn.begin())
+        cur = conn.cursor("aio")
+        self.run_(cur.execute("select generate_series(1, 3)"))
+        task = cur.close()
+        cur = self.run_(conn.execute(
+            "select count(*) from pg_cursors where name = 'aio'"))
+        self.assert_(task.done())
+        self.assertEqual(self.run_(cur.fetchone()), (0,))
+        self.run_(conn.commit())
+
+    def test_named_cursor_scroll(self):
+        conn = self.connect()
+        self.run_(conn.begin())
+        cur = conn.cursor("aio")
+        self.run_(cur.execute("select generate_series(1, 3)"))
+        self.assertRaises(psycopg2.NotSupportedError, cur.cursor.scroll, 1)
+        self.assertRaises(psycopg2.NotSupportedError,
+            cur.cursor.scroll, 0, 'absolute')
+        self.assert_(not conn.connection.isexecuting())
+        self.assertEqual(self.run_(cur.fetchall()), [(1,), (2,), (3,)])
+        self.run_(cur.close())
+        self.run_(conn.commit())
+
+    def test_named_cursor_no_transaction(self):
+        conn = self.connect()
+        cur = conn.cursor("aio")
+        self.assertRaises(psycopg2.ProgrammingError,
+            self.run_, cur.execute("select 1"))
+        self.assertRaises(psycopg2.ProgrammingError, cur.cursor.prefetch)
+        self.assertRaises(psycopg2.ProgrammingError,
+            conn.cursor().cursor.prefetch)
+
+decorate_all_tests(AioTests, skip_if_no_trollius)
+
+
+class AioPoolTests(unittest.TestCase):
+
+    pool = None
+
+    def setUp(self):
+        import psycopg2.aio
+        self.aio = psycopg2.aio
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        if self.pool is not None and not self.pool.closed:
+            self.pool.closeall()
+        self.loop.close()
+
+    def run_(self, coro):
+        return self.loop.run_until_complete(coro)
+
+    def create_pool(self, minconn, maxconn, **kwargs):
+        self.pool = self.run_(self.aio.create_pool(minconn, maxconn, dsn,
+            loop=self.loop, **kwargs))
+        return self.pool
+
+    def test_open(self):
+        pool = self.create_pool(3, 5, stats=True)
+        stats = pool.get_stats()
+        self.assertEqual(stats['idle'], 3)
+        self.assertEqual(stats['size'], 3)
+        self.assertEqual(stats['connects'], 3)
+
+    def test_connect_error(self):
+        self.assertRaises(psycopg2.OperationalError, self.run_,
+            self.aio.create_pool(2, 2, "dbname=nosuchdb_aio", loop=self.loop))
+
+    def test_acquire_release(self):
+        pool = self.create_pool(1, 2)
+        conn = self.run_(pool.acquire())
+        cur = self.run_(conn.execute("select 1"))
+        self.assertEqual(self.run_(cur.fetchone()), (1,))
+        self.run_(pool.release(conn))
+        self.assert_(self.run_(pool.acquire()) is conn)
+
+    def test_grow_and_shrink(self):
+        pool = self.create_pool(1, 3)
+        conns = [self.run_(pool.acquire()) for i in range(3)]
+        self.assertEqual(len(set(conns)), 3)
+        for conn in conns:
+            self.run_(pool.release(conn))
+        self.assertEqual(len(pool._pool), 1)
+        self.assertEqual(sum(1 for c in conns if c.closed), 2)
+
+    def test_no_wait(self):
+        import psycopg2.pool
+        pool = self.create_pool(0, 1)
+        conn = self.run_(pool.acquire(timeout=0))
+        self.assertRaises(psycopg2.pool.PoolError,
+            self.run_, pool.acquire(timeout=0))
+        self.run_(pool.release(conn))
+
+    def test_timeout(self):
+        import psycopg2.pool
+        pool = self.create_pool(1, 1, stats=True)
+        conn = self.run_(pool.acquire())
+        t0 = time.time()
+        self.assertRaises(psycopg2.pool.PoolError,
+            self.run_, pool.acquire(timeout=0.2))
+        self.assert_(0.15 < time.time() - t0 < 1)
+        stats = pool.get_stats()
+        self.assertEqual(stats['exhausted'], 1)
+        self.assertEqual(stats['wait_timeouts'], 1)
+        self.run_(pool.release(conn))
+
+    def test_waiters_in_order(self):
+        pool = self.create_pool(1, 1)
+        order = []
+
+        @asyncio.coroutine
+        def worker(i):
+            conn = yield From(pool.acquire())
+            order.append(i)
+            yield From(asyncio.sleep(0.01, loop=self.loop))
+            yield From(pool.release(conn))
+
+        # gather() doesn't start the coroutines in order
+        tasks = [asyncio.async(worker(i), loop=self.loop) for i in range(5)]
+        self.run_(asyncio.gather(loop=self.loop, *tasks))
+        self.assertEqual(order, range(5))
+        self.assertEqual(pool._size(), 1)
+
+    def test_bounded_concurrency(self):
+        pool = self.create_pool(0, 3, stats=True)
+        conns = set()
+
+        @asyncio.coroutine
+        def worker():
+            conn = yield From(pool.acquire())
+            conns.add(conn)
+            yield From(conn.execute("select pg_sleep(0.1)"))
+            yield From(pool.release(conn))
+
+        t0 = time.time()
+        self.run_(asyncio.gather(loop=self.loop,
+            *[worker() for i in range(6)]))
+        self.assert_(time.time() - t0 < 0.5)
+        self.assertEqual(len(conns), 3)
+        stats = pool.get_stats()
+        self.assertEqual(stats['checkouts'], 6)
+        self.assertEqual(stats['max_used'], 3)
+
+    def test_release_rollback(self):
+        pool = self.create_pool(1, 1)
+        conn = self.run_(pool.acquire())
+        self.run_(conn.begin())
+        self.run_(conn.execute("select 1"))
+        self.run_(pool.release(conn))
+        self.assertEqual(conn.connection.get_transaction_status(),
+            psycopg2.extensions.TRANSACTION_STATUS_IDLE)
+
+    def test_broken_connection(self):
+        pool = self.create_pool(1, 1)
+        conn = self.run_(pool.acquire())
+        self.run_(pool.release(conn))
+        conn.close()
+        conn2 = self.run_(pool.acquire())
+        self.assert_(conn2 is not conn)
+        self.assert_(not conn2.closed)
+
+    def test_ping_idle(self):
+        pool = self.create_pool(1, 1, ping_idle=0)
+        conn = self.run_(pool.acquire())
+        pid = conn.connection.get_backend_pid()
+        cur = self.run_(conn.execute("select pg_backend_pid()"))
+        self.run_(pool.release(conn))
+
+        kill = psycopg2.connect(dsn)
+        kill.cursor().execute("select pg_terminate_backend(%s)", (pid,))
+        kill.close()
+        time.sleep(0.1)
+
+        conn2 = self.run_(pool.acquire())
+        self.assert_(conn2 is not conn)
+        cur = self.run_(conn2.execute("select 1"))
+        self.assertEqual(self.run_(cur.fetchone()), (1,))
+
+    def test_maintenance(self):
+        pool = self.create_pool(2, 2, max_idle=0.05,
+            maintenance_interval=0.1)
+        old = list(pool._pool)
+        self.run_(asyncio.sleep(0.35, loop=self.loop))
+        self.assertEqual(len(pool._pool), 2)
+        for conn in old:
+            self.assert_(conn.closed)
+
+    def test_closeall_wakes_waiters(self):
+        import psycopg2.pool
+        pool = self.create_pool(1, 1)
+        conn = self.run_(pool.acquire())
+        self.loop.call_later(0.1, pool.closeall)
+        self.assertRaises(psycopg2.pool.PoolError, self.run_, pool.acquire())
+        self.assert_(conn.closed)
+
+    def test_stats_keys(self):
+        import psycopg2.pool
+        pool = self.create_pool(1, 1, stats=True)
+        tpool = psycopg2.pool.ThreadedConnectionPool(1, 1, dsn, stats=True)
+        try:
+            self.assertEqual(sorted(pool.get_stats()),
+                sorted(tpool.get_stats()))
+        finally:
+            tpool.closeall()
+
+decorate_all_tests(AioPoolTests, skip_if_no_trollius)
+
+
+def test_suite():
+    return unittest.TestLoader().loadTestsFromName(__name__)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -254,6 +254,53 @@ class AsyncTests(unittest.TestCase):
                           cur.copy_from,
                           StringIO.StringIO("1\n3\n5\n\\.\n"), "table1")
 
+    def test_async_copy_from(self):
+        cur = self.conn.cursor()
+        data = ''.join(["%d\n" % i for i in xrange(100000)])
+        cur.copy_from(StringIO.StringIO(data), "table1")
+        self.assertTrue(self.conn.isexecuting())
+        stub = PollableStub(self.conn)
+        self.wait(stub)
+        self.assertFalse(self.conn.isexecuting())
+        self.assertEqual(cur.rowcount, 100000)
+        self.assert_(psycopg2.extensions.POLL_WRITE in stub.polls)
+
+        cur.execute("select count(*), max(id) from table1")
+        self.wait(cur)
+        self.assertEqual(cur.fetchone(), (100000, 99999))
+
+    def test_async_copy_to(self):
+        cur = self.conn.cursor()
+        cur.execute("insert into table1 select generate_series(1, 50000)")
+        self.wait(cur)
+
+        f = StringIO.StringIO()
+        cur.copy_expert("copy table1 to stdout", f, size=100)
+        stub = PollableStub(self.conn)
+        self.wait(stub)
+        self.assertEqual(f.getvalue(),
+            ''.join(["%d\n" % i for i in xrange(1, 50001)]))
+        self.assertEqual(cur.rowcount, 50000)
+        self.assert_(psycopg2.extensions.POLL_READ in stub.polls)
+
+    def test_async_copy_error(self):
+        cur = self.conn.cursor()
+        cur.copy_from(StringIO.StringIO("1\nx\n"), "table1")
+        self.assertRaises(psycopg2.DataError, self.wait, self.conn)
+
+        class BrokenFile(object):
+            def read(self, size):
+                raise ZeroDivisionError
+            readline = read
+
+        cur.copy_from(BrokenFile(), "table1")
+        self.assertRaises(ZeroDivisionError, self.wait, self.conn)
+        self.assertFalse(self.conn.isexecuting())
+
+        cur.execute("select count(*) from table1")
+        self.wait(cur)
+        self.assertEqual(cur.fetchone(), (0,))
+
     def test_lobject_while_async(self):
         # large objects should be prohibited
         self.assertRaises(psycopg2.ProgrammingError,
@@ -449,6 +496,87 @@ class AsyncTests(unittest.TestCase):
         self.assertEqual(cur.fetchone(), (42,))
 
 
+class FanOutTests(unittest.TestCase):
+
+    def setUp(self):
+        self.conns = []
+
+    def tearDown(self):
+        for conn in self.conns:
+            conn.close()
+
+    def connect(self, sleeps):
+        from psycopg2.extras import wait_select
+        for sleep in sleeps:
+            conn = psycopg2.connect(dsn, async=True)
+            self.conns.append(conn)
+            wait_select(conn)
+            curs = conn.cursor()
+            curs.execute("set application_name to %s", (sleep,))
+            wait_select(conn)
+        return self.conns
+
+    query = "select pg_sleep(current_setting('application_name')::float), " \
+        "current_setting('application_name')"
+
+    def test_fan_out(self):
+        from psycopg2.extras import fan_out
+        conns = self.connect(['0.3', '0.1', '0.2'])
+        t0 = time.time()
+        rv = list(fan_out(conns, self.query))
+        self.assert_(time.time() - t0 < 0.5)
+        self.assertEqual([conn for conn, curs in rv],
+            [conns[1], conns[2], conns[0]])
+        self.assertEqual([curs.fetchone()[1] for conn, curs in rv],
+            ['0.1', '0.2', '0.3'])
+
+    def test_error(self):
+        from psycopg2.extras import fan_out
+        conns = self.connect(['0.1', 'x'])
+        rv = dict(fan_out(conns, self.query))
+        self.assert_(isinstance(rv[conns[1]], psycopg2.DataError))
+        self.assertEqual(rv[conns[0]].fetchone()[1], '0.1')
+
+    def test_timeout(self):
+        from psycopg2.extras import fan_out
+        conns = self.connect(['0.01', '10'])
+        t0 = time.time()
+        rv = list(fan_out(conns, self.query, timeout=0.2))
+        self.assert_(time.time() - t0 < 2)
+        self.assertEqual(rv[0][0], conns[0])
+        self.assertEqual(rv[0][1].fetchone()[1], '0.01')
+        self.assertEqual(rv[1][0], conns[1])
+        self.assert_(isinstance(rv[1][1], extensions.QueryCanceledError))
+
+    def test_timeout_per_connection(self):
+        # the timeout counts from the moment every query is sent
+        from psycopg2.extras import fan_out
+        conns = self.connect(['0.8', '0.1'])
+        def connections():
+            yield conns[0]
+            time.sleep(0.5)
+            yield conns[1]
+
+        rv = dict(fan_out(connections(), self.query, timeout=0.5))
+        self.assert_(isinstance(rv[conns[0]], extensions.QueryCanceledError))
+        self.assertEqual(rv[conns[1]].fetchone()[1], '0.1')
+
+    def test_close_early(self):
+        from psycopg2.extras import fan_out, wait_select
+        conns = self.connect(['0.01', '10'])
+        t0 = time.time()
+        gen = fan_out(conns, self.query)
+        conn, curs = gen.next()
+        self.assertEqual(conn, conns[0])
+        gen.close()
+        self.assert_(time.time() - t0 < 2)
+
+        curs = conns[1].cursor()
+        curs.execute("select 42")
+        wait_select(conns[1])
+        self.assertEqual(curs.fetchone(), (42,))
+
+
 def test_suite():
     return unittest.TestLoader().loadTestsFromName(__name__)
 
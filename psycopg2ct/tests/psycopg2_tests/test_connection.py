@@ -885,6 +885,111 @@ class TransactionControlTests(unittest.TestCase):
             self.conn.set_session, readonly=True, deferrable=True)
 
 
+class SettingsCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.conn = psycopg2.connect(dsn)
+
+    def tearDown(self):
+        if not self.conn.closed:
+            self.conn.close()
+
+    def set_behind(self, name, value):
+        # change a setting in a way the connection can't detect
+        curs = self.conn.cursor()
+        curs.execute("do $$ begin execute 'set %s to %s'; end $$"
+            % (name, value))
+        self.conn.commit()
+
+    def show(self, name):
+        curs = self.conn.cursor()
+        curs.execute("show %s" % name)
+        rv = curs.fetchone()[0]
+        self.conn.rollback()
+        return rv
+
+    def test_isolation_level_cached(self):
+        level = self.conn.isolation_level
+        self.set_behind('default_transaction_isolation', 'serializable')
+        self.assertEqual(self.conn.isolation_level, level)
+
+        # a SET seen by the connection drops the cache
+        self.conn.cursor().execute("set work_mem to '2MB'")
+        self.conn.commit()
+        self.assertEqual(self.conn.isolation_level,
+            psycopg2.extensions.ISOLATION_LEVEL_SERIALIZABLE)
+
+    def test_set_session_skipped(self):
+        self.conn.set_session(readonly=True)
+        self.assertEqual(self.show('default_transaction_read_only'), 'on')
+        self.set_behind('default_transaction_read_only', 'off')
+        self.conn.set_session(readonly=True)
+        self.assertEqual(self.show('default_transaction_read_only'), 'off')
+        self.conn.set_session(readonly=False)
+        self.conn.set_session(readonly=True)
+        self.assertEqual(self.show('default_transaction_read_only'), 'on')
+
+    def test_rollback(self):
+        curs = self.conn.cursor()
+        curs.execute("set default_transaction_isolation to 'serializable'")
+        self.assertEqual(self.conn.isolation_level,
+            psycopg2.extensions.ISOLATION_LEVEL_SERIALIZABLE)
+        self.conn.rollback()
+        self.assertEqual(self.conn.isolation_level,
+            psycopg2.extensions.ISOLATION_LEVEL_READ_COMMITTED)
+
+    def test_rollback_to_savepoint(self):
+        curs = self.conn.cursor()
+        curs.execute("savepoint sp")
+        curs.execute("set default_transaction_isolation to 'serializable'")
+        self.assertEqual(self.conn.isolation_level,
+            psycopg2.extensions.ISOLATION_LEVEL_SERIALIZABLE)
+        curs.execute("rollback to savepoint sp")
+        self.conn.commit()
+        self.assertEqual(self.conn.isolation_level,
+            psycopg2.extensions.ISOLATION_LEVEL_READ_COMMITTED)
+        self.conn.set_isolation_level(
+            psycopg2.extensions.ISOLATION_LEVEL_SERIALIZABLE)
+        self.assertEqual(self.show('default_transaction_isolation'),
+            'serializable')
+
+    def test_commented_set(self):
+        self.assertEqual(self.conn.isolation_level,
+            psycopg2.extensions.ISOLATION_LEVEL_READ_COMMITTED)
+        curs = self.conn.cursor()
+        curs.execute("/* app */ SET default_transaction_isolation "
+            "= 'serializable'")
+        self.conn.commit()
+        self.assertEqual(self.conn.isolation_level,
+            psycopg2.extensions.ISOLATION_LEVEL_SERIALIZABLE)
+        self.conn.set_session(isolation_level='read committed')
+        self.assertEqual(self.show('default_transaction_isolation'),
+            'read committed')
+
+    def test_set_local(self):
+        level = self.conn.isolation_level
+        curs = self.conn.cursor()
+        curs.execute(
+            "set local default_transaction_isolation to 'serializable'")
+        self.assertEqual(self.conn.isolation_level,
+            psycopg2.extensions.ISOLATION_LEVEL_SERIALIZABLE)
+        self.conn.commit()
+        self.assertEqual(self.conn.isolation_level, level)
+
+    def test_reset(self):
+        self.conn.set_isolation_level(
+            psycopg2.extensions.ISOLATION_LEVEL_SERIALIZABLE)
+        self.conn.reset()
+        self.assertEqual(self.conn.isolation_level,
+            psycopg2.extensions.ISOLATION_LEVEL_READ_COMMITTED)
+
+    def test_reported(self):
+        self.assertEqual(self.conn._get_guc('DateStyle'),
+            self.show('DateStyle'))
+        self.assert_('datestyle' not in self.conn._gucs)
+        self.conn.set_client_encoding('LATIN1')
+        self.assertEqual(self.conn._get_guc('client_encoding'), 'LATIN1')
+
+
 class AutocommitTests(unittest.TestCase):
     def setUp(self):
         self.conn = psycopg2.connect(dsn)
@@ -25,12 +25,17 @@
 import os
 import sys
 import string
+from datetime import date, datetime, timedelta
+from decimal import Decimal
 from testutils import unittest, decorate_all_tests, skip_if_no_iobase
+from testutils import skip_if_tpc_disabled, skip_before_python
+from testutils import skip_before_postgres
 from cStringIO import StringIO
 from itertools import cycle, izip
 
 import psycopg2
 import psycopg2.extensions
+import psycopg2.extras
 from testconfig import dsn, green
 
 def skip_if_green(f):
@@ -127,6 +132,48 @@ class CopyTests(unittest.TestCase):
         self.assertRaises(ZeroDivisionError,
             curs.copy_from, MinimalRead(f), "tcopy", columns=cols())
 
+    def _check_copy_buffer(self, data, nrecs):
+        curs = self.conn.cursor()
+        curs.execute("delete from tcopy")
+        curs.copy_from(data, 'tcopy', columns=('id', 'data'))
+        self.assertEqual(curs.rowcount, nrecs)
+        curs.execute("select count(*), max(data) from tcopy")
+        self.assertEqual(curs.fetchone(), (nrecs, 'x' * 10))
+
+    def test_copy_from_buffers(self):
+        data = ''.join(["%d\t%s\n" % (i, 'x' * (i % 11))
+            for i in xrange(100000)])
+        self._check_copy_buffer(data, 100000)
+        self._check_copy_buffer(buffer(data), 100000)
+        self._check_copy_buffer(bytearray(data), 100000)
+        self._check_copy_buffer(buffer(data, 0, data.index('11\t')), 11)
+
+    @skip_before_python(2, 7)
+    def test_copy_from_memoryview(self):
+        data = ''.join(["%d\t%s\n" % (i, 'x' * (i % 11))
+            for i in xrange(100000)])
+        self._check_copy_buffer(memoryview(data), 100000)
+
+    def test_copy_from_mmap(self):
+        import mmap
+        import tempfile
+        f = tempfile.TemporaryFile()
+        f.write('header\n')
+        for i in xrange(1000):
+            f.write("%d\t%s\n" % (i, 'x' * (i % 11)))
+        f.flush()
+        m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        m.readline()
+        self._check_copy_buffer(m, 1000)
+        self.assertEqual(m.tell(), m.size())
+
+        curs = self.conn.cursor()
+        curs.execute("delete from tcopy")
+        m.seek(0)
+        m.readline()
+        curs.copy_expert("COPY tcopy (id, data) FROM STDIN", m)
+        self.assertEqual(curs.rowcount, 1000)
+
     def test_copy_to(self):
         curs = self.conn.cursor()
         try:
@@ -271,10 +318,449 @@ class CopyTests(unittest.TestCase):
         curs.execute("select count(*) from manycols;")
         self.assertEqual(curs.fetchone()[0], 2)
 
+    def _create_records_table(self):
+        curs = self.conn.cursor()
+        curs.execute('''
+            CREATE TEMPORARY TABLE trecords (
+              id int, data text, flag bool, num numeric, f float8,
+              day date, ts timestamp, span interval, bin bytea, arr text[]
+            )''')
+        return curs
+
+    def _test_copy_records(self, format):
+        curs = self._create_records_table()
+        records = [
+            (1, 'a\tb\nc\\d,"e"', True, Decimal('1.5'), 0.1,
+                date(2011, 1, 2), datetime(2011, 1, 2, 3, 4, 5, 6),
+                timedelta(days=1, seconds=2, microseconds=500000),
+                buffer('\x00\\\t\xff'),
+                ['x', None, 'NULL', 'a "b" \\', '']),
+            (2, u'\xe0\xe8', False, None, float('-inf'),
+                None, None, timedelta(seconds=-1), None, []),
+            (3, '', None, Decimal('-1E+3'), None, None, None, None,
+                bytearray('abc'), None),
+        ]
+        curs.copy_records('trecords', None, records, format=format)
+        self.assertEqual(curs.rowcount, 3)
+
+        curs.execute("select * from trecords order by id")
+        rows = curs.fetchall()
+        self.assertEqual(len(rows), 3)
+        def norm(v):
+            if isinstance(v, (buffer, bytearray)):
+                return str(v)
+            if isinstance(v, unicode):
+                return v.encode('utf8')
+            return v
+
+        for got, want in zip(rows, records):
+            self.assertEqual(map(norm, got[:9]), map(norm, want[:9]))
+
+        curs.execute("select arr::text from trecords order by id")
+        self.assertEqual(curs.fetchall(), [
+            ('{x,NULL,"NULL","a \\"b\\" \\\\",""}',), ('{}',), (None,)])
+
+    def test_copy_records_text(self):
+        self.conn.set_client_encoding('UTF8')
+        self._test_copy_records('text')
+
+    def test_copy_records_csv(self):
+        self.conn.set_client_encoding('UTF8')
+        self._test_copy_records('csv')
+
+    def test_copy_records_binary(self):
+        curs = self._create_records_table()
+        types = ['int4', 'text', 'bool', 'numeric', 'float8', 'date',
+            'timestamp', 'interval', 'bytea', 'text[]']
+        records = [
+            (1, 'a\tb', True, Decimal('-12345.678900'), 0.1,
+                date(2011, 1, 2), datetime(2011, 1, 2, 3, 4, 5, 6),
+                timedelta(days=1, seconds=2, microseconds=3),
+                buffer('\x00\\\xff'), ['x', None, 'NULL']),
+            (2, None, None, None, None, None, None, None, None, []),
+        ]
+        curs.copy_records('trecords', None, records, format='binary',
+            types=types)
+        self.assertEqual(curs.rowcount, 2)
+
+        curs.execute("select numeric_text, arr::text from (select "
+            "num::text as numeric_text, arr from trecords order by id) x")
+        self.assertEqual(curs.fetchall(),
+            [('-12345.678900', '{x,NULL,"NULL"}'), (None, '{}')])
+
+        rows = []
+        decoder = psycopg2.extensions.BinaryCopyDecoder(self.conn, types,
+            rows.append)
+        curs.copy_expert(
+            "COPY (select * from trecords order by id) TO STDOUT BINARY",
+            decoder)
+        self.assertTrue(decoder.done)
+        self.assertEqual(decoder.rows, 2)
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[0][:8], records[0][:8])
+        self.assertEqual(str(rows[0][8]), str(records[0][8]))
+        self.assertEqual(rows[0][9], records[0][9])
+        self.assertEqual(rows[1], records[1])
+
+    def test_copy_records_columns(self):
+        curs = self.conn.cursor()
+        records = ((i, 'x' * (i % 100)) for i in xrange(10000))
+        curs.copy_records('tcopy', ('id', 'data'), records, size=1000)
+        self.assertEqual(curs.rowcount, 10000)
+        curs.execute("select count(*), sum(length(data)) from tcopy")
+        self.assertEqual(curs.fetchone(), (10000, 495000))
+
+    def test_copy_records_error(self):
+        curs = self.conn.cursor()
+
+        def records():
+            yield (1, 'a')
+            raise ZeroDivisionError()
+
+        self.assertRaises(ZeroDivisionError,
+            curs.copy_records, 'tcopy', None, records())
+        self.conn.rollback()
+
+        self._create_temp_table()
+        self.assertRaises(psycopg2.DataError,
+            curs.copy_records, 'tcopy', None, [('x', 'a')])
+        self.assertRaises(ValueError,
+            curs.copy_records, 'tcopy', None, [], format='xml')
+
+        self.conn.rollback()
+        curs.execute("select 1")
+        self.assertEqual(curs.fetchone(), (1,))
+
+    def test_copy_to_coalesce(self):
+        class CountWrites(object):
+            def __init__(self):
+                self.writes = []
+            def write(self, data):
+                self.writes.append(data)
+
+        curs = self.conn.cursor()
+        curs.execute("insert into tcopy (data) "
+            "select repeat('x', 10) from generate_series(1, 1000)")
+        f = CountWrites()
+        curs.copy_to(f, 'tcopy', columns=('data',), size=4096)
+        self.assertEqual(''.join(f.writes), ('x' * 10 + '\n') * 1000)
+        self.assertEqual(len(f.writes), 3)
+        self.assertEqual(curs.rowcount, 1000)
+
+    def test_copy_to_bytearray(self):
+        curs = self.conn.cursor()
+        curs.execute("insert into tcopy (data) values ('a\tb'), ('c')")
+        buf = bytearray('head:')
+        curs.copy_to(buf, 'tcopy', columns=('data',))
+        self.assertEqual(str(buf), 'head:a\\tb\nc\n')
+
+        buf = bytearray()
+        curs.copy_expert("COPY tcopy (data) TO STDOUT", buf, size=1)
+        self.assertEqual(str(buf), 'a\\tb\nc\n')
+
+    def test_copy_to_mmap(self):
+        import mmap
+        curs = self.conn.cursor()
+        curs.execute("insert into tcopy (data) values ('a'), ('b')")
+        m = mmap.mmap(-1, 100)
+        curs.copy_expert("COPY tcopy (data) TO STDOUT", m)
+        self.assertEqual(m.tell(), 4)
+        self.assertEqual(m[:4], 'a\nb\n')
+
+    def test_copy_to_error(self):
+        curs = self.conn.cursor()
+        f = StringIO()
+        self.assertRaises(psycopg2.DataError, curs.copy_expert,
+            "COPY (select 1 / (3 - i) from generate_series(1, 5) i) "
+            "TO STDOUT", f)
+        self.conn.rollback()
+
+        class BadFile(object):
+            def write(self, data):
+                raise ZeroDivisionError()
+
+        self.assertRaises(ZeroDivisionError, curs.copy_expert,
+            "COPY (select generate_series(1, 10000)) TO STDOUT", BadFile())
+        curs.execute("select 42")
+        self.assertEqual(curs.fetchone(), (42,))
+
+    def test_copy_rows(self):
+        curs = self.conn.cursor()
+        query = """select i, 'a\tb\\' || i, i %% 3 = 0, i::numeric / 4,
+            '2011-01-02'::date + i, '{1,2}'::int[],
+            decode('00ff', 'hex'), nullif(i, i)
+            from generate_series(1, %s) i"""
+        curs.execute(query, (100,))
+        want = curs.fetchall()
+
+        rows = curs.copy_rows(query, (100,))
+        self.assertEqual(curs.description[0].name, 'i')
+        got = list(rows)
+        self.assertEqual(curs.rowcount, 100)
+        self.assertEqual(len(got), 100)
+        for g, w in zip(got, want):
+            self.assertEqual(g[:6], w[:6])
+            self.assertEqual(str(g[6]), str(w[6]))
+            self.assertEqual(g[7], None)
+
+    def test_copy_rows_dict(self):
+        curs = self.conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+        rows = list(curs.copy_rows(
+            "select i as x from generate_series(1, 3) i"))
+        self.assertEqual([r['x'] for r in rows], [1, 2, 3])
+
+    def test_copy_rows_semicolon(self):
+        curs = self.conn.cursor()
+        rows = list(curs.copy_rows(
+            "select i from generate_series(1, %s) i ;\n ; ", (3,)))
+        self.assertEqual(rows, [(1,), (2,), (3,)])
+
+    def test_copy_rows_close(self):
+        curs = self.conn.cursor()
+        rows = curs.copy_rows("select i from generate_series(1, 100000) i")
+        self.assertEqual(rows.next(), (1,))
+        self.assertEqual(rows.next(), (2,))
+        rows.close()
+
+        curs.execute("select 42")
+        self.assertEqual(curs.fetchone(), (42,))
+
+    def test_copy_rows_not_iterated(self):
+        curs = self.conn.cursor()
+        query = "select i from generate_series(1, 100000) i"
+        rows = curs.copy_rows(query)
+        self.assertEqual(curs.description[0].name, 'i')
+        rows.close()
+        curs.execute("select 42")
+        self.assertEqual(curs.fetchone(), (42,))
+
+        rows = curs.copy_rows(query)
+        del rows
+        curs.execute("select 42")
+        self.assertEqual(curs.fetchone(), (42,))
+
+        rows = curs.copy_rows(query)
+        self.assertEqual(rows.next(), (1,))
+        del rows
+        curs.execute("select 42")
+        self.assertEqual(curs.fetchone(), (42,))
+
+    @skip_before_postgres(9, 6)
+    def test_copy_rows_executed_once(self):
+        curs = self.conn.cursor()
+        curs.execute("create temp table tonce (id serial, data text)")
+        rows = list(curs.copy_rows(
+            "insert into tonce (data) values (%s), (%s) returning id, data",
+            ('a', 'b')))
+        self.assertEqual(rows, [(1, 'a'), (2, 'b')])
+        curs.execute("select count(*) from tonce")
+        self.assertEqual(curs.fetchone(), (2,))
+
+    def test_copy_rows_error(self):
+        curs = self.conn.cursor()
+        self.assertRaises(psycopg2.ProgrammingError,
+            curs.copy_rows, "select nosuchcol")
+        self.conn.rollback()
+
+        rows = curs.copy_rows("select 1 / (3 - i) from generate_series(1, 5) i")
+        self.assertRaises(psycopg2.DataError, list, rows)
+        self.conn.rollback()
+        curs.execute("select 42")
+        self.assertEqual(curs.fetchone(), (42,))
+
 
 decorate_all_tests(CopyTests, skip_if_green)
 
 
+class ParallelCopyTests(unittest.TestCase):
+
+    def setUp(self):
+        import psycopg2.pool
+        self.conn = self.connect()
+        curs = self.conn.cursor()
+        curs.execute("drop table if exists tparallel")
+        curs.execute("create table tparallel (id int primary key, data text)")
+        self.conn.commit()
+        self.pool = psycopg2.pool.ThreadedConnectionPool(0, 4, dsn)
+
+    def tearDown(self):
+        self.pool.closeall()
+        self.conn.rollback()
+        self.conn.cursor().execute("drop table tparallel")
+        self.conn.commit()
+        self.conn.close()
+
+    def connect(self):
+        return psycopg2.connect(dsn)
+
+    def count(self):
+        curs = self.conn.cursor()
+        curs.execute("select count(*), count(distinct data) from tparallel")
+        rv = curs.fetchone()
+        self.conn.rollback()
+        return rv
+
+    def test_file(self):
+        f = StringIO(''.join(["%d\t%s\n" % (i, 'x' * (i % 7))
+            for i in xrange(10000)]))
+        n = psycopg2.extras.copy_parallel(self.pool, f, 'tparallel',
+            size=1000)
+        self.assertEqual(n, 10000)
+        self.assertEqual(self.count(), (10000, 7))
+        self.assertEqual(len(self.pool._used), 0)
+
+    def test_records(self):
+        records = ((i, i % 5 and str(i % 5) or None) for i in xrange(10000))
+        n = psycopg2.extras.copy_parallel(self.pool, records, 'tparallel',
+            columns=('id', 'data'), rows=100, workers=3)
+        self.assertEqual(n, 10000)
+        self.assertEqual(self.count(), (10000, 4))
+        self.assertEqual(len(self.pool._used), 0)
+
+    def test_error(self):
+        records = [(i,) for i in xrange(1000)] + [(0,)] \
+            + [(i,) for i in xrange(1000, 2000)]
+        self.assertRaises(psycopg2.IntegrityError,
+            psycopg2.extras.copy_parallel, self.pool, records, 'tparallel',
+            columns=('id',), rows=10)
+
+        # the chunks loaded before the error are kept
+        self.assert_(0 < self.count()[0] < 2000)
+        self.assertEqual(len(self.pool._used), 0)
+
+    @skip_if_tpc_disabled
+    def test_two_phase(self):
+        records = [(i,) for i in xrange(1000)]
+        n = psycopg2.extras.copy_parallel(self.pool, records, 'tparallel',
+            columns=('id',), rows=10, two_phase=True)
+        self.assertEqual(n, 1000)
+        self.assertEqual(self.count()[0], 1000)
+
+    @skip_if_tpc_disabled
+    def test_two_phase_error(self):
+        records = [(i,) for i in xrange(1000)] + [('x',)] \
+            + [(i,) for i in xrange(1000, 2000)]
+        self.assertRaises(psycopg2.DataError,
+            psycopg2.extras.copy_parallel, self.pool, records, 'tparallel',
+            columns=('id',), rows=10, two_phase=True)
+        self.assertEqual(self.count()[0], 0)
+
+        curs = self.conn.cursor()
+        curs.execute("select count(*) from pg_prepared_xacts")
+        self.assertEqual(curs.fetchone()[0], 0)
+
+    @skip_if_tpc_disabled
+    def test_two_phase_commit_error(self):
+        # the second transaction fails to commit: the following ones must
+        # not be left prepared
+        commits = []
+        class FailingConnection(psycopg2.extensions.connection):
+            def tpc_commit(self, xid=None):
+                commits.append(self)
+                if len(commits) == 2:
+                    raise psycopg2.OperationalError("commit failed")
+                return super(FailingConnection, self).tpc_commit(xid)
+
+        self.pool.closeall()
+        self.pool = psycopg2.pool.ThreadedConnectionPool(0, 4, dsn,
+            connection_factory=FailingConnection)
+
+        records = [(i,) for i in xrange(1000)]
+        self.assertRaises(psycopg2.OperationalError,
+            psycopg2.extras.copy_parallel, self.pool, records, 'tparallel',
+            columns=('id',), rows=10, two_phase=True)
+        self.assertEqual(len(commits), 2)
+        self.assert_(self.count()[0] < 1000)
+        self.assertEqual(len(self.pool._used), 0)
+
+        curs = self.conn.cursor()
+        curs.execute("select count(*) from pg_prepared_xacts")
+        self.assertEqual(curs.fetchone()[0], 0)
+
+    @skip_if_tpc_disabled
+    def test_two_phase_broken_worker(self):
+        # the worker can't even roll back: copy_parallel() must not block
+        def records():
+            for i in xrange(2000):
+                if i == 100:
+                    for conn in self.pool._used.values():
+                        curs = self.conn.cursor()
+                        curs.execute("select pg_terminate_backend(%s)",
+                            (conn.get_backend_pid(),))
+                        self.conn.rollback()
+                yield (i,)
+
+        self.assertRaises(psycopg2.OperationalError,
+            psycopg2.extras.copy_parallel, self.pool, records(), 'tparallel',
+            columns=('id',), rows=10, workers=1, two_phase=True)
+        self.assertEqual(self.count()[0], 0)
+        self.assertEqual(len(self.pool._used), 0)
+
+
+class TransferTests(unittest.TestCase):
+
+    def setUp(self):
+        self.src = psycopg2.connect(dsn)
+        self.dst = psycopg2.connect(dsn)
+        curs = self.dst.cursor()
+        curs.execute("create temp table tdst (id int, data text, ts date)")
+        self.dst.commit()
+
+    def tearDown(self):
+        self.src.close()
+        self.dst.close()
+
+    def _test_transfer(self, binary):
+        reports = []
+        stats = psycopg2.extras.transfer(self.src,
+            "select i, 'x' || i, '2011-01-01'::date + i "
+            "from generate_series(1, 10000) i",
+            self.dst, 'tdst', binary=binary, size=1000, buffers=2,
+            progress=reports.append, interval=0)
+        self.assertEqual(stats.rows, 10000)
+        self.assert_(stats.bytes > 10000)
+        self.assert_(stats.chunks > 10)
+        self.assert_(len(reports) > 10)
+        self.assert_(reports[-1] is stats)
+
+        curs = self.dst.cursor()
+        curs.execute("select count(*), max(data), max(ts) from tdst")
+        self.assertEqual(curs.fetchone(),
+            (10000, 'x9999', date(2038, 5, 19)))
+
+    def test_transfer_text(self):
+        self._test_transfer(False)
+
+    def test_transfer_binary(self):
+        self._test_transfer(True)
+
+    def test_transfer_columns(self):
+        psycopg2.extras.transfer(self.src, "select 'a', 1",
+            self.dst, 'tdst', columns=('data', 'id'))
+        curs = self.dst.cursor()
+        curs.execute("select * from tdst")
+        self.assertEqual(curs.fetchall(), [(1, 'a', None)])
+
+    def test_src_error(self):
+        self.assertRaises(psycopg2.DataError, psycopg2.extras.transfer,
+            self.src, "select 1 / (10000 - i), 'x', null "
+            "from generate_series(1, 20000) i",
+            self.dst, 'tdst', size=100)
+        self.dst.rollback()
+        curs = self.dst.cursor()
+        curs.execute("select count(*) from tdst")
+        self.assertEqual(curs.fetchone()[0], 0)
+
+    def test_dst_error(self):
+        self.assertRaises(psycopg2.DataError, psycopg2.extras.transfer,
+            self.src, "select 'x', 'x', null from generate_series(1, 100000)",
+            self.dst, 'tdst', size=100, buffers=1)
+        self.src.rollback()
+        curs = self.src.cursor()
+        curs.execute("select 42")
+        self.assertEqual(curs.fetchone(), (42,))
+
+
 def test_suite():
     return unittest.TestLoader().loadTestsFromName(__name__)
 
@@ -0,0 +1,156 @@
+import datetime
+import struct
+import uuid
+from decimal import Decimal
+from testutils import unittest
+
+import psycopg2
+from psycopg2.extensions import BinaryCopyEncoder, BinaryCopyDecoder
+from psycopg2.extensions import CopySource
+from psycopg2.tz import FixedOffsetTimezone
+
+
+class FakeConnection(object):
+    _py_enc = 'utf8'
+    server_version = 90100
+
+
+class BinaryCopyTests(unittest.TestCase):
+    def roundtrip(self, types, records, chunk=None):
+        conn = FakeConnection()
+        source = CopySource(records, BinaryCopyEncoder(conn, types))
+        rows = []
+        decoder = BinaryCopyDecoder(conn, types, rows.append)
+        data = source.read()
+        if chunk is None:
+            decoder.write(data)
+        else:
+            for i in xrange(0, len(data), chunk):
+                decoder.write(data[i:i + chunk])
+
+        self.assertTrue(decoder.done)
+        self.assertEqual(source.rows, len(records))
+        self.assertEqual(decoder.rows, len(records))
+        return rows
+
+    def test_scalars(self):
+        types = ['bool', 'int2', 'int4', 'int8', 'float8', 'text', 'bytea']
+        records = [
+            (True, 1, -2, 2 ** 40, 0.5, 'foo', buffer('\x00\xff')),
+            (False, None, 0, None, None, '', buffer('')),
+        ]
+        rows = self.roundtrip(types, records)
+        self.assertEqual(rows[0][:6], records[0][:6])
+        self.assertEqual(str(rows[0][6]), '\x00\xff')
+        self.assertEqual(rows[1][:6], records[1][:6])
+
+    def test_unicode(self):
+        rows = self.roundtrip(['text'], [(u'\xe0',)])
+        self.assertEqual(rows, [('\xc3\xa0',)])
+
+    def test_numeric(self):
+        values = ['0', '1', '-1', '0.00001', '1E+3', '12345.6789',
+            '-0.1000', '100000000000000000000.000000000000000000001',
+            'NaN']
+        rows = self.roundtrip(['numeric'], [(Decimal(v),) for v in values])
+        for row, v in zip(rows, values):
+            if v == 'NaN':
+                self.assertTrue(row[0].is_nan())
+            else:
+                self.assertEqual(row[0], Decimal(v))
+                self.assertEqual(row[0].as_tuple()[2],
+                    min(0, Decimal(v).as_tuple()[2]))
+
+    def test_datetime(self):
+        types = ['date', 'time', 'timestamp', 'timestamptz', 'interval']
+        tzinfo = FixedOffsetTimezone(90)
+        records = [(
+            datetime.date(1999, 12, 31),
+            datetime.time(23, 59, 59, 999999),
+            datetime.datetime(2011, 1, 2, 3, 4, 5, 6),
+            datetime.datetime(2011, 1, 2, 3, 4, 5, 6, tzinfo),
+            datetime.timedelta(-1, 5, 6),
+        )]
+        rows = self.roundtrip(types, records)
+        self.assertEqual(rows, records)
+        self.assertEqual(rows[0][3].utcoffset(), datetime.timedelta(0))
+
+    def decode_field(self, type, data):
+        conn = FakeConnection()
+        stream = CopySource([], BinaryCopyEncoder(conn, [type])).read()
+        rows = []
+        decoder = BinaryCopyDecoder(conn, [type], rows.append)
+        decoder.write(stream[:-2]
+            + struct.pack('!hi', 1, len(data)) + data + stream[-2:])
+        return rows[0][0]
+
+    def test_datetime_out_of_range(self):
+        day = 86400 * 1000000
+        # 4713-01-01 BC and 10000-01-01
+        self.assertRaises(psycopg2.DataError,
+            self.decode_field, 'date', struct.pack('!i', -2451545))
+        self.assertRaises(psycopg2.DataError,
+            self.decode_field, 'date', struct.pack('!i', 2921940))
+        self.assertRaises(psycopg2.DataError,
+            self.decode_field, 'timestamp', struct.pack('!q', -2451545 * day))
+        self.assertRaises(psycopg2.DataError,
+            self.decode_field, 'timestamptz', struct.pack('!q', 2921940 * day))
+
+        # the infinities are still mapped to min and max
+        self.assertEqual(datetime.date.min,
+            self.decode_field('date', struct.pack('!i', -0x80000000)))
+        self.assertEqual(datetime.datetime.max,
+            self.decode_field('timestamp', struct.pack('!q', 2 ** 63 - 1)))
+
+    def test_interval_months(self):
+        # 1 month is not 30 days
+        self.assertRaises(psycopg2.DataError,
+            self.decode_field, 'interval', struct.pack('!qii', 0, 0, 1))
+        self.assertEqual(datetime.timedelta(40, 1),
+            self.decode_field('interval', struct.pack('!qii', 1000000, 40, 0)))
+
+    def test_uuid(self):
+        u = uuid.uuid4()
+        self.assertEqual(self.roundtrip(['uuid'], [(u,)]), [(u,)])
+
+    def test_arrays(self):
+        records = [([1, None, 3], ['a', 'b']), ([], None)]
+        rows = self.roundtrip(['int4[]', 1009], records, chunk=3)
+        self.assertEqual(rows, [([1, None, 3], ['a', 'b']), ([], None)])
+
+    def test_chunked(self):
+        records = [(i, 'x' * i) for i in xrange(100)]
+        rows = self.roundtrip(['int4', 'text'], records, chunk=7)
+        self.assertEqual(rows, records)
+
+    def test_streaming(self):
+        # every record is passed on as soon as its data is available
+        conn = FakeConnection()
+        records = [(i,) for i in xrange(3)]
+        data = CopySource(records, BinaryCopyEncoder(conn, ['int4'])).read()
+        rows = []
+        decoder = BinaryCopyDecoder(conn, ['int4'], rows.append)
+        decoder.write(data[:19 + 2 + 8])
+        self.assertEqual(rows, [(0,)])
+        decoder.write(data[19 + 2 + 8:-12])
+        self.assertEqual(rows, [(0,), (1,)])
+        self.assertFalse(decoder.done)
+        decoder.write(data[-12:])
+        self.assertEqual(rows, records)
+        self.assertTrue(decoder.done)
+
+    def test_errors(self):
+        conn = FakeConnection()
+        self.assertRaises(psycopg2.NotSupportedError,
+            BinaryCopyEncoder, conn, ['point'])
+        encoder = BinaryCopyEncoder(conn, ['int4'])
+        self.assertRaises(ValueError, encoder.encode_row, (1, 2))
+        decoder = BinaryCopyDecoder(conn, ['int4'], lambda row: None)
+        self.assertRaises(psycopg2.DataError, decoder.write, 'x' * 20)
+
+
+def test_suite():
+    return unittest.TestLoader().loadTestsFromName(__name__)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -31,6 +31,11 @@ from testconfig import dsn
 from testutils import unittest, skip_before_postgres, skip_if_no_namedtuple
 from testutils import skipIf
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 class CursorTests(unittest.TestCase):
 
     def setUp(self):
@@ -337,6 +342,103 @@ class CursorTests(unittest.TestCase):
         self.assertRaises((IndexError, psycopg2.ProgrammingError),
             cur.scroll, 10, mode='absolute')
 
+    def test_row_maker(self):
+        calls = []
+        def maker(curs):
+            calls.append([d[0] for d in curs.description])
+            return list
+
+        cur = self.conn.cursor()
+        cur.row_maker = maker
+        cur.execute("select x, x * 2 as y from generate_series(1, 3) x")
+        self.assertEqual(calls, [['x', 'y']])
+        self.assertEqual(cur.fetchone(), [1, 2])
+        self.assertEqual(cur.fetchall(), [[2, 4], [3, 6]])
+
+    def test_row_maker_named(self):
+        calls = []
+        def maker(curs):
+            calls.append(len(curs.description))
+            return lambda values: values[0]
+
+        cur = self.conn.cursor('tmp')
+        cur.row_maker = maker
+        cur.execute("select generate_series(1, 5), null::int")
+        self.assertEqual(cur.fetchmany(2), [1, 2])
+        self.assertEqual(cur.fetchall(), [3, 4, 5])
+        self.assertEqual(calls, [2, 2])
+
+    @skipIf(numpy is None, "numpy not available")
+    def test_fetch_numpy(self):
+        cur = self.conn.cursor()
+        cur.execute("""select i, i / 2.0::float8, i > 1, i::text,
+            ('2011-01-0' || i)::date
+            from generate_series(1, 3) i
+            union all select null, null, null, null, null""")
+        ints, floats, bools, texts, dates = cur.fetch_numpy()
+        self.assertEqual(ints.dtype, numpy.int32)
+        self.assertEqual(list(ints.mask), [False, False, False, True])
+        self.assertEqual(list(ints[:3]), [1, 2, 3])
+        self.assertEqual(list(floats[:3]), [0.5, 1.0, 1.5])
+        self.assert_(numpy.isnan(floats[3]))
+        self.assertEqual(list(bools[:3]), [False, True, True])
+        self.assertEqual(list(texts), ['1', '2', '3', None])
+        self.assertEqual(dates[2], numpy.datetime64('2011-01-03'))
+        self.assert_(numpy.isnat(dates[3]))
+
+    @skipIf(numpy is None, "numpy not available")
+    def test_fetch_numpy_special_dates(self):
+        cur = self.conn.cursor()
+        cur.execute("set timezone to 'UTC'")
+        cur.execute("""select d::date, d::timestamp, d::timestamptz
+            from (values ('infinity'), ('-infinity'), ('0044-03-15 BC'),
+                ('0001-01-01 BC'), (null)) v (d)""")
+        dates, tss, tstzs = cur.fetch_numpy()
+        for a in dates, tss, tstzs:
+            self.assert_(numpy.isnat(a[0]))
+            self.assert_(numpy.isnat(a[1]))
+            self.assert_(numpy.isnat(a[4]))
+        self.assertEqual(dates[2], numpy.datetime64('-0043-03-15'))
+        self.assertEqual(dates[3], numpy.datetime64('0000-01-01'))
+        self.assertEqual(tss[2], numpy.datetime64('-0043-03-15T00:00'))
+        self.assertEqual(tstzs[2], numpy.datetime64('-0043-03-15T00:00'))
+        self.assertEqual(tstzs[3], numpy.datetime64('0000-01-01T00:00'))
+
+    @skipIf(numpy is None, "numpy not available")
+    def test_fetch_numpy_named(self):
+        cur = self.conn.cursor('tmp')
+        cur.execute("select generate_series(1, 10) as x")
+        x, = cur.fetch_numpy(4, dtypes={'x': 'float64'})
+        self.assertEqual(x.dtype, numpy.float64)
+        self.assertEqual(list(x), [1.0, 2.0, 3.0, 4.0])
+        x, = cur.fetch_numpy()
+        self.assertEqual(list(x), range(5, 11))
+        x, = cur.fetch_numpy()
+        self.assertEqual(len(x), 0)
+
+    @skipIf(numpy is None, "numpy not available")
+    def test_iter_numpy_named(self):
+        cur = self.conn.cursor('tmp')
+        cur.execute("""select i as a, nullif(i % 3, 0) as b
+            from generate_series(1, 7) i""")
+        chunks = list(cur.iter_numpy(3))
+        self.assertEqual([len(c['a']) for c in chunks], [3, 3, 1])
+        self.assertEqual(list(chunks[1]['a']), [4, 5, 6])
+        self.assertEqual(list(chunks[1]['b'].mask), [False, False, True])
+
+    @skipIf(numpy is None, "numpy not available")
+    def test_iter_numpy_structured(self):
+        cur = self.conn.cursor()
+        cur.execute("""select i as a, nullif(i % 3, 0) as b
+            from generate_series(1, 5) i""")
+        chunks = list(cur.iter_numpy(4, dtypes={'b': 'float64'},
+            structured=True))
+        self.assertEqual(len(chunks), 2)
+        self.assertEqual(chunks[0].dtype.names, ('a', 'b'))
+        self.assertEqual(list(chunks[0]['a']), [1, 2, 3, 4])
+        self.assert_(numpy.isnan(chunks[0]['b'][2]))
+        self.assertEqual(list(chunks[1]['b']), [2.0])
+
 
 def test_suite():
     return unittest.TestLoader().loadTestsFromName(__name__)
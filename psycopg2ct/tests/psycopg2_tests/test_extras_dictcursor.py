@@ -177,6 +177,13 @@ class NamedTupleCursorTest(unittest.TestCase):
         if self.conn is not None:
             self.conn.close()
 
+    @skip_if_no_namedtuple
+    def test_bad_names_fail_on_fetch(self):
+        curs = self.conn.cursor()
+        curs.execute("select 1")
+        self.assertEqual(curs.rowcount, 1)
+        self.assertRaises(ValueError, curs.fetchone)
+
     @skip_if_no_namedtuple
     def test_fetchone(self):
         curs = self.conn.cursor()
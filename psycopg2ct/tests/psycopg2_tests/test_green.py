@@ -95,6 +95,78 @@ class GreenTests(unittest.TestCase):
         self.assertEqual(2, curs.fetchone()[0])
 
 
+    def test_copy_out(self):
+        conn = self.conn
+        stub = self.set_stub_wait_callback(conn)
+        curs = conn.cursor()
+        from StringIO import StringIO
+        f = StringIO()
+        curs.copy_expert(
+            "COPY (select i, pg_sleep(0.1) from generate_series(1, 3) i) "
+            "TO STDOUT", f, size=1)
+        self.assertEqual(f.getvalue(), '1\t\n2\t\n3\t\n')
+        self.assert_(psycopg2.extensions.POLL_READ in stub.polls)
+
+        rows = list(curs.copy_rows("select generate_series(1, 3)"))
+        self.assertEqual(rows, [(1,), (2,), (3,)])
+
+        curs.execute("select 42")
+        self.assertEqual(curs.fetchone(), (42,))
+
+        # an iterator never used doesn't leave the connection in COPY
+        rows = curs.copy_rows("select generate_series(1, 3)")
+        del rows
+        curs.execute("select 42")
+        self.assertEqual(curs.fetchone(), (42,))
+
+    def test_copy_in(self):
+        conn = self.conn
+        stub = self.set_stub_wait_callback(conn)
+        curs = conn.cursor()
+        curs.execute("create temp table copy_in (data text)")
+        from StringIO import StringIO
+        for mb in 1, 5, 10, 20:
+            del stub.polls[:]
+            row = 'x' * 1023 + '\n'
+            curs.copy_from(StringIO(row * (mb * 1024)), 'copy_in',
+                size=1024 * 1024)
+            self.assertEqual(curs.rowcount, mb * 1024)
+            if stub.polls.count(psycopg2.extensions.POLL_WRITE) > 1:
+                break
+        else:
+            import warnings
+            warnings.warn("a large copy didn't trigger block on write.")
+
+        curs.execute("select 42")
+        self.assertEqual(curs.fetchone(), (42,))
+
+    def test_wait_poll(self):
+        conn = self.conn
+        stub = ConnectionStub(conn)
+        psycopg2.extensions.set_wait_callback(
+            lambda conn: psycopg2.extras.wait_poll(stub))
+        curs = conn.cursor()
+        curs.execute("select pg_sleep(0.1), %s", ('x' * 1024 * 1024,))
+        self.assertEqual(len(curs.fetchone()[1]), 1024 * 1024)
+        self.assert_(psycopg2.extensions.POLL_READ in stub.polls)
+
+    def test_wait_poll_timeout(self):
+        import time
+        conn = self.conn
+        psycopg2.extensions.set_wait_callback(
+            lambda conn: psycopg2.extras.wait_poll(conn, timeout=0.2))
+        curs = conn.cursor()
+        curs.execute("select pg_sleep(0.01)")
+
+        t0 = time.time()
+        self.assertRaises(psycopg2.extensions.QueryCanceledError,
+            curs.execute, "select pg_sleep(10)")
+        self.assert_(time.time() - t0 < 2)
+
+        conn.rollback()
+        curs.execute("select 42")
+        self.assertEqual(curs.fetchone(), (42,))
+
 def test_suite():
     return unittest.TestLoader().loadTestsFromName(__name__)
 
@@ -0,0 +1,745 @@
+#!/usr/bin/env python
+
+# test_pool.py - unit test for connection pools
+#
+# psycopg2 is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# In addition, as a special exception, the copyright holders give
+# permission to link this program with the OpenSSL library (or with
+# modified versions of OpenSSL that use the same license as OpenSSL),
+# and distribute linked combinations including the two.
+#
+# You must obey the GNU Lesser General Public License in all respects for
+# all of the code used other than OpenSSL.
+#
+# psycopg2 is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public
+# License for more details.
+
+import time
+import threading
+
+import psycopg2
+import psycopg2.pool
+from testutils import unittest
+from testconfig import dsn
+
+
+class ThreadedPoolTests(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = psycopg2.pool.ThreadedConnectionPool(1, 2, dsn,
+            stats=True)
+
+    def tearDown(self):
+        if not self.pool.closed:
+            self.pool.closeall()
+
+    def getconn_later(self, results, delay=0, **kwargs):
+        def getconn():
+            time.sleep(delay)
+            try:
+                results.append(self.pool.getconn(**kwargs))
+            except psycopg2.pool.PoolError, e:
+                results.append(e)
+
+        t = threading.Thread(target=getconn)
+        t.start()
+        return t
+
+    def test_no_wait(self):
+        self.pool.getconn()
+        self.pool.getconn()
+        t0 = time.time()
+        self.assertRaises(psycopg2.pool.PoolError, self.pool.getconn)
+        self.assert_(time.time() - t0 < 0.1)
+        self.assertEqual(self.pool.waits, 0)
+        self.assertEqual(self.pool.stats.waits, 0)
+        self.assertEqual(self.pool.stats.exhausted, 1)
+
+    def test_timeout(self):
+        self.pool.getconn()
+        self.pool.getconn()
+        t0 = time.time()
+        self.assertRaises(psycopg2.pool.PoolError,
+            self.pool.getconn, timeout=0.2)
+        self.assert_(0.2 <= time.time() - t0 < 0.5)
+        self.assertEqual(self.pool.waits, 1)
+        self.assertEqual(self.pool.wait_timeouts, 1)
+        self.assert_(self.pool.max_wait_time >= 0.2)
+        self.assertEqual(self.pool.stats.waits, 0)
+        self.assertEqual(self.pool.stats.wait_timeouts, 1)
+        self.assert_(self.pool.stats.wait_time.max >= 0.2)
+
+    def test_wait(self):
+        conn = self.pool.getconn()
+        self.pool.getconn()
+
+        results = []
+        t = self.getconn_later(results, timeout=None)
+        # the thread may start waiting a bit after it is started
+        while not self.pool._waiters:
+            time.sleep(0.01)
+        time.sleep(0.1)
+        self.assertEqual(results, [])
+
+        self.pool.putconn(conn)
+        t.join()
+        self.assertEqual(results, [conn])
+        self.assertEqual(self.pool.waits, 1)
+        self.assertEqual(self.pool.stats.waits, 1)
+        self.assert_(self.pool.stats.wait_time.total >= 0.1)
+
+    def test_wait_counters_without_stats(self):
+        pool = psycopg2.pool.ThreadedConnectionPool(1, 1, dsn)
+        try:
+            self.assert_(pool.stats is None)
+            pool.getconn()
+            self.assertRaises(psycopg2.pool.PoolError,
+                pool.getconn, timeout=0.1)
+            self.assertEqual(pool.waits, 1)
+            self.assertEqual(pool.wait_timeouts, 1)
+            self.assert_(pool.wait_time >= 0.1)
+            self.assert_(pool.max_wait_time >= 0.1)
+        finally:
+            pool.closeall()
+
+    def test_fifo(self):
+        conns = [self.pool.getconn(), self.pool.getconn()]
+
+        order = []
+        def getconn(key):
+            conn = self.pool.getconn(key=key, timeout=5)
+            order.append(key)
+            time.sleep(0.05)
+            self.pool.putconn(conn, key=key)
+
+        threads = []
+        for key in 'abcd':
+            t = threading.Thread(target=getconn, args=(key,))
+            t.start()
+            threads.append(t)
+            time.sleep(0.05)
+        self.assertEqual(len(self.pool._waiters), 4)
+
+        # a thread arriving now can't jump the queue
+        self.assertRaises(psycopg2.pool.PoolError, self.pool.getconn)
+
+        self.pool.putconn(conns[0])
+        for t in threads:
+            t.join()
+        self.assertEqual(order, list('abcd'))
+
+    def test_closeall(self):
+        self.pool.getconn()
+        self.pool.getconn()
+
+        results = []
+        t = self.getconn_later(results, timeout=None)
+        time.sleep(0.1)
+        self.pool.closeall()
+        t.join()
+        self.assert_(isinstance(results[0], psycopg2.pool.PoolError))
+
+
+class PoolHealthTests(unittest.TestCase):
+
+    def tearDown(self):
+        if not self.pool.closed:
+            self.pool.closeall()
+
+    def kill(self, conn):
+        killer = psycopg2.connect(dsn)
+        try:
+            killer.cursor().execute(
+                "select pg_terminate_backend(%s)", (conn.get_backend_pid(),))
+        finally:
+            killer.close()
+        time.sleep(0.1)
+
+    def test_config_not_passed(self):
+        self.pool = psycopg2.pool.SimpleConnectionPool(1, 1, dsn,
+            max_lifetime=10, max_idle=10, ping_idle=10)
+        self.assertEqual(self.pool.max_lifetime, 10)
+        self.assert_('max_idle' not in self.pool._kwargs)
+
+    def test_max_lifetime(self):
+        self.pool = psycopg2.pool.SimpleConnectionPool(1, 1, dsn,
+            max_lifetime=0.1)
+        conn = self.pool.getconn()
+        self.pool.putconn(conn)
+        self.assert_(self.pool.getconn() is conn)
+        time.sleep(0.2)
+
+        # expired on putconn
+        self.pool.putconn(conn)
+        self.assert_(conn.closed)
+        conn2 = self.pool.getconn()
+        self.assert_(conn2 is not conn)
+        self.pool.putconn(conn2)
+        time.sleep(0.2)
+
+        # expired in the pool
+        self.assert_(self.pool.getconn() is not conn2)
+        self.assert_(conn2.closed)
+
+    def test_closed_in_pool(self):
+        self.pool = psycopg2.pool.SimpleConnectionPool(1, 1, dsn)
+        conn = self.pool._pool[0]
+        conn.close()
+        conn2 = self.pool.getconn()
+        self.assert_(conn2 is not conn)
+        self.assert_(not conn2.closed)
+
+    def test_ping(self):
+        self.pool = psycopg2.pool.SimpleConnectionPool(1, 1, dsn,
+            ping_idle=0)
+        conn = self.pool._pool[0]
+        self.kill(conn)
+        conn2 = self.pool.getconn()
+        self.assert_(conn2 is not conn)
+        curs = conn2.cursor()
+        curs.execute("select 1")
+        self.assertEqual(curs.fetchone(), (1,))
+
+        # the ping doesn't leave the connection in a transaction
+        self.pool.putconn(conn2)
+        conn2 = self.pool.getconn()
+        self.assertEqual(conn2.get_transaction_status(),
+            psycopg2.extensions.TRANSACTION_STATUS_IDLE)
+
+    def test_ping_unlocked(self):
+        pool = [None]
+        locked = []
+
+        class PingConnection(psycopg2.extensions.connection):
+            def cursor(self, *args, **kwargs):
+                if pool[0] is not None:
+                    locked.append(pool[0]._lock.locked())
+                return super(PingConnection, self).cursor(*args, **kwargs)
+
+        self.pool = psycopg2.pool.ThreadedConnectionPool(1, 2, dsn,
+            ping_idle=0, connection_factory=PingConnection)
+        pool[0] = self.pool
+        conn = self.pool._pool[0]
+        self.kill(conn)
+        conn2 = self.pool.getconn()
+        self.assert_(conn2 is not conn)
+        self.assertEqual(locked, [False])
+        self.assert_(not self.pool._lock.locked())
+        self.assertEqual(self.pool._used.values(), [conn2])
+
+    def test_no_ping(self):
+        self.pool = psycopg2.pool.SimpleConnectionPool(1, 1, dsn,
+            ping_idle=60)
+        conn = self.pool._pool[0]
+        self.kill(conn)
+        self.assert_(self.pool.getconn() is conn)
+
+    def test_maintenance_idle(self):
+        self.pool = psycopg2.pool.ThreadedConnectionPool(2, 3, dsn,
+            max_idle=0.2, maintenance_interval=0.05)
+        conns = self.pool._pool[:]
+        time.sleep(0.5)
+        self.assertEqual(len(self.pool._pool), 2)
+        for conn in conns:
+            self.assert_(conn.closed)
+            self.assert_(conn not in self.pool._pool)
+
+    def test_maintenance_broken(self):
+        self.pool = psycopg2.pool.ThreadedConnectionPool(1, 1, dsn,
+            maintenance_interval=0.05)
+        conn = self.pool._pool[0]
+        conn.close()
+        time.sleep(0.2)
+        self.assertEqual(len(self.pool._pool), 1)
+        self.assert_(self.pool._pool[0] is not conn)
+        self.assert_(not self.pool._pool[0].closed)
+
+    def test_maintenance_respects_maxconn(self):
+        self.pool = psycopg2.pool.ThreadedConnectionPool(1, 1, dsn,
+            max_idle=0, maintenance_interval=0.05)
+        conn = self.pool.getconn()
+        time.sleep(0.2)
+        self.assertEqual(self.pool._pool, [])
+        self.pool.putconn(conn)
+        self.assertEqual(len(self.pool._pool), 1)
+
+    def test_maintenance_stops(self):
+        before = set(threading.enumerate())
+        self.pool = psycopg2.pool.ThreadedConnectionPool(1, 1, dsn,
+            maintenance_interval=0.05)
+        threads = set(threading.enumerate()) - before
+        self.assertEqual(len(threads), 1)
+        self.pool.closeall()
+        time.sleep(0.2)
+        self.assert_(not threads.pop().isAlive())
+
+
+class PoolWarmupTests(unittest.TestCase):
+
+    def test_concurrent_connect(self):
+        pool = psycopg2.pool.SimpleConnectionPool(5, 5, dsn)
+        try:
+            self.assertEqual(len(pool._pool), 5)
+            pids = set()
+            for i in range(5):
+                conn = pool.getconn()
+                self.assert_(not conn.async)
+                self.assert_(not conn.autocommit)
+                curs = conn.cursor()
+                curs.execute("select pg_backend_pid()")
+                pids.add(curs.fetchone()[0])
+                self.assertEqual(conn.get_transaction_status(),
+                    psycopg2.extensions.TRANSACTION_STATUS_INTRANS)
+                conn.rollback()
+            self.assertEqual(len(pids), 5)
+        finally:
+            pool.closeall()
+
+    def test_connect_error(self):
+        self.assertRaises(psycopg2.OperationalError,
+            psycopg2.pool.SimpleConnectionPool, 3, 3, dsn + " port=1")
+
+    def test_connect_timeout(self):
+        # a server accepting connections but never answering
+        import socket
+        sock = socket.socket()
+        try:
+            sock.bind(('127.0.0.1', 0))
+            sock.listen(5)
+            t0 = time.time()
+            self.assertRaises(psycopg2.OperationalError,
+                psycopg2.pool.SimpleConnectionPool, 3, 3,
+                "host=127.0.0.1 port=%d connect_timeout=2"
+                    % sock.getsockname()[1])
+            self.assert_(time.time() - t0 < 4)
+        finally:
+            sock.close()
+
+    def test_connect_timeout_parse(self):
+        f = psycopg2.pool._connect_timeout
+        self.assertEqual(f(dsn), None)
+        self.assertEqual(f("dbname=x connect_timeout=10"), 10)
+        self.assertEqual(f("connect_timeout = '3' dbname=x"), 3)
+        self.assertEqual(f("dbname=x connect_timeout=0"), None)
+        self.assertEqual(f("dbname=x my_connect_timeout=10"), None)
+
+    def test_green(self):
+        from psycopg2.extras import wait_select
+        psycopg2.extensions.set_wait_callback(wait_select)
+        try:
+            pool = psycopg2.pool.SimpleConnectionPool(3, 3, dsn)
+        finally:
+            psycopg2.extensions.set_wait_callback(None)
+        self.assertEqual(len(pool._pool), 3)
+        pool.closeall()
+
+    def test_maintenance_top_up(self):
+        pool = psycopg2.pool.ThreadedConnectionPool(3, 3, dsn,
+            maintenance_interval=0.05)
+        try:
+            conns = pool._pool[:]
+            for conn in conns:
+                conn.close()
+            time.sleep(0.3)
+            self.assertEqual(len(pool._pool), 3)
+            for conn in pool._pool:
+                self.assert_(conn not in conns)
+                self.assert_(not conn.closed)
+        finally:
+            pool.closeall()
+
+
+class PoolStatsTests(unittest.TestCase):
+
+    def test_disabled(self):
+        pool = psycopg2.pool.ThreadedConnectionPool(1, 2, dsn)
+        try:
+            self.assertEqual(pool.stats, None)
+            self.assertEqual(pool.get_stats(), None)
+            self.assert_('stats' not in pool._kwargs)
+            pool.putconn(pool.getconn())
+        finally:
+            pool.closeall()
+
+    def test_stats(self):
+        pool = psycopg2.pool.SimpleConnectionPool(1, 2, dsn, stats=True)
+        try:
+            c1 = pool.getconn()
+            c2 = pool.getconn()
+            self.assertRaises(psycopg2.pool.PoolError, pool.getconn)
+            time.sleep(0.05)
+            pool.putconn(c1)
+            pool.putconn(c2)
+
+            stats = pool.get_stats()
+            self.assertEqual(stats['checkouts'], 2)
+            self.assertEqual(stats['waits'], 0)
+            self.assertEqual(stats['exhausted'], 1)
+            self.assertEqual(stats['connects'], 2)
+            self.assertEqual(stats['closes'], 1)
+            self.assertEqual(stats['max_used'], 2)
+            self.assertEqual((stats['idle'], stats['used'], stats['size']),
+                (1, 0, 1))
+
+            hold = stats['hold_time']
+            self.assertEqual(hold['count'], 2)
+            self.assert_(hold['max'] >= 0.05)
+            self.assertEqual(sum([n for b, n in hold['buckets']]), 2)
+            self.assertEqual(sum([n for b, n in hold['buckets']
+                if b is not None and b < 0.05]), 0)
+            self.assertEqual(stats['wait_time']['count'], 2)
+        finally:
+            pool.closeall()
+
+    def test_callback(self):
+        events = []
+        pool = psycopg2.pool.SimpleConnectionPool(1, 1, dsn,
+            stats_callback=lambda event, value: events.append(event))
+        try:
+            pool.putconn(pool.getconn())
+            pool.putconn(pool.getconn(), close=True)
+            self.assertEqual(events, ['connect',
+                'checkout', 'checkin', 'checkout', 'checkin', 'close'])
+        finally:
+            pool.closeall()
+
+    def test_histogram(self):
+        h = psycopg2.pool.Histogram()
+        for v in (0.00005, 0.0001, 0.00015, 100):
+            h.add(v)
+        s = h.snapshot()
+        self.assertEqual(s['count'], 4)
+        self.assertEqual(s['max'], 100)
+        self.assertEqual(s['buckets'][0], (0.0001, 2))
+        self.assertEqual(s['buckets'][1], (0.0002, 1))
+        self.assertEqual(s['buckets'][-1], (None, 1))
+
+
+class PersistentPoolTests(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = psycopg2.pool.PersistentConnectionPool(1, 1, dsn)
+
+    def tearDown(self):
+        if not self.pool.closed:
+            self.pool.closeall()
+
+    def test_fast_path(self):
+        conn = self.pool.getconn()
+
+        class NoLock(object):
+            def acquire(self):
+                raise AssertionError("lock acquired")
+        lock, self.pool._lock = self.pool._lock, NoLock()
+        try:
+            self.assert_(self.pool.getconn() is conn)
+        finally:
+            self.pool._lock = lock
+
+        self.pool.putconn()
+        self.assertEqual(self.pool._used, {})
+        self.assert_(self.pool.getconn() is conn)
+
+    def test_per_thread(self):
+        self.pool = psycopg2.pool.PersistentConnectionPool(1, 2, dsn)
+        conn = self.pool.getconn()
+        results = []
+        def getconn():
+            results.append(self.pool.getconn())
+            results.append(self.pool.getconn())
+            self.pool.putconn()
+        t = threading.Thread(target=getconn)
+        t.start()
+        t.join()
+        self.assert_(results[0] is results[1])
+        self.assert_(results[0] is not conn)
+        self.assert_(self.pool.getconn() is conn)
+
+    def test_dead_thread(self):
+        results = []
+        def getconn():
+            conn = self.pool.getconn()
+            conn.cursor().execute("select 1")
+            results.append(conn)
+        t = threading.Thread(target=getconn)
+        t.start()
+        t.join()
+        del t
+        import gc
+        gc.collect()
+
+        # the pool has a single connection: it must be back
+        conn = self.pool.getconn()
+        self.assert_(conn is results[0])
+        self.assertEqual(conn.get_transaction_status(),
+            psycopg2.extensions.TRANSACTION_STATUS_IDLE)
+
+    def test_closeall(self):
+        self.pool.getconn()
+        self.pool.closeall()
+        self.assertRaises(psycopg2.pool.PoolError, self.pool.getconn)
+
+
+class SessionResetTests(unittest.TestCase):
+
+    pool = None
+
+    def tearDown(self):
+        if self.pool is not None and not self.pool.closed:
+            self.pool.closeall()
+
+    def roundtrip(self, reset, query):
+        self.pool = psycopg2.pool.SimpleConnectionPool(1, 1, dsn, reset=reset)
+        conn = self.pool.getconn()
+        curs = conn.cursor()
+        curs.execute(query)
+        conn.commit()
+        self.pool.putconn(conn)
+        self.assert_(self.pool.getconn() is conn)
+        return conn
+
+    def query(self, conn, query):
+        curs = conn.cursor()
+        curs.execute(query)
+        rv = curs.fetchall()
+        conn.rollback()
+        return rv
+
+    def test_bad_mode(self):
+        self.assertRaises(ValueError, psycopg2.pool.SimpleConnectionPool,
+            0, 1, dsn, reset='foo')
+
+    def test_track(self):
+        conn = psycopg2.connect(dsn)
+        try:
+            for query, kinds in [
+                    ("select 1", []),
+                    ("update t set x = 1", []),
+                    ("set local work_mem to '1MB'", []),
+                    ("set transaction read only", []),
+                    ("prepare transaction 'x'", []),
+                    ("SET work_mem TO '1MB'", ['guc']),
+                    ("select 1; reset work_mem", ['guc']),
+                    ("select set_config('work_mem', '1MB', false)", ['guc']),
+                    ("prepare p as select 1", ['prepared']),
+                    ("listen foo", ['listen']),
+                    ("declare c cursor with hold for select 1", ['cursor']),
+                    ("declare c cursor for select 1", []),
+                    ("create temp table t (x int)", ['temp']),
+                    ("create local temporary view v as select 1", ['temp']),
+                    ("select pg_advisory_lock(1)", ['lock']),
+                    ("/* app */ SET work_mem TO '1MB'", ['guc']),
+                    ("-- app\nprepare p as select 1", ['prepared']),
+                    ("select 1; /* a */ -- b\n /* c */ listen foo",
+                        ['listen']),
+                    ("/* set work_mem to '1MB' */ select 1", []),
+                    ("-- listen foo\nselect 1", []),
+                    ]:
+                conn._session_state.clear()
+                conn._track_session(query)
+                self.assertEqual(sorted(conn._session_state), kinds, query)
+        finally:
+            conn.close()
+
+    def test_guc(self):
+        conn = self.roundtrip('tracked', "set work_mem to '1234kB'")
+        self.assertNotEqual(self.query(conn, "show work_mem"), [('1234kB',)])
+        self.assertEqual(conn._session_state, set())
+
+    def test_set_session(self):
+        self.pool = psycopg2.pool.SimpleConnectionPool(1, 1, dsn,
+            reset='tracked')
+        conn = self.pool.getconn()
+        conn.set_session(readonly=True, autocommit=True)
+        self.pool.putconn(conn)
+        conn = self.pool.getconn()
+        self.assert_(not conn.autocommit)
+        self.assertEqual(self.query(conn,
+            "show default_transaction_read_only"), [('off',)])
+
+    def test_commented(self):
+        conn = self.roundtrip('tracked',
+            "/* app */ set work_mem to '1234kB'; "
+            "-- app\nprepare p as select 1; /* app */ listen foo")
+        self.assertNotEqual(self.query(conn, "show work_mem"), [('1234kB',)])
+        self.assertEqual(self.query(conn,
+            "select count(*) from pg_listening_channels()"), [(0,)])
+        self.assertRaises(psycopg2.DatabaseError,
+            self.query, conn, "execute p")
+
+    def test_prepared(self):
+        conn = self.roundtrip('tracked', "prepare p as select 1")
+        self.assertRaises(psycopg2.DatabaseError,
+            self.query, conn, "execute p")
+
+    def test_temp(self):
+        conn = self.roundtrip('tracked', "create temp table tmp (x int)")
+        self.assertRaises(psycopg2.ProgrammingError,
+            self.query, conn, "select * from tmp")
+
+    def test_listen(self):
+        conn = self.roundtrip('tracked', "listen foo")
+        self.assertEqual(self.query(conn,
+            "select count(*) from pg_listening_channels()"), [(0,)])
+
+    def test_advisory_lock(self):
+        conn = self.roundtrip('tracked', "select pg_advisory_lock(42)")
+        self.assertEqual(self.query(conn,
+            "select count(*) from pg_locks "
+            "where locktype = 'advisory' and pid = pg_backend_pid()"),
+            [(0,)])
+
+    def test_rollback(self):
+        self.pool = psycopg2.pool.SimpleConnectionPool(1, 1, dsn,
+            reset='tracked')
+        conn = self.pool.getconn()
+        conn.cursor().execute("select 1")
+        self.pool.putconn(conn)
+        self.assertEqual(conn.get_transaction_status(),
+            psycopg2.extensions.TRANSACTION_STATUS_IDLE)
+        self.assertEqual(conn._session_state, set())
+
+    def test_error_state(self):
+        self.pool = psycopg2.pool.SimpleConnectionPool(1, 1, dsn,
+            reset='tracked')
+        conn = self.pool.getconn()
+        curs = conn.cursor()
+        curs.execute("set work_mem to '1234kB'")
+        self.assertRaises(psycopg2.ProgrammingError,
+            curs.execute, "select * from nosuchtable")
+        self.pool.putconn(conn)
+        self.assert_(self.pool.getconn() is conn)
+        self.assertNotEqual(self.query(conn, "show work_mem"), [('1234kB',)])
+
+    def test_undetected(self):
+        query = ("do $$ begin execute 'create temp table tmp (x int)'; "
+            "end $$")
+        conn = self.roundtrip('tracked', query)
+        self.assertEqual(self.query(conn, "select * from tmp"), [])
+        self.pool.closeall()
+
+        conn = self.roundtrip('discard', query)
+        self.assertRaises(psycopg2.ProgrammingError,
+            self.query, conn, "select * from tmp")
+        self.pool.closeall()
+
+        conn = self.roundtrip('all', query)
+        self.assertRaises(psycopg2.ProgrammingError,
+            self.query, conn, "select * from tmp")
+
+    def test_setup_datestyle(self):
+        # the datestyle forced at connection is not user state, and it is
+        # forced again after the settings are reset
+        import datetime
+        for reset in ('tracked', 'all', 'discard'):
+            self.pool = psycopg2.pool.SimpleConnectionPool(1, 1,
+                dsn + " options='-c datestyle=German'", reset=reset)
+            conn = self.pool.getconn()
+            self.assertEqual(conn._session_state, set())
+            conn.cursor().execute("set work_mem to '1234kB'")
+            conn.commit()
+            self.pool.putconn(conn)
+            conn = self.pool.getconn()
+            self.assertEqual(self.query(conn, "select '2020-03-04'::date"),
+                [(datetime.date(2020, 3, 4),)])
+            self.pool.closeall()
+
+    def test_client_encoding(self):
+        for reset in ('tracked', 'all', 'discard'):
+            self.pool = psycopg2.pool.SimpleConnectionPool(1, 1, dsn,
+                reset=reset)
+            conn = self.pool.getconn()
+            encoding = conn.encoding
+            conn.set_client_encoding(
+                encoding == 'LATIN1' and 'UTF8' or 'LATIN1')
+            self.pool.putconn(conn)
+            conn = self.pool.getconn()
+            self.assertEqual(conn.encoding, encoding)
+            self.assertEqual(self.query(conn, "show client_encoding"),
+                [(conn.get_parameter_status('client_encoding'),)])
+            self.pool.closeall()
+
+
+class QueryExecutorTests(unittest.TestCase):
+
+    def setUp(self):
+        try:
+            import concurrent.futures
+        except ImportError:
+            return self.skipTest("concurrent.futures not available")
+        self.pool = psycopg2.pool.ThreadedConnectionPool(1, 4, dsn)
+        self.executor = psycopg2.pool.QueryExecutor(self.pool)
+
+    def tearDown(self):
+        if hasattr(self, 'executor'):
+            self.executor.shutdown()
+            self.pool.closeall()
+
+    def test_submit(self):
+        future = self.executor.submit("select %s, %s", (1, 'a'))
+        self.assertEqual(future.result(), [(1, 'a')])
+
+    def test_rowcount(self):
+        future = self.executor.submit(
+            "create temp table t as select generate_series(1, 3)")
+        self.assertEqual(future.result(), 3)
+
+    def test_parallel(self):
+        t0 = time.time()
+        futures = [self.executor.submit("select pg_sleep(0.2)")
+            for i in range(4)]
+        for future in futures:
+            future.result()
+        self.assert_(time.time() - t0 < 0.6)
+
+    def test_error(self):
+        future = self.executor.submit("select * from nosuchtable")
+        self.assertRaises(psycopg2.ProgrammingError, future.result)
+        conn = self.pool.getconn()
+        self.assertEqual(conn.get_transaction_status(),
+            psycopg2.extensions.TRANSACTION_STATUS_IDLE)
+        self.pool.putconn(conn)
+
+    def test_map(self):
+        rv = self.executor.map("select %s * 2", ((i,) for i in range(20)))
+        self.assertEqual([r[0][0] for r in rv], range(0, 40, 2))
+
+    def test_back_pressure(self):
+        executor = psycopg2.pool.QueryExecutor(self.pool, max_workers=1,
+            max_pending=2)
+        try:
+            submitted = []
+            def submit():
+                for i in range(3):
+                    submitted.append(executor.submit("select pg_sleep(0.2)"))
+            t = threading.Thread(target=submit)
+            t.start()
+            time.sleep(0.1)
+            self.assertEqual(len(submitted), 2)
+            t.join()
+            self.assertEqual(len(submitted), 3)
+        finally:
+            executor.shutdown()
+
+    def test_cursor_factory(self):
+        import psycopg2.extras
+        executor = psycopg2.pool.QueryExecutor(self.pool,
+            cursor_factory=psycopg2.extras.RealDictCursor)
+        try:
+            self.assertEqual(executor.submit("select 1 as x").result(),
+                [{'x': 1}])
+        finally:
+            executor.shutdown()
+
+
+def test_suite():
+    return unittest.TestLoader().loadTestsFromName(__name__)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -245,6 +245,112 @@ class QueryCancellationTests(unittest.TestCase):
                           curs.execute, 'SELECT pg_sleep(50)')
 
 
+class PiggybackBeginTests(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = psycopg2.connect(dsn)
+        curs = self.conn.cursor()
+        curs.execute('CREATE TEMPORARY TABLE table1 (id int PRIMARY KEY)')
+        self.conn.commit()
+
+        self.conn.piggyback_begin = True
+        self.commands = []
+        execute_command = self.conn._execute_command
+        def _execute_command(command):
+            self.commands.append(command)
+            return execute_command(command)
+        self.conn._execute_command = _execute_command
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test_begin(self):
+        curs = self.conn.cursor()
+        curs.execute('INSERT INTO table1 VALUES (%s)', (1,))
+        self.assertEqual(self.commands, [])
+        self.assertEqual(curs.query, 'INSERT INTO table1 VALUES (1)')
+        self.assertEqual(curs.rowcount, 1)
+        self.assertEqual(self.conn.status, STATUS_BEGIN)
+        self.assertEqual(self.conn.get_transaction_status(),
+            psycopg2.extensions.TRANSACTION_STATUS_INTRANS)
+
+        curs.execute('SELECT id FROM table1')
+        self.assertEqual(curs.fetchall(), [(1,)])
+        self.conn.rollback()
+        self.assertEqual(self.conn.status, STATUS_READY)
+
+        curs.execute('SELECT count(*) FROM table1')
+        self.assertEqual(curs.fetchone(), (0,))
+        self.assertEqual(self.commands, ['ROLLBACK'])
+
+    def test_named_cursor(self):
+        curs = self.conn.cursor('named')
+        curs.execute('SELECT generate_series(1, 3)')
+        self.assertEqual(curs.fetchall(), [(1,), (2,), (3,)])
+        self.assertEqual(self.commands, [])
+
+    def test_runtime_error(self):
+        curs = self.conn.cursor()
+        self.assertRaises(psycopg2.DataError, curs.execute, 'SELECT 1/0')
+        self.assertEqual(self.commands, [])
+        self.assertEqual(self.conn.status, STATUS_BEGIN)
+        self.assertEqual(self.conn.get_transaction_status(),
+            psycopg2.extensions.TRANSACTION_STATUS_INERROR)
+
+    def test_syntax_error(self):
+        curs = self.conn.cursor()
+        self.assertRaises(psycopg2.ProgrammingError, curs.execute, 'SELEC 1')
+        self.assertEqual(self.commands, ['BEGIN'])
+        self.assertEqual(self.conn.status, STATUS_BEGIN)
+        self.assertEqual(self.conn.get_transaction_status(),
+            psycopg2.extensions.TRANSACTION_STATUS_INERROR)
+        self.assertRaises(psycopg2.InternalError, curs.execute, 'SELECT 1')
+        self.conn.rollback()
+        curs.execute('SELECT 1')
+        self.assertEqual(curs.fetchone(), (1,))
+
+    def test_error_after_commit(self):
+        # the error is not a syntax error: don't execute the query again
+        curs = self.conn.cursor()
+        self.assertRaises(psycopg2.DataError, curs.execute,
+            'INSERT INTO table1 VALUES (1); COMMIT; SELECT 1/0')
+        self.conn.rollback()
+        curs.execute('SELECT count(*) FROM table1')
+        self.assertEqual(curs.fetchone(), (1,))
+
+    def test_runtime_syntax_error_after_commit(self):
+        curs = self.conn.cursor()
+        self.assertRaises(psycopg2.ProgrammingError, curs.execute,
+            "INSERT INTO table1 VALUES (1); COMMIT; "
+            "DO $$ BEGIN EXECUTE 'SELEC 1'; END $$")
+        self.conn.rollback()
+        curs.execute('SELECT count(*) FROM table1')
+        self.assertEqual(curs.fetchone(), (1,))
+
+    def test_begin_query(self):
+        curs = self.conn.cursor()
+        curs.execute('begin')
+        self.assertEqual(curs.statusmessage, 'BEGIN')
+        self.assertEqual(self.conn.get_transaction_status(),
+            psycopg2.extensions.TRANSACTION_STATUS_INTRANS)
+
+    def test_empty_query(self):
+        curs = self.conn.cursor()
+        for query in ['', ' ', ';', '-- nothing', '/* start */ -- x',
+                '-- begin']:
+            self.assertRaises(psycopg2.ProgrammingError, curs.execute, query)
+            self.assertEqual(self.conn.get_transaction_status(),
+                psycopg2.extensions.TRANSACTION_STATUS_INTRANS)
+            self.conn.rollback()
+
+    def test_autocommit(self):
+        self.conn.autocommit = True
+        curs = self.conn.cursor()
+        curs.execute('SELECT 1')
+        self.assertEqual(self.conn.get_transaction_status(),
+            psycopg2.extensions.TRANSACTION_STATUS_IDLE)
+
+
 def test_suite():
     return unittest.TestLoader().loadTestsFromName(__name__)
 
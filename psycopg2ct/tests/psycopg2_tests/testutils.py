@@ -153,6 +153,20 @@ def skip_if_no_iobase(f):
     return skip_if_no_iobase_
 
 
+def skip_if_no_trollius(f):
+    """Skip a test if the asyncio port trollius is not available."""
+    def skip_if_no_trollius_(self):
+        try:
+            import trollius
+        except ImportError:
+            return self.skipTest("trollius not available")
+        else:
+            return f(self)
+
+    skip_if_no_trollius_.__name__ = f.__name__
+    return skip_if_no_trollius_
+
+
 def skip_before_postgres(*ver):
     """Skip a test on PostgreSQL before a certain version."""
     ver = ver + (0,) * (3 - len(ver))